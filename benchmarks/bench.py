@@ -0,0 +1,273 @@
+"""
+Benchmarks of the coordinate lookups, the parsing of the NetCDF files and
+the download of the data, to compare the performance between commits.
+
+Files are generated by `cds_weather.synthetic` and the downloads use a
+fake client that writes synthetic files instead of requesting the API,
+so the benchmarks run offline, without credentials. Results are stored
+as JSON, by default at `benchmarks/results/<commit>.json`, usage:
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --select parse --repeat 10
+    python benchmarks/bench.py --compare benchmarks/results/ab49f9b.json
+
+Cases
+-----
+
+lookup : `from_geocode()`, `from_geocodes()`, `do_area_many()` and
+         `regions.bounding_boxes()` for 1, 100 and all municipalities.
+
+parse  : `to_dataframe()` of files from 1 day to 2 years of a city,
+         `to_dataframe_batch()` of a region of a state, both also for
+         GRIB files, `to_dataframe_many()` of many files of a year and
+         `to_dataframe()` of a month from the `archive` of a region.
+
+e2e    : `download()` and `download_batch()` with a fake client,
+         followed by `to_dataframe()` and `to_dataframe_batch()`.
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cds_weather import (  # noqa: E402
+    archive,
+    connection,
+    extract_latlons,
+    extract_reanalysis,
+    regions,
+    synthetic,
+)
+from cds_weather.extract_coordinates import do_area_many  # noqa: E402
+
+RESULTS_DIR = Path(__file__).parent / "results"
+CASES = ["lookup", "parse", "e2e"]
+REPEAT = 5
+
+# Rio de Janeiro
+GEOCODE = 3304557
+UF = 33
+# files parsed by `to_dataframe_many()`
+MANY_FILES = 8
+SPANS = {
+    "1d": ("2022-01-01", "2022-01-01"),
+    "1m": ("2022-01-01", "2022-01-31"),
+    "1y": ("2022-01-01", "2022-12-31"),
+    "2y": ("2021-01-01", "2022-12-31"),
+}
+
+
+class FakeClient:
+    """
+    Client of the API that writes synthetic files, with the
+    `retrieve(dataset, request, target)` method of `cdsapi.Client`.
+    """
+
+    def retrieve(self, dataset: str, request: dict, target: str):
+        synthetic.write_request(request, target)
+
+
+def _timeit(func, repeat: int, setup=None) -> dict:
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return dict(
+        min=min(times),
+        median=statistics.median(times),
+        mean=statistics.mean(times),
+        repeat=repeat,
+    )
+
+
+def bench_lookup(repeat: int, tmp: Path) -> dict:
+    extract_latlons.table()
+    everything = extract_latlons.geocodes()
+    sizes = {"1": everything[:1], "100": everything[:100], "all": everything}
+
+    results = dict()
+    for name, geocodes in sizes.items():
+        results[f"from_geocode[{name}]"] = _timeit(
+            lambda: [extract_latlons.from_geocode(g) for g in geocodes], repeat
+        )
+        results[f"from_geocodes[{name}]"] = _timeit(
+            lambda: extract_latlons.from_geocodes(geocodes), repeat
+        )
+        lats, lons = extract_latlons.from_geocodes(geocodes)
+        results[f"do_area_many[{name}]"] = _timeit(
+            lambda: do_area_many(lats, lons), repeat
+        )
+        results[f"bounding_boxes[{name}]"] = _timeit(
+            lambda: regions.bounding_boxes(geocodes), repeat
+        )
+    return results
+
+
+def bench_parse(repeat: int, tmp: Path) -> dict:
+    lat, lon = extract_latlons.from_geocode(GEOCODE)
+    north, south, east, west = extract_reanalysis.do_area(lat, lon)
+
+    results = dict()
+    for name, (start, end) in SPANS.items():
+        file = synthetic.write(
+            tmp / f"{GEOCODE}_{name}.nc", [north, west, south, east], start, end
+        )
+        results[f"to_dataframe[{name}]"] = _timeit(
+            lambda: extract_reanalysis.to_dataframe(file, GEOCODE), repeat
+        )
+
+    start, end = SPANS["1y"]
+    file = synthetic.write(
+        tmp / f"{GEOCODE}_1y.grib",
+        [north, west, south, east],
+        start,
+        end,
+        format="grib",
+    )
+    results["to_dataframe[grib-1y]"] = _timeit(
+        lambda: extract_reanalysis.to_dataframe(file, GEOCODE), repeat
+    )
+
+    start, end = SPANS["1m"]
+    (area, geocodes), *_ = regions.bounding_boxes(regions.select(UF))
+    for name, format in [("REGION.nc", "netcdf"), ("REGION.grib", "grib")]:
+        file = synthetic.write(tmp / name, area, start, end, format=format)
+        case = "uf-1m" if format == "netcdf" else "uf-1m-grib"
+        results[f"to_dataframe_batch[{case}]"] = _timeit(
+            lambda: extract_reanalysis.to_dataframe_batch({file: geocodes}), repeat
+        )
+
+    start, end = SPANS["1y"]
+    area = [north, west, south, east]
+    files = {
+        synthetic.write(tmp / f"many_{i}.nc", area, start, end, seed=i): [GEOCODE]
+        for i in range(MANY_FILES)
+    }
+    results[f"to_dataframe_many[{MANY_FILES}x1y]"] = _timeit(
+        lambda: extract_reanalysis.to_dataframe_many(files), repeat
+    )
+
+    # a month of a city, from a year of a region in the archive
+    (area, geocodes), *_ = regions.bounding_boxes(regions.select(UF))
+    file = synthetic.write(tmp / "REGION_1y.nc", area, start, end)
+    for case, compress in [("archive", True), ("archive-mmap", False)]:
+        root = tmp / case
+        archive.add(file, root=root, compress=compress)
+        results[f"to_dataframe[{case}-1m]"] = _timeit(
+            lambda: extract_reanalysis.to_dataframe(
+                root, geocodes[0], past_date="2022-06-01", date="2022-06-30"
+            ),
+            repeat,
+        )
+    return results
+
+
+def bench_e2e(repeat: int, tmp: Path) -> dict:
+    # the clients of the pool of `connection` are fake ones
+    connection.reset()
+    connection._validated = True
+    new_client, connection._new_client = connection._new_client, FakeClient
+    data_dir = tmp / "e2e"
+
+    def clean():
+        for file in data_dir.glob("*"):
+            file.unlink()
+
+    def single(start, end):
+        file = extract_reanalysis.download(
+            GEOCODE, start, end, data_dir=data_dir, use_cache=False
+        )
+        extract_reanalysis.to_dataframe(file, GEOCODE)
+
+    def batch(start, end):
+        files = extract_reanalysis.download_batch(
+            UF, start, end, data_dir=data_dir, use_cache=False
+        )
+        extract_reanalysis.to_dataframe_batch(files)
+
+    results = dict()
+    for name in ["1m", "1y"]:
+        start, end = SPANS[name]
+        results[f"download[{name}]"] = _timeit(
+            lambda: single(start, end), repeat, clean
+        )
+    start, end = SPANS["1m"]
+    results["download_batch[uf-1m]"] = _timeit(lambda: batch(start, end), repeat, clean)
+    connection._new_client = new_client
+    connection.reset()
+    return results
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _compare(results: dict, file: str):
+    with open(file) as f:
+        baseline = json.load(f)
+    print(f"\n{'case':<36}{baseline['commit']:>12}{results['commit']:>12}{'ratio':>8}")
+    for case, new in results["results"].items():
+        old = baseline["results"].get(case)
+        if old is None:
+            continue
+        ratio = new["median"] / old["median"]
+        print(f"{case:<36}{old['median']:>12.4f}{new['median']:>12.4f}{ratio:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--select", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--output", help="JSON file of the results.")
+    parser.add_argument("--compare", help="JSON file of a previous run.")
+    args = parser.parse_args(argv)
+
+    commit = _commit()
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp:
+        for case in args.select:
+            bench = globals()[f"bench_{case}"]
+            for name, timing in bench(args.repeat, Path(tmp)).items():
+                results[f"{case}.{name}"] = timing
+                print(f"{case + '.' + name:<36}{timing['median']:>12.4f}s")
+
+    results = dict(
+        commit=commit,
+        date=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        results=results,
+    )
+    output = Path(args.output or RESULTS_DIR / f"{commit}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results stored at {output}")
+
+    if args.compare:
+        _compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Checks the import time of the package against a budget.
+
+Heavy dependencies (pandas, xarray, cdsapi, eccodes, scipy, pyarrow and
+MetPy) are imported by the functions that use them, and data files are
+only read on the first lookup, so importing the modules used by the CLI
+and by worker processes stays fast. Each module is imported in a new
+interpreter and the check fails if the import takes longer than the
+budget or loads any of the heavy dependencies. The test suite only
+checks the dependencies, in `tests/test_import_time.py`. Usage:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget 0.5
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# modules imported by the CLI and worker processes
+MODULES = [
+    "cds_weather",
+    "cds_weather.archive",
+    "cds_weather.cli",
+    "cds_weather.connection",
+    "cds_weather.executor",
+    "cds_weather.extract_reanalysis",
+    "cds_weather.grib",
+    "cds_weather.incremental",
+    "cds_weather.loader",
+    "cds_weather.metrics",
+    "cds_weather.planner",
+    "cds_weather.regions",
+]
+HEAVY = ["pandas", "xarray", "cdsapi", "eccodes", "scipy", "pyarrow", "metpy", "pint"]
+
+# seconds to import each module, the best of `REPEAT` runs
+BUDGET = 0.3
+REPEAT = 5
+
+_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps(dict(seconds=seconds, modules=sorted(sys.modules))))
+"""
+
+
+def measure(module: str, repeat: int = REPEAT) -> dict:
+    """
+    Imports the module in `repeat` new interpreters.
+
+    Returns:
+        dict with the best `seconds` and the `heavy` modules loaded.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _SCRIPT.format(module=module)],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+
+    loaded = {name.split(".")[0] for name in runs[0]["modules"]}
+    return dict(
+        seconds=min(run["seconds"] for run in runs),
+        heavy=[name for name in HEAVY if name in loaded],
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget", type=float, default=BUDGET)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in MODULES:
+        result = measure(module, args.repeat)
+        errors = []
+        if result["seconds"] > args.budget:
+            errors.append(f"over the budget of {args.budget}s")
+        if result["heavy"]:
+            errors.append(f"imports {', '.join(result['heavy'])}")
+        failed |= bool(errors)
+        status = "; ".join(errors) or "ok"
+        print(f"{module:<36}{result['seconds']:>8.3f}s  {status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
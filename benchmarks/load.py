@@ -0,0 +1,224 @@
+"""
+Load test of the downloads against a local mock of the Copernicus API.
+
+Starts the server of `cds_weather.mock_cds` and points the shared clients
+of `connection` at it, with the `CDSAPI_URL` and `CDSAPI_KEY` environment
+variables, so a batch of `download()` calls runs through the real
+`connect()`, `cdsapi.Client` and `executor` without credentials nor
+quota. Each download is a different city and the batch is sent by a pool
+of threads, once for each number of workers, reporting the requests per
+second, the percentiles of the end-to-end latency of each `download()`,
+the bytes per second and the failures simulated by the server, usage:
+
+    python benchmarks/load.py
+    python benchmarks/load.py --requests 64 --workers 1 4 16 --queue-delay 2
+    python benchmarks/load.py --error-rate 0.05 --drop-rate 0.05 --bandwidth 1e6
+    python benchmarks/load.py --span 1d --requests 2 --workers 2 --strict
+
+The clients wait `--sleep-max` seconds between retries, instead of the
+two minutes of `cdsapi`, and failed downloads are retried after
+`--backoff` seconds, so failure modes can be tested in a short run.
+With `--strict`, the exit status is 1 if any download failed.
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cds_weather import (  # noqa: E402
+    connection,
+    executor,
+    extract_latlons,
+    extract_reanalysis,
+    metrics,
+    mock_cds,
+)
+
+REQUESTS = 16
+WORKERS = [1, 2, 4, 8]
+# `past_date` and `date` of `download()`, a single day without `past_date`
+SPANS = {
+    "1d": (None, "2022-01-01"),
+    "1m": ("2022-01-01", "2022-01-31"),
+    "1y": ("2022-01-01", "2022-12-31"),
+}
+PERCENTILES = [50, 90, 99]
+# seconds between the retries of the clients and of the executor
+SLEEP_MAX = 1.0
+BACKOFF = 1.0
+# server counters shown in the report
+COUNTERS = ["submit", "rate_limited", "errors", "dropped", "failed"]
+
+
+def _point(server, sleep_max: float):
+    os.environ["CDSAPI_URL"] = server.url
+    os.environ["CDSAPI_KEY"] = mock_cds.KEY
+    connection.CLIENT_OPTIONS = dict(
+        sleep_max=sleep_max, retry_max=20, quiet=True, progress=False
+    )
+    connection.reset()
+
+
+def run(
+    requests: int,
+    workers: int,
+    span: str,
+    data_dir: Path,
+    sleep_max: float = SLEEP_MAX,
+    **options,
+) -> dict:
+    """
+    Downloads `requests` cities with `workers` threads from a new mock
+    server, started with the `options` of `mock_cds.start()`.
+
+    Returns:
+        A dict with the counts of `ok` and `failed` downloads, the
+        `seconds` of the batch, `requests_per_second`, the `latency`
+        percentiles, `bytes_per_second`, the median `queued` seconds and
+        the counters of the server.
+    """
+    start_date, end_date = SPANS[span]
+    geocodes = extract_latlons.geocodes()[:requests]
+    data_dir.mkdir(parents=True, exist_ok=True)
+    events = []
+    hook = events.append
+
+    def download(geocode):
+        begin = time.perf_counter()
+        file = extract_reanalysis.download(
+            geocode, start_date, end_date, data_dir=data_dir, use_cache=False
+        )
+        return time.perf_counter() - begin, file
+
+    server = mock_cds.start(**options)
+    metrics.add_hook(hook)
+    try:
+        _point(server, sleep_max)
+        connection.connect(interactive=False)
+        # the client of the status check sets the `cdsapi` logger to INFO
+        logging.getLogger("cdsapi").setLevel(logging.getLogger().level)
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(download, geocodes))
+        seconds = time.perf_counter() - begin
+    finally:
+        metrics.remove_hook(hook)
+        # results still referenced delete their jobs when collected
+        gc.collect()
+        server.stop()
+        connection.reset()
+
+    latencies = [latency for latency, file in results if file]
+    size = sum(os.path.getsize(file) for _, file in results if file)
+    queued = [e["queued"] for e in events if e["stage"] == "download" and "queued" in e]
+    latency = dict()
+    if latencies:
+        values = np.percentile(latencies, PERCENTILES)
+        latency = {f"p{p}": float(v) for p, v in zip(PERCENTILES, values)}
+        latency["max"] = max(latencies)
+    return dict(
+        workers=workers,
+        ok=len(latencies),
+        failed=len(results) - len(latencies),
+        seconds=seconds,
+        requests_per_second=len(latencies) / seconds,
+        latency=latency,
+        bytes_per_second=size / seconds,
+        queued=float(np.median(queued)) if queued else None,
+        server={name: server.stats.get(name, 0) for name in COUNTERS},
+    )
+
+
+def _report(result: dict):
+    latency = result["latency"]
+    columns = [f"{latency.get(f'p{p}', float('nan')):>8.2f}" for p in PERCENTILES]
+    print(
+        f"{result['workers']:>8}{result['ok']:>6}{result['failed']:>8}"
+        f"{result['requests_per_second']:>10.2f}{''.join(columns)}"
+        f"{result['bytes_per_second'] / 1e6:>10.2f}  "
+        + " ".join(f"{k}={v}" for k, v in result["server"].items() if v),
+        flush=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--workers", type=int, nargs="+", default=WORKERS)
+    parser.add_argument("--span", choices=SPANS, default="1m")
+    parser.add_argument("--sleep-max", type=float, default=SLEEP_MAX)
+    parser.add_argument("--backoff", type=float, default=BACKOFF)
+    parser.add_argument("--queue-delay", type=float, default=0.5)
+    parser.add_argument("--run-time", type=float, default=0.5)
+    parser.add_argument("--max-running", type=int, default=4)
+    parser.add_argument("--rate-limit", type=float)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, help="Bytes per second.")
+    parser.add_argument("--output", help="JSON file of the results.")
+    parser.add_argument(
+        "--strict", action="store_true", help="Exit with 1 if a download failed."
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.CRITICAL,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    executor.BACKOFF = args.backoff
+    options = dict(
+        queue_delay=args.queue_delay,
+        run_time=args.run_time,
+        max_running=args.max_running,
+        rate_limit=args.rate_limit,
+        failure_rate=args.failure_rate,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        bandwidth=args.bandwidth,
+    )
+    print(f"{args.requests} requests of {args.span}, server {options}")
+    percentiles = "".join(f"{f'p{p} s':>8}" for p in PERCENTILES)
+    print(f"{'workers':>8}{'ok':>6}{'failed':>8}{'req/s':>10}{percentiles}{'MB/s':>10}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in args.workers:
+            result = run(
+                args.requests,
+                workers,
+                args.span,
+                Path(tmp) / f"workers_{workers}",
+                sleep_max=args.sleep_max,
+                **options,
+            )
+            _report(result)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                dict(options=options, span=args.span, results=results), f, indent=1
+            )
+        print(f"Results stored at {args.output}")
+
+    if args.strict and any(result["failed"] for result in results):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""
+Compact archive of the downloaded reanalysis data.
+
+Files downloaded by `download()` and `download_batch()` are kept as the
+API returned them, one file per geocode or region and date range. The
+archive merges them into a single store per region grid, so years of
+backfill use less disk and any range can be read without opening the
+original files. Each store is a directory `ARCHIVE_DIR/N_W_S_E/` with:
+
+    meta.json             : grid, variables and the encoding of each chunk.
+    time-YYYY-MM.V.npy    : times of a chunk.
+    values-YYYY-MM.V.zlib : values of a chunk, compressed (`compress=True`).
+    values-YYYY-MM.V.npy  : values of a chunk, uncompressed.
+
+Chunks hold a calendar month of the (variable, time, latitude, longitude)
+values, packed as int16 with a scale and offset per chunk and variable,
+-32767 being the missing value. A date range only reads the months it
+covers. Compressed chunks are shuffled by byte, the low bytes of the
+values followed by their slowly varying high bytes, and compressed with
+zlib. Uncompressed chunks are memory-mapped on read, so only the pages
+of the requested points are read from disk.
+
+Adding a file that overlaps the times already stored replaces them. The
+chunks changed are written as a new version `V`, next to the current
+one, and `meta.json` is replaced last, so a store interrupted halfway
+still describes the chunks it had. The files of the previous versions
+are removed once `meta.json` points to the new ones.
+
+Methods
+-------
+
+add(files, root)                 : Merges downloaded NetCDF or GRIB files
+                                   into the stores of their grids.
+
+stores(root)                     : Metadata of the stores of an archive.
+
+dataset(geocode, start, end, root) : Reads the four points of the cell of
+                                     a geocode as an xarray Dataset, as
+                                     the files of `download()`.
+
+is_archive(path)                 : Whether a path is the root of an archive.
+"""
+
+import io
+import os
+import json
+import zlib
+import logging
+import threading
+import numpy as np
+
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from cds_weather import globals, grib, metrics, spatial
+
+ARCHIVE_DIR = globals.DATA_DIR / "archive"
+VARIABLES = ["t2m", "tp", "msl", "d2m"]
+# higher levels take twice as long to compress for a few percent
+COMPRESSION_LEVEL = 3
+META_FILE = "meta.json"
+
+_FILL = -32767
+_lock = threading.RLock()
+# tolerance of the float32 coordinates of the files
+_EPS = 1e-4
+
+
+def _root(root: Optional[Union[str, Path]] = None) -> Path:
+    return Path(root or ARCHIVE_DIR)
+
+
+def is_archive(path) -> bool:
+    """
+    Returns True if the path is a directory with stores of an archive.
+    """
+    path = Path(str(path))
+    return path.is_dir() and any((p / META_FILE).exists() for p in path.iterdir())
+
+
+def stores(root: Optional[str] = None) -> dict:
+    """
+    Returns the metadata of every store in the archive, by store name.
+    """
+    root = _root(root)
+    result = dict()
+    if not root.is_dir():
+        return result
+    for store in sorted(root.iterdir()):
+        meta = _read_meta(store)
+        if meta:
+            result[store.name] = meta
+    return result
+
+
+def _read_meta(store: Path) -> Optional[dict]:
+    try:
+        with open(store / META_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(store: Path, meta: dict):
+    path = store / META_FILE
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+
+
+def _save(path: Path, data: bytes):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _read_file(file: str) -> tuple:
+    """
+    Reads a downloaded file. Returns the latitudes, longitudes, times and
+    a float32 array of the values with shape (variable, time, lat, lon).
+    """
+    if grib.is_grib(file):
+        steps, lats, lons = dict(), None, None
+        for variable, time, lats, lons, values in grib.messages(file):
+            steps.setdefault(time, dict())[variable] = values
+        times = np.array(sorted(steps), dtype="datetime64[ns]")
+        values = np.full(
+            (len(VARIABLES), len(times), len(lats), len(lons)), np.nan, np.float32
+        )
+        for i, time in enumerate(times):
+            for v, variable in enumerate(VARIABLES):
+                if variable in steps[time]:
+                    values[v, i] = steps[time][variable]
+        return lats, lons, times, values
+
+    import xarray as xr
+
+    with xr.open_dataset(file, engine="netcdf4") as ds:
+        ds = ds[VARIABLES].transpose("time", "latitude", "longitude").load()
+        values = np.stack([ds[v].values.astype(np.float32) for v in VARIABLES])
+        times = ds.time.values.astype("datetime64[ns]")
+        return ds.latitude.values, ds.longitude.values, times, values
+
+
+def _store_name(lats, lons) -> str:
+    area = [lats.max(), lons.min(), lats.min(), lons.max()]
+    return "_".join(f"{float(c):g}" for c in area)
+
+
+def _encode(values: np.ndarray) -> tuple:
+    """
+    Packs the values of a chunk as int16, with a scale and offset for
+    each variable. Returns the packed array, the scales and the offsets.
+    """
+    packed = np.empty(values.shape, dtype=np.int16)
+    scales, offsets = [], []
+    for v, variable in enumerate(values):
+        valid = ~np.isnan(variable)
+        low = float(variable[valid].min()) if valid.any() else 0.0
+        high = float(variable[valid].max()) if valid.any() else 0.0
+        # values in [-32766, 32766], -32767 is the missing value
+        scale = (high - low) / (2**16 - 4) or 1.0
+        offset = (high + low) / 2
+        packed[v] = np.where(valid, np.round((variable - offset) / scale), _FILL)
+        scales.append(scale)
+        offsets.append(offset)
+    return packed, scales, offsets
+
+
+def _decode(packed: np.ndarray, scales: list, offsets: list) -> np.ndarray:
+    shape = (-1,) + (1,) * (packed.ndim - 1)
+    values = packed * np.array(scales).reshape(shape) + np.array(offsets).reshape(shape)
+    values[packed == _FILL] = np.nan
+    return values.astype(np.float32)
+
+
+def _chunk_files(month: str, chunk: dict) -> tuple:
+    """
+    Names of the times and values files of a version of a chunk.
+    """
+    version = chunk["version"]
+    extension = "zlib" if chunk["compressed"] else "npy"
+    return f"time-{month}.{version}.npy", f"values-{month}.{version}.{extension}"
+
+
+def _write_chunk(
+    store: Path, month: str, version: int, times, values, compress: bool
+) -> dict:
+    packed, scales, offsets = _encode(values)
+    chunk = dict(
+        version=version,
+        shape=list(packed.shape),
+        scale=scales,
+        offset=offsets,
+        compressed=compress,
+        start=str(times[0].astype("datetime64[s]")),
+        end=str(times[-1].astype("datetime64[s]")),
+    )
+    time_file, values_file = _chunk_files(month, chunk)
+    _save(store / time_file, _npy(times.astype("datetime64[s]")))
+    if compress:
+        # low and high bytes apart, the high ones vary slowly and compress well
+        shuffled = packed.view(np.uint8).reshape(-1, 2).T.tobytes()
+        _save(store / values_file, zlib.compress(shuffled, COMPRESSION_LEVEL))
+    else:
+        _save(store / values_file, _npy(packed))
+    return chunk
+
+
+def _npy(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def _read_chunk(store: Path, month: str, chunk: dict, mmap: bool = True) -> tuple:
+    """
+    Returns the times of a chunk and its packed values, memory-mapped if
+    the chunk is uncompressed and `mmap` is True.
+    """
+    time_file, values_file = _chunk_files(month, chunk)
+    times = np.load(store / time_file).astype("datetime64[ns]")
+    if not chunk["compressed"]:
+        packed = np.load(store / values_file, mmap_mode="r" if mmap else None)
+        return times, packed
+
+    with open(store / values_file, "rb") as f:
+        shuffled = np.frombuffer(zlib.decompress(f.read()), dtype=np.uint8)
+    packed = shuffled.reshape(2, -1).T.copy().view(np.int16)
+    return times, packed.reshape(chunk["shape"])
+
+
+def _merge(store: Path, meta: dict, times, values, compress: bool) -> tuple:
+    """
+    Writes the times and values into new versions of the monthly chunks
+    of a store, replacing the times already stored, and updates `meta`.
+    Returns the chunks written and the files of their previous versions,
+    to be removed once the new `meta` is written.
+    """
+    months = times.astype("datetime64[M]")
+    written, stale = 0, []
+    for month in np.unique(months):
+        name = str(month)
+        in_month = months == month
+        new_times, new_values = times[in_month], values[:, in_month]
+
+        chunk = meta["chunks"].get(name)
+        version = 0
+        if chunk is not None:
+            version = chunk["version"] + 1
+            stale.extend(_chunk_files(name, chunk))
+            old_times, packed = _read_chunk(store, name, chunk, mmap=False)
+            keep = ~np.isin(old_times, new_times)
+            old_values = _decode(packed[:, keep], chunk["scale"], chunk["offset"])
+            new_times = np.concatenate([old_times[keep], new_times])
+            new_values = np.concatenate([old_values, new_values], axis=1)
+            order = np.argsort(new_times, kind="stable")
+            new_times, new_values = new_times[order], new_values[:, order]
+
+        meta["chunks"][name] = _write_chunk(
+            store, name, version, new_times, new_values, compress
+        )
+        written += 1
+    return written, stale
+
+
+def add(
+    files: Union[str, Iterable[str], dict],
+    root: Optional[str] = None,
+    compress: bool = True,
+    remove: bool = False,
+) -> dict:
+    """
+    Merges downloaded files into the archive, usage:
+
+    add(download_batch(geocodes=33, past_date='2022-01-01', date='2022-12-31'))
+    add(Path("data").glob("*.nc"), compress=False)
+
+    Attrs:
+        files (str, iterable or dict): NetCDF or GRIB files, as returned by
+                                       `download()` or `download_batch()`.
+        root (opt(str)): Directory of the archive, `ARCHIVE_DIR` by default.
+        compress (bool): If True, chunks are compressed with zlib. Otherwise
+                         they are stored as .npy files, memory-mapped on read.
+        remove (bool): If True, each file is removed once archived.
+
+    Returns:
+        A dict mapping each file to the store it was merged into.
+    """
+    root = _root(root)
+    if isinstance(files, (str, Path)):
+        files = [files]
+
+    result = dict()
+    for file in files:
+        with metrics.timer("archive.add", file=str(file)) as m:
+            lats, lons, times, values = _read_file(str(file))
+            store = root / _store_name(lats, lons)
+            with _lock:
+                store.mkdir(parents=True, exist_ok=True)
+                meta = _read_meta(store) or dict(
+                    latitude=[float(lat) for lat in lats],
+                    longitude=[float(lon) for lon in lons],
+                    variables=VARIABLES,
+                    chunks=dict(),
+                )
+                m["chunks"], stale = _merge(store, meta, times, values, compress)
+                # the new chunks are only in use once meta.json points to them
+                _write_meta(store, meta)
+                for name in stale:
+                    (store / name).unlink(missing_ok=True)
+        logging.info(f"{file} archived at {store}.")
+        result[str(file)] = str(store)
+        if remove:
+            os.remove(file)
+    return result
+
+
+def _contains(meta: dict, area: tuple) -> Optional[tuple]:
+    """
+    Rows and columns of the points (north, south) x (west, east) of a cell
+    in the grid of a store, or None if they aren't all in the grid.
+    """
+    north, south, east, west = area
+    lats, lons = np.array(meta["latitude"]), np.array(meta["longitude"])
+    rows = [np.abs(lats - lat).argmin() for lat in (north, south)]
+    cols = [np.abs(lons - lon).argmin() for lon in (west, east)]
+    if np.abs(lats[rows] - [north, south]).max() > _EPS:
+        return None
+    if np.abs(lons[cols] - [west, east]).max() > _EPS:
+        return None
+    return rows, cols
+
+
+def dataset(
+    geocode: Union[int, str],
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    root: Optional[str] = None,
+    mmap: bool = True,
+):
+    """
+    Reads the data of the `do_area` cell of a geocode from every store
+    containing it, in the layout of the files of `download()`.
+
+    Attrs:
+        geocode (int or str): Geocode of the city.
+        start (opt(str)): First day, 'YYYY-MM-DD'. All days by default.
+        end (opt(str)): Last day, 'YYYY-MM-DD'. All days by default.
+        root (opt(str)): Directory of the archive, `ARCHIVE_DIR` by default.
+        mmap (bool): Memory-map the uncompressed chunks.
+
+    Returns:
+        xr.Dataset with the `t2m`, `tp`, `msl` and `d2m` variables of the
+        four points of the cell, with `time`, `latitude` and `longitude`
+        dimensions.
+
+    Raises:
+        ValueError : If the archive has no data for the geocode and range.
+    """
+    import xarray as xr
+
+    root = _root(root)
+    north, south, east, west = spatial.cell(geocode)
+    # limits of the range, the whole archive by default
+    first = np.datetime64(start or "1678-01-01", "ns")
+    last = np.datetime64(end or "2261-12-31", "ns") + np.timedelta64(1, "D")
+
+    parts = []
+    with metrics.timer("archive.read", geocode=str(geocode)) as m:
+        for name, meta in stores(root).items():
+            points = _contains(meta, (north, south, east, west))
+            if points is None:
+                continue
+            rows, cols = points
+            for month, chunk in sorted(meta["chunks"].items()):
+                begin = np.datetime64(chunk["start"], "ns")
+                if begin >= last or np.datetime64(chunk["end"], "ns") < first:
+                    continue
+                times, packed = _read_chunk(root / name, month, chunk, mmap)
+                in_range = np.flatnonzero((times >= first) & (times < last))
+                if not in_range.size:
+                    continue
+                block = packed[:, in_range[0] : in_range[-1] + 1][:, :, rows][..., cols]
+                values = _decode(np.asarray(block), chunk["scale"], chunk["offset"])
+                parts.append((times[in_range], values))
+        m["chunks"] = len(parts)
+
+    if not parts:
+        raise ValueError(f"No data of {geocode} in the archive at {root}")
+
+    times = np.concatenate([t for t, _ in parts])
+    values = np.concatenate([v for _, v in parts], axis=1)
+    # the same times may be in more than one store
+    times, index = np.unique(times, return_index=True)
+    values = values[:, index]
+
+    coords = dict(time=times, latitude=[north, south], longitude=[west, east])
+    dims = ["time", "latitude", "longitude"]
+    return xr.Dataset(
+        {v: (dims, values[i]) for i, v in enumerate(VARIABLES)}, coords=coords
+    )
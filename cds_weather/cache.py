@@ -0,0 +1,406 @@
+"""
+Local cache of the files downloaded from Copernicus.
+
+Every request sent to the API is stored in `globals.CACHE_DIR/netcdf` with
+a name given by a hash of its canonical form (dataset, variables, area, dates,
+times and format), so repeating a request never reaches the API. A manifest
+records the area and the days each file covers: when a new request overlaps
+files already in the cache, only the missing days are requested, one request
+per month, and the target file is assembled locally from the cached files.
+
+The total size of the cache is kept under a disk budget, removing the least
+recently used files first. The manifest is locked while it is read and
+updated, by the threads of a process and, with `fcntl`, by every process
+sharing the cache directory. Files in use by a request are pinned with a
+shared lock, which keeps them from being evicted until the request is done.
+
+Methods
+-------
+
+request_key(dataset, request) : Hash of the canonical form of a request.
+
+request_days(request)         : Days returned by the API for a request, the
+                                valid dates of the year x month x day product.
+
+retrieve(client, dataset, request, target) : Drop-in replacement of
+                                `cdsapi.Client().retrieve()` that goes
+                                through the cache.
+
+evict(max_bytes)              : Removes the least recently used files until
+                                the cache fits in `max_bytes`.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+from pathlib import Path
+from datetime import date
+from typing import Optional
+from contextlib import contextmanager
+
+from cds_weather import globals
+
+try:
+    import fcntl
+except ImportError:
+    # locks between processes aren't available on Windows
+    fcntl = None
+
+CACHE_DIR = globals.CACHE_DIR / "netcdf"
+# disk budget of the cache, in bytes
+MAX_BYTES = int(os.environ.get("ADCLIMA_CACHE_MAX_BYTES", 20 * 1024**3))
+
+_lock = threading.RLock()
+# depth of the nested `_locked()` blocks of the thread holding `_lock`
+_depth = 0
+# coordinates within this tolerance are considered the same grid point
+_EPS = 1e-6
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+def _canonical(dataset: str, request: dict) -> dict:
+    canonical = dict()
+    for key, value in request.items():
+        if key == "area":
+            canonical[key] = [round(float(c), 6) for c in value]
+        elif isinstance(value, (list, tuple, set)):
+            canonical[key] = sorted(_as_list(value))
+        else:
+            canonical[key] = str(value)
+    canonical["dataset"] = dataset
+    return canonical
+
+
+def request_key(dataset: str, request: dict) -> str:
+    """
+    Returns a sha256 hash that identifies a request regardless of the
+    order of its keys and list values.
+    """
+    canonical = json.dumps(_canonical(dataset, request), sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def request_days(request: dict) -> list:
+    """
+    Returns the sorted ISO dates of a request. The API combines every
+    year, month and day of the request, invalid dates are skipped.
+    """
+    days = set()
+    for year in _as_list(request.get("year")):
+        for month in _as_list(request.get("month")):
+            for day in _as_list(request.get("day")):
+                try:
+                    days.add(date(int(year), int(month), int(day)).isoformat())
+                except ValueError:
+                    continue
+    return sorted(days)
+
+
+def _manifest_path(cache_dir: Path) -> Path:
+    return cache_dir / "manifest.json"
+
+
+@contextmanager
+def _locked(cache_dir: Path):
+    """
+    Holds the lock of the manifest of a cache directory, between threads
+    and between processes.
+    """
+    global _depth
+    with _lock:
+        lock_file = None
+        # flock isn't reentrant, only the outermost block takes it
+        if _depth == 0 and fcntl is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            lock_file = open(cache_dir / "manifest.lock", "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _depth += 1
+        try:
+            yield
+        finally:
+            _depth -= 1
+            if lock_file is not None:
+                lock_file.close()
+
+
+def _pin(file: Path):
+    """
+    Opens a cached file with a shared lock, so `evict()` leaves it in place
+    until the returned file object is closed.
+    """
+    f = open(file, "rb")
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_SH)
+    return f
+
+
+def _remove_unpinned(file: Path) -> bool:
+    """
+    Removes a cached file unless it is pinned. Returns False if pinned.
+    """
+    try:
+        with open(file, "rb") as f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+            file.unlink()
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def _read_manifest(cache_dir: Path) -> dict:
+    try:
+        with open(_manifest_path(cache_dir)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    # entries whose file was removed outside of the cache
+    return {k: v for k, v in manifest.items() if (cache_dir / v["file"]).exists()}
+
+
+def _write_manifest(cache_dir: Path, manifest: dict):
+    path = _manifest_path(cache_dir)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _contains(outer: list, inner: list) -> bool:
+    north, west, south, east = outer
+    i_north, i_west, i_south, i_east = inner
+    return (
+        north + _EPS >= i_north
+        and west - _EPS <= i_west
+        and south - _EPS <= i_south
+        and east + _EPS >= i_east
+    )
+
+
+def _covers(entry: dict, dataset: str, request: dict) -> bool:
+    """
+    True if the file of the entry has every variable and time of the
+    request, in the same format, for an area containing the request's.
+    """
+    return (
+        entry["dataset"] == dataset
+        and entry["format"] == request.get("format")
+        and entry["product_type"] == request.get("product_type")
+        and set(_as_list(request.get("variable"))) <= set(entry["variables"])
+        and set(_as_list(request.get("time"))) <= set(entry["times"])
+        and _contains(entry["area"], [float(c) for c in request["area"]])
+    )
+
+
+def _fetch(client, dataset: str, request: dict, cache_dir: Path) -> dict:
+    key = request_key(dataset, request)
+    extension = "grib" if request.get("format") == "grib" else "nc"
+    file = cache_dir / f"{key}.{extension}"
+    tmp = cache_dir / f"{key}.{threading.get_ident()}.part"
+
+    try:
+        client.retrieve(dataset, request, str(tmp))
+        os.replace(tmp, file)
+    except Exception:
+        if tmp.exists():
+            tmp.unlink()
+        raise
+
+    return dict(
+        file=file.name,
+        dataset=dataset,
+        product_type=request.get("product_type"),
+        format=request.get("format"),
+        variables=sorted(_as_list(request.get("variable"))),
+        times=sorted(_as_list(request.get("time"))),
+        area=[float(c) for c in request["area"]],
+        days=request_days(request),
+        size=file.stat().st_size,
+        last_access=time.time(),
+    )
+
+
+def _monthly_requests(request: dict, days: list) -> list:
+    months = dict()
+    for day in days:
+        year, month, d = day.split("-")
+        months.setdefault((year, month), []).append(d)
+
+    requests = []
+    for (year, month), month_days in sorted(months.items()):
+        sub_request = dict(request)
+        sub_request.update(year=year, month=month, day=month_days)
+        requests.append(sub_request)
+    return requests
+
+
+def _assemble(files_days: dict, request: dict, target: str):
+    """
+    Writes the area and days of the request, taken from the cached
+    files, into the target NetCDF file.
+    """
+    import xarray as xr
+
+    north, west, south, east = [float(c) for c in request["area"]]
+    parts = []
+    for file, days in files_days.items():
+        with xr.open_dataset(file, engine="netcdf4") as ds:
+            lats, lons = ds.latitude, ds.longitude
+            ds = ds.isel(
+                latitude=((lats <= north + _EPS) & (lats >= south - _EPS)).values,
+                longitude=((lons >= west - _EPS) & (lons <= east + _EPS)).values,
+            )
+            in_days = ds.time.dt.strftime("%Y-%m-%d").isin(days).values
+            parts.append(ds.isel(time=in_days).load())
+
+    merged = xr.concat(parts, dim="time").sortby("time")
+    # each file is packed with its own scale and offset, which may not
+    # fit the values of the others
+    for var in merged.data_vars.values():
+        var.encoding = dict()
+    merged.to_netcdf(target, engine="netcdf4")
+
+
+def retrieve(
+    client,
+    dataset: str,
+    request: dict,
+    target: str,
+    cache_dir: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+) -> str:
+    """
+    Retrieves a request through the cache. Files with the same request
+    are copied to `target`. Otherwise, the days not covered by any cached
+    file are requested from the API and `target` is built from the cached
+    files, sliced to the area and days of the request.
+
+    Attrs:
+        client (cdsapi.Client): Client used for the missing data.
+        dataset (str): Name of the dataset, e.g. "reanalysis-era5-single-levels".
+        request (dict): Body of the request, as in `cdsapi.Client().retrieve()`.
+        target (str): Path of the resulting file.
+        cache_dir (opt(str)): Directory of the cache, `CACHE_DIR` by default.
+        max_bytes (opt(int)): Disk budget of the cache, `MAX_BYTES` by default.
+
+    Returns:
+        target (str): Path of the resulting file.
+    """
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    key = request_key(dataset, request)
+    # files in use, evicted only once the target is written
+    pins = []
+
+    try:
+        with _locked(cache_dir):
+            manifest = _read_manifest(cache_dir)
+            days = request_days(request)
+            files_days, used = dict(), []
+            missing = set(days)
+            if key in manifest:
+                files_days = {str(cache_dir / manifest[key]["file"]): None}
+                used, missing = [key], set()
+            # partial coverage only merges NetCDF files
+            elif request.get("format") == "netcdf":
+                for entry_key, entry in manifest.items():
+                    covered = missing.intersection(entry["days"])
+                    if covered and _covers(entry, dataset, request):
+                        files_days[str(cache_dir / entry["file"])] = sorted(covered)
+                        used.append(entry_key)
+                        missing -= covered
+            pins += [_pin(Path(file)) for file in files_days]
+
+        if key in used:
+            logging.info(f"Request found in cache: {key}.")
+        elif not missing:
+            logging.info(f"Request covered by {len(used)} cached files.")
+        elif len(missing) == len(days):
+            # nothing in the cache, the request is sent as it is
+            entry = _fetch(client, dataset, request, cache_dir)
+            files_days = {str(cache_dir / entry["file"]): None}
+            used = [key]
+            with _locked(cache_dir):
+                manifest = _read_manifest(cache_dir)
+                manifest[key] = entry
+                _write_manifest(cache_dir, manifest)
+                pins.append(_pin(cache_dir / entry["file"]))
+        else:
+            logging.info(f"{len(missing)} of {len(days)} days missing in cache.")
+            for sub_request in _monthly_requests(request, sorted(missing)):
+                entry = _fetch(client, dataset, sub_request, cache_dir)
+                sub_key = request_key(dataset, sub_request)
+                files_days[str(cache_dir / entry["file"])] = entry["days"]
+                used.append(sub_key)
+                with _locked(cache_dir):
+                    manifest = _read_manifest(cache_dir)
+                    manifest[sub_key] = entry
+                    _write_manifest(cache_dir, manifest)
+                    pins.append(_pin(cache_dir / entry["file"]))
+
+        if list(files_days.values()) == [None]:
+            shutil.copyfile(next(iter(files_days)), target)
+        else:
+            _assemble(files_days, request, target)
+
+        with _locked(cache_dir):
+            manifest = _read_manifest(cache_dir)
+            now = time.time()
+            for used_key in used:
+                if used_key in manifest:
+                    manifest[used_key]["last_access"] = now
+            _write_manifest(cache_dir, manifest)
+    finally:
+        for pin in pins:
+            pin.close()
+
+    evict(max_bytes, cache_dir)
+    return target
+
+
+def evict(max_bytes: Optional[int] = None, cache_dir: Optional[str] = None) -> int:
+    """
+    Removes the least recently used files until the cache fits in the
+    disk budget. Files pinned by a request in progress are kept.
+
+    Returns:
+        removed (int): Number of bytes removed.
+    """
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    removed = 0
+
+    with _locked(cache_dir):
+        manifest = _read_manifest(cache_dir)
+        total = sum(entry["size"] for entry in manifest.values())
+        by_access = sorted(manifest, key=lambda k: manifest[k]["last_access"])
+
+        for key in by_access:
+            if total <= max_bytes:
+                break
+            if not _remove_unpinned(cache_dir / manifest[key]["file"]):
+                continue
+            entry = manifest.pop(key)
+            total -= entry["size"]
+            removed += entry["size"]
+            logging.info(f"Evicted {entry['file']} from cache.")
+
+        if removed:
+            _write_manifest(cache_dir, manifest)
+
+    return removed
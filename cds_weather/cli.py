@@ -0,0 +1,325 @@
+"""
+Command line entry point, `adclima`, that runs batch jobs described by
+a manifest, a JSON file like:
+
+    {
+        "geocodes": [3304557, 3303302],
+        "uf": [33, 35],
+        "start": "2021-01-01",
+        "end": "2022-12-31",
+        "sink": "sqlite:data/adclima.db",
+        "workers": 4
+    }
+
+`geocodes` may also be "all". The cities are grouped in regions (@see
+`regions` module) and the date range is split in months, each region and
+month being a unit of work that is downloaded, parsed and loaded into the
+sink. Sinks are `sqlite:PATH`, a `postgresql://` connection string,
+`parquet:DIR` (@see `store` module) or `none`, to keep only the files.
+
+Finished units are recorded in a checkpoint journal, by default next to
+the manifest with the `.journal` extension. Running the same manifest
+again skips them, so an interrupted run resumes at the next unfinished
+unit. Optional keys: `data_dir`, `journal`, `max_region_size`, `use_cache`,
+`format`, "netcdf" or "grib", and `archive`, a directory where downloaded
+files are merged into a compact archive (@see `archive` module).
+
+Usage:
+
+    adclima run manifest.json
+    adclima run manifest.json --workers 8 --sink parquet:data/parquet
+    adclima status manifest.json
+
+Methods
+-------
+
+read_manifest(path)       : Reads and validates a manifest.
+
+units(manifest)           : Splits the manifest in units of work.
+
+run(manifest)             : Runs the units not finished yet.
+
+main(argv)                : Entry point of the `adclima` console script.
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+
+from pathlib import Path
+from typing import Optional
+from datetime import datetime, timedelta
+
+from cds_weather import (
+    archive,
+    executor,
+    extract_reanalysis,
+    loader,
+    pipeline,
+    regions,
+)
+
+REQUIRED = ["start", "end"]
+DEFAULTS = dict(
+    geocodes=None,
+    uf=None,
+    sink="none",
+    workers=executor.MAX_WORKERS,
+    data_dir=None,
+    journal=None,
+    max_region_size=regions.MAX_REGION_SIZE,
+    use_cache=True,
+    format="netcdf",
+    archive=None,
+)
+
+
+def read_manifest(path: str) -> dict:
+    """
+    Reads a manifest, filling the optional keys with `DEFAULTS`. The
+    journal defaults to the path of the manifest with `.journal`.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    missing = [key for key in REQUIRED if key not in manifest]
+    if missing:
+        raise ValueError(f"Manifest {path} is missing {missing}")
+    if not manifest.get("geocodes") and not manifest.get("uf"):
+        raise ValueError(f"Manifest {path} has no `geocodes` nor `uf`")
+    unknown = set(manifest) - set(REQUIRED) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown keys in manifest {path}: {sorted(unknown)}")
+
+    manifest = {**DEFAULTS, **manifest}
+    manifest["journal"] = manifest["journal"] or str(Path(path).with_suffix(".journal"))
+    return manifest
+
+
+def _geocodes(manifest: dict) -> list:
+    selected = []
+    geocodes = manifest["geocodes"]
+    if geocodes:
+        selected += regions.select(geocodes)
+    for uf in manifest["uf"] or []:
+        selected += regions.select(f"{int(uf):02d}")
+    return list(dict.fromkeys(selected))
+
+
+def _months(start: str, end: str) -> list:
+    """
+    Splits the range in (first, last) days of each calendar month.
+    """
+    first = datetime.strptime(start, "%Y-%m-%d")
+    end = datetime.strptime(end, "%Y-%m-%d")
+    months = []
+    while first <= end:
+        next_month = (first.replace(day=1) + timedelta(days=32)).replace(day=1)
+        last = min(next_month - timedelta(days=1), end)
+        months.append((first.strftime("%Y-%m-%d"), last.strftime("%Y-%m-%d")))
+        first = next_month
+    return months
+
+
+def units(manifest: dict) -> list:
+    """
+    Splits the manifest in units of work, one per region and month.
+
+    Returns:
+        units (list): Dicts with the `id`, the `geocodes` of the region and
+                      the `start` and `end` days of the month.
+    """
+    boxes = regions.bounding_boxes(_geocodes(manifest), manifest["max_region_size"])
+    result = []
+    for start, end in _months(manifest["start"], manifest["end"]):
+        for area, geocodes in boxes:
+            coords = "_".join(f"{c:g}" for c in area)
+            result.append(
+                dict(
+                    id=f"{start}_{end}_{coords}",
+                    geocodes=geocodes,
+                    start=start,
+                    end=end,
+                )
+            )
+    return result
+
+
+def _sink(spec: str):
+    """
+    Returns the function that loads a DataFrame into the sink, returning
+    the rows loaded, and the function that closes it.
+    """
+    if spec == "none":
+        return (lambda df: len(df)), (lambda: None)
+
+    if spec.startswith("parquet:"):
+        from cds_weather import store
+
+        root = spec[len("parquet:") :]
+        return (lambda df: store.write(df, root)), (lambda: None)
+
+    if spec.startswith("sqlite:"):
+        import sqlite3
+
+        conn = sqlite3.connect(spec[len("sqlite:") :], check_same_thread=False)
+    elif spec.startswith(("postgresql://", "postgres://")):
+        import psycopg2
+
+        conn = psycopg2.connect(spec)
+    else:
+        raise ValueError(f"Unknown sink {spec}")
+
+    loader.create_table(conn)
+    return (lambda df: loader.load(df, conn)), conn.close
+
+
+def _download(unit: dict, manifest: dict) -> dict:
+    past_date = unit["start"] if unit["start"] < unit["end"] else None
+    files = extract_reanalysis.download_batch(
+        unit["geocodes"],
+        past_date=past_date,
+        date=unit["end"],
+        data_dir=manifest["data_dir"],
+        max_region_size=manifest["max_region_size"],
+        use_cache=manifest["use_cache"],
+        workers=1,
+        journal=f"{manifest['journal']}.downloads",
+        format=manifest["format"],
+    )
+    if not files:
+        raise Exception("download failed")
+    if manifest["archive"]:
+        archive.add(files, root=manifest["archive"])
+    return files
+
+
+class _Progress:
+    """
+    Throughput and estimated time to finish the pending units.
+    """
+
+    def __init__(self, total: int, done: int):
+        self.total = total
+        self.done = done
+        self.new = 0
+        self.failed = 0
+        self.rows = 0
+        self.start = time.perf_counter()
+
+    def update(self, unit: dict, rows: Optional[int]):
+        if rows is None:
+            self.failed += 1
+        else:
+            self.new += 1
+            self.rows += rows
+        elapsed = time.perf_counter() - self.start
+        finished = self.new + self.failed
+        pending = self.total - self.done - finished
+        eta = timedelta(seconds=round(elapsed / finished * pending))
+        state = "failed" if rows is None else f"{rows} rows"
+        print(
+            f"[{self.done + finished}/{self.total}] {unit['id']}: {state} | "
+            f"{finished / elapsed * 3600:.1f} units/h, "
+            f"{self.rows / elapsed:.0f} rows/s | ETA {eta}",
+            flush=True,
+        )
+
+    def summary(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        return (
+            f"{self.new} units loaded, {self.failed} failed, {self.done} already "
+            f"done. {self.rows} rows in {timedelta(seconds=round(elapsed))} "
+            f"({self.rows / max(elapsed, 1e-9):.0f} rows/s)."
+        )
+
+
+def run(manifest: dict) -> bool:
+    """
+    Runs the units of the manifest that aren't done in its journal.
+    Downloads run in `workers` threads and the files are parsed and loaded
+    into the sink while the next ones download (@see `pipeline` module),
+    each unit loaded is recorded as done in the journal.
+
+    Returns:
+        True if every unit is done.
+    """
+    all_units = units(manifest)
+    done = executor.read_journal(manifest["journal"])
+    pending = [u for u in all_units if done.get(u["id"], {}).get("state") != "done"]
+    progress = _Progress(len(all_units), len(all_units) - len(pending))
+    print(f"{len(pending)} of {len(all_units)} units pending.", flush=True)
+
+    journal = executor.Journal(manifest["journal"])
+    load, close = _sink(manifest["sink"])
+    try:
+        for unit, rows, error in pipeline.run(
+            pending,
+            lambda unit: _download(unit, manifest),
+            extract_reanalysis.to_dataframe_batch,
+            load,
+            download_workers=manifest["workers"],
+        ):
+            if error is None:
+                journal.write(id=unit["id"], state="done", rows=rows)
+            else:
+                logging.error(f"Unit {unit['id']} failed: {error}")
+                journal.write(id=unit["id"], state="failed", error=str(error))
+            progress.update(unit, rows)
+    finally:
+        close()
+
+    print(progress.summary(), flush=True)
+    return progress.failed == 0
+
+
+def status(manifest: dict) -> dict:
+    """
+    Counts the units of the manifest by their state in the journal.
+    """
+    journal = executor.read_journal(manifest["journal"])
+    counts = dict(done=0, failed=0, pending=0)
+    for unit in units(manifest):
+        state = journal.get(unit["id"], {}).get("state", "pending")
+        counts[state] = counts.get(state, 0) + 1
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="adclima", description="Batch downloads of ERA5 data by geocode."
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Runs a manifest.")
+    run_parser.add_argument("manifest")
+    run_parser.add_argument("--workers", type=int)
+    run_parser.add_argument("--sink")
+    run_parser.add_argument("--journal")
+
+    status_parser = commands.add_parser("status", help="Progress of a manifest.")
+    status_parser.add_argument("manifest")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    manifest = read_manifest(args.manifest)
+    if args.command == "status":
+        counts = status(manifest)
+        print(", ".join(f"{n} {state}" for state, n in counts.items()))
+        return 0
+
+    for key in ["workers", "sink", "journal"]:
+        if getattr(args, key) is not None:
+            manifest[key] = getattr(args, key)
+    return 0 if run(manifest) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
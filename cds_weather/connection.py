@@ -12,8 +12,9 @@ key: <uid>:<key>
 These credentials only need to be configured once, `cdsapi` will
 check them every request to the API. If the method `download` is
 called, `.cdsapirc` will be searched. If the file is missing, a
-prompt will ask for its first configuration. Then, the status will
-be returned if successful:
+prompt will ask for its first configuration, unless the process is
+not running in a terminal, when an exception is raised instead.
+Then, the status will be returned if successful:
 
 'info': ['Welcome to the CDS']
 'warning': []
@@ -29,17 +30,38 @@ _check_credentials(uid, key): Credentials will be checked for right
 
 connect(opt[uid], opt[key]) : If none credentials are passed, it will request
                               a Status from `cdsapi` Client, if credentials are
-                              not found, will enter _interactive_con.
+                              not found, will enter _interactive_con. The status
+                              is requested once per process and the clients are
+                              shared by every download.
+
+client()                    : Context manager that lends a client of the pool
+                              to a single thread, returned when the block ends.
+
+reset()                     : Drops the shared clients, forcing a new status
+                              request in the next `connect()`.
 """
+import sys
 import uuid
-import cdsapi
+import queue
 import logging
+import threading
 
 from typing import Optional
+from contextlib import contextmanager
+from cds_weather import metrics
 from cds_weather.globals import CDSAPIRC_PATH
 
 credentials = "url: https://cds.climate.copernicus.eu/api/v2\n" "key: "
 
+# keyword arguments of the clients, like the `sleep_max` seconds between
+# retries, shortened to run against a local server (@see `mock_cds` module)
+CLIENT_OPTIONS = dict()
+
+_lock = threading.RLock()
+_validated = False
+# idle clients of the pool, the last returned is the first lent
+_clients = None
+
 
 def _interactive_con(answer):
     """
@@ -82,9 +104,104 @@ def _check_credentials(uid, key):
     return uid, key
 
 
+def _store_credentials(uid: str, key: str):
+    with open(CDSAPIRC_PATH, "w") as f:
+        f.write(credentials + f"{uid}:{key}")
+        logging.info(f"Credentials stored at {CDSAPIRC_PATH}")
+    reset()
+
+
+def _validate(interactive: bool):
+    """
+    Requests the API status once per process. If the credentials are
+    missing or invalid, enters the interactive mode or, if `interactive`
+    is False, raises an exception instead of waiting for an input.
+    """
+    import cdsapi
+
+    global _validated
+    try:
+        status = cdsapi.Client().status()
+        logging.info("Credentials file configured.")
+        logging.info(status["info"])
+        logging.warning(status["warning"])
+
+    except Exception as e:
+        logging.error(e)
+        if not interactive:
+            raise ConnectionError(
+                f"Copernicus credentials not found or invalid at {CDSAPIRC_PATH}. "
+                "Usage: `cds_weather.connect(uid, key)`"
+            ) from e
+
+        answer = input("Enter interactive mode? (y/n): ")
+        uid_answer, key_answer = _interactive_con(answer)
+        uid, key = _check_credentials(uid_answer, key_answer)
+        _store_credentials(uid, key)
+        logging.info(cdsapi.Client().status()["info"])
+
+    _validated = True
+
+
+def reset():
+    """
+    Drops the shared clients, the credentials will be validated again
+    in the next `connect()`.
+    """
+    global _validated, _clients
+    with _lock:
+        _validated = False
+        _clients = None
+
+
+def _new_client():
+    import cdsapi
+
+    return cdsapi.Client(info_callback=metrics.cdsapi_info, **CLIENT_OPTIONS)
+
+
+def _checkout(interactive: Optional[bool]) -> tuple:
+    global _clients
+
+    if interactive is None:
+        interactive = sys.stdin is not None and sys.stdin.isatty()
+
+    with metrics.timer("connect"), _lock:
+        if not _validated:
+            _validate(interactive)
+        if _clients is None:
+            _clients = queue.LifoQueue()
+        pool = _clients
+    try:
+        return pool, pool.get_nowait()
+    except queue.Empty:
+        return pool, _new_client()
+
+
+@contextmanager
+def client(interactive: Optional[bool] = None):
+    """
+    Lends an idle client of the pool, or a new one if all of them are in
+    use, so no two threads share a client and its HTTP session. The client
+    goes back to the pool when the block ends, usage:
+
+    with connection.client() as c:
+        c.retrieve(dataset, request, target)
+
+    Attrs:
+        interactive (opt(bool)): See `connect()`.
+    """
+    pool, lent = _checkout(interactive)
+    try:
+        yield lent
+    finally:
+        pool.put(lent)
+
+
 def connect(
     uid: Optional[str] = None,
     key: Optional[str] = None,
+    interactive: Optional[bool] = None,
 ):
     """
     `connect()` will be responsible for inserting the credentials in
@@ -94,43 +211,31 @@ def connect(
     via `_interactive_con()`, the values are evaluated and stored at
     `$HOME/.cdsapirc` file, returning the Client instance as well.
 
+    The status is only requested in the first call of the process, the
+    following calls return one of the clients of the pool, each one
+    keeping its HTTP session alive between requests. The client may be
+    lent to other threads too, code running requests at the same time
+    should take its clients with `client()` instead.
+
     Attrs:
         uid (opt(str)) : UID found in Copernicus User page.
         key (opt(str)) : API Key found in Copernicus User page.
+        interactive (opt(bool)): If the credentials are not valid, ask for
+                                 them via input. By default, only when
+                                 running in a terminal. If False, an
+                                 exception is raised instead.
 
     Returns:
         cdsapi.Client(): Instance of the Copernicus API Client, used
                          for requesting data from the API.
     """
-    if not uid and not key:
+    if uid or key:
         try:
-            status = cdsapi.Client().status()
-            logging.info("Credentials file configured.")
-            logging.info(status["info"])
-            logging.warning(status["warning"])
-
+            uid, key = _check_credentials(uid, key)
+            _store_credentials(uid, key)
         except Exception as e:
             logging.error(e)
+            return None
 
-            answer = input("Enter interactive mode? (y/n): ")
-            uid_answer, key_answer = _interactive_con(answer)
-            uid, key = _check_credentials(uid_answer, key_answer)
-
-            with open(CDSAPIRC_PATH, "w") as f:
-                f.write(credentials + f"{uid}:{key}")
-                logging.info(f"Credentials stored at {CDSAPIRC_PATH}")
-                logging.info(cdsapi.Client().status()["info"])
-
-        finally:
-            return cdsapi.Client()
-
-    try:
-        uid, key = _check_credentials(uid, key)
-        with open(CDSAPIRC_PATH, "w") as f:
-            f.write(credentials + f"{uid}:{key}")
-            logging.info(f"Credentials stored at {CDSAPIRC_PATH}")
-
-        return cdsapi.Client()
-
-    except Exception as e:
-        logging.error(e)
+    with client(interactive) as shared:
+        return shared
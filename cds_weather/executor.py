@@ -0,0 +1,253 @@
+"""
+Run many Copernicus requests concurrently.
+
+Requests to the API spend most of their time waiting in the Copernicus
+queue, so several of them can be submitted at once. The executor sends
+planned requests (@see `planner` module) through a bounded thread pool,
+sized to the number of requests a single user can have running at the
+same time in the CDS queue.
+
+Failures that are likely temporary, connection errors, timeouts and
+responses with a 429 or 5xx status, are retried with exponential backoff.
+Files are downloaded to a temporary `.part` file that is only renamed to
+the target once complete, so a target file is never left half written.
+The state of each job can be recorded in a journal, a JSON lines file:
+if the process is interrupted, running it again with the same journal
+skips the jobs already done.
+
+A job is a dict with the keys `dataset`, `request` and `target`. Each
+job takes a client of the pool of `connection.client()`, or the client
+passed to `run()`, any object with a `retrieve(dataset, request, target)`
+method, like `cdsapi.Client`.
+
+Methods
+-------
+
+job_id(job)        : Identifier of a job, a hash of its request and target.
+
+run(jobs)          : Runs the jobs and returns the final state of each one.
+
+read_journal(path) : Returns the last recorded state of each job.
+
+Journal(path)      : Appends entries to a journal, synced to the disk.
+"""
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+
+from pathlib import Path
+from typing import Iterable, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from cds_weather import cache, connection, metrics
+
+# requests running at the same time, CDS limits the active requests per user
+MAX_WORKERS = 4
+MAX_RETRIES = 5
+# seconds before the first retry, doubled at each attempt
+BACKOFF = 30.0
+MAX_BACKOFF = 600.0
+
+
+def job_id(job: dict) -> str:
+    key = cache.request_key(job["dataset"], job["request"])
+    return f"{key[:16]}-{Path(job['target']).name}"
+
+
+def _is_transient(error: Exception) -> bool:
+    """
+    Connection errors, timeouts, transfers cut halfway and HTTP errors
+    with a 429 or 5xx status are worth retrying.
+    """
+    import requests
+
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    ):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or 500 <= status < 600
+    return False
+
+
+def read_journal(path: str) -> dict:
+    """
+    Returns a dict with the last recorded entry of each job id.
+    """
+    states = dict()
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line of a killed process may be incomplete
+                    continue
+                states[entry["id"]] = entry
+    except FileNotFoundError:
+        pass
+    return states
+
+
+class Journal:
+    """
+    JSON lines file with an `id` and a `state` in each entry, readable by
+    `read_journal()`. Without a path, nothing is written.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.lock = threading.Lock()
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+    def write(self, **entry):
+        if not self.path:
+            return
+        entry["time"] = time.time()
+        with self.lock, open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _retrieve(job: dict, client, part: str, use_cache: bool, fields: dict):
+    states = metrics.track_states() if metrics.enabled() else None
+    start = time.perf_counter()
+    if use_cache:
+        cache.retrieve(client, job["dataset"], job["request"], part)
+    else:
+        client.retrieve(job["dataset"], job["request"], part)
+
+    if states is not None:
+        end, size = time.perf_counter(), os.path.getsize(part)
+        fields.update(metrics.download_fields(states, start, end, size))
+
+
+def _run_job(
+    job: dict,
+    client,
+    journal: Journal,
+    retries: int,
+    backoff: float,
+    use_cache: bool,
+    submitted: float,
+) -> dict:
+    if client is None:
+        # a client of the pool for the job only, retries included
+        with connection.client() as pooled:
+            return _run_job(
+                job, pooled, journal, retries, backoff, use_cache, submitted
+            )
+
+    jid, target = job_id(job), str(job["target"])
+    part = f"{target}.part"
+    error = None
+    # seconds waiting for a free worker
+    wait = time.perf_counter() - submitted
+
+    for attempt in range(1, retries + 2):
+        journal.write(id=jid, state="running", target=target, attempt=attempt)
+        try:
+            with metrics.timer(
+                "download", id=jid, dataset=job["dataset"], attempt=attempt, wait=wait
+            ) as m:
+                _retrieve(job, client, part, use_cache, m)
+            os.replace(part, target)
+            journal.write(id=jid, state="done", target=target, attempt=attempt)
+            return dict(id=jid, state="done", target=target, attempts=attempt)
+
+        except Exception as e:
+            error = e
+            if os.path.exists(part):
+                os.remove(part)
+            if not _is_transient(e) or attempt > retries:
+                break
+            delay = min(backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+            delay *= random.uniform(0.5, 1.0)
+            logging.warning(f"{jid} failed ({e}), retrying in {delay:.0f}s.")
+            time.sleep(delay)
+
+    logging.error(f"{jid} failed: {error}")
+    journal.write(id=jid, state="failed", target=target, error=str(error))
+    return dict(id=jid, state="failed", target=target, error=str(error))
+
+
+def run(
+    jobs: Iterable[dict],
+    client=None,
+    workers: int = MAX_WORKERS,
+    retries: int = MAX_RETRIES,
+    backoff: Optional[float] = None,
+    journal: Optional[str] = None,
+    use_cache: bool = False,
+) -> dict:
+    """
+    Runs the jobs in a pool of `workers` threads.
+
+    Attrs:
+        jobs (iterable): Dicts with `dataset`, `request` and `target`.
+        client: Object with a `retrieve(dataset, request, target)` method,
+                shared by the workers. By default, each job takes a client
+                of the pool of `connection.client()` for itself.
+        workers (int): Maximum number of requests at the same time.
+        retries (int): Retries of each job after a transient failure.
+        backoff (opt(float)): Seconds before the first retry, doubled each
+                              time. `BACKOFF` by default.
+        journal (opt(str)): Path of the journal. Jobs recorded as done, whose
+                            target still exists, are skipped.
+        use_cache (bool): If True, the jobs go through the local cache
+                          (@see `cache` module).
+
+    Returns:
+        A dict with the final state of each job id: `state` ("done",
+        "skipped" or "failed"), `target` and, if failed, the `error`.
+    """
+    if backoff is None:
+        backoff = BACKOFF
+    journal_ = Journal(journal)
+    done = read_journal(journal) if journal else dict()
+    results, pending = dict(), []
+
+    for job in jobs:
+        jid = job_id(job)
+        entry = done.get(jid)
+        if entry and entry["state"] == "done" and os.path.exists(job["target"]):
+            results[jid] = dict(id=jid, state="skipped", target=str(job["target"]))
+        else:
+            pending.append(job)
+
+    if results:
+        logging.info(f"{len(results)} jobs already done, skipping.")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(
+                _run_job,
+                job,
+                client,
+                journal_,
+                retries,
+                backoff,
+                use_cache,
+                time.perf_counter(),
+            )
+            for job in pending
+        ]
+        for future in futures:
+            result = future.result()
+            results[result["id"]] = result
+
+    return results
@@ -12,9 +12,14 @@ can be found in the jupyter notebook of the project.
 Methods:
     do_area(latitude, longitude) : Returns North, South, East and West given a
                                    coordinate.
+
+    do_area_many(lats, lons)     : Returns arrays of North, South, East and West
+                                   given arrays of coordinates.
 """
 
-from cds_weather.globals import LATITUDES, LONGITUDES
+import numpy as np
+
+from cds_weather.globals import GRID_RESOLUTION, LATITUDES, LONGITUDES
 
 
 def do_area(lat, lon) -> tuple:
@@ -50,36 +55,33 @@ def do_area(lat, lon) -> tuple:
     [-23.0, -43.25] = S, W
     [-22.75, -43.0] = N, E
     """
-    closest_lat = min(LATITUDES, key=lambda x: abs(x - lat))
-    closest_lon = min(LONGITUDES, key=lambda x: abs(x - lon))
+    north, south, east, west = do_area_many(lat, lon)
+    return float(north), float(south), float(east), float(west)
 
-    first_quadr = lat - closest_lat < 0 and lon - closest_lon < 0
-    second_quadr = lat - closest_lat > 0 and lon - closest_lon < 0
-    third_quadr = lat - closest_lat > 0 and lon - closest_lon > 0
-    fourth_quadr = lat - closest_lat < 0 and lon - closest_lon > 0
 
-    if first_quadr:
-        north, east = closest_lat, closest_lon
-        i_south = [i - 1 for i, x in enumerate(LATITUDES) if x == north].pop()
-        i_west = [i - 1 for i, y in enumerate(LONGITUDES) if y == east].pop()
-        south, west = LATITUDES[i_south], LONGITUDES[i_west]
+def do_area_many(lats, lons) -> tuple:
+    """
+    Vectorized version of `do_area()`. As the grid is regular, the cell
+    containing each coordinate is found by rounding it down to a multiple
+    of `GRID_RESOLUTION`, the closest coordinate being one of its corners.
+    Coordinates exactly over a grid line are the south (or west) side of
+    the cell, and cells crossing the edge of the grid are moved inside it.
 
-    if second_quadr:
-        north, west = closest_lat, closest_lon
-        i_south = [i - 1 for i, x in enumerate(LATITUDES) if x == north].pop()
-        i_east = [i + 1 for i, y in enumerate(LONGITUDES) if y == west].pop()
-        south, east = LATITUDES[i_south], LONGITUDES[i_east]
+    Params:
+        lats (array_like): Latitudes in degrees.
+        lons (array_like): Longitudes in degrees.
 
-    if third_quadr:
-        south, west = closest_lat, closest_lon
-        i_north = [i + 1 for i, x in enumerate(LATITUDES) if x == south].pop()
-        i_east = [i + 1 for i, y in enumerate(LONGITUDES) if y == west].pop()
-        north, east = LATITUDES[i_north], LONGITUDES[i_east]
+    Returns:
+        north, south, east, west (ndarray): Coordinates of the cell of each
+                                            point, with the shape of the input.
+    """
+    res = GRID_RESOLUTION
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
 
-    if fourth_quadr:
-        south, east = closest_lat, closest_lon
-        i_north = [i - 1 for i, x in enumerate(LATITUDES) if x == south].pop()
-        i_west = [i - 1 for i, y in enumerate(LONGITUDES) if y == east].pop()
-        north, west = LATITUDES[i_north], LONGITUDES[i_west]
+    south = np.floor(lats / res) * res
+    south = np.clip(south, LATITUDES[0], LATITUDES[-1] - res)
+    west = np.floor(lons / res) * res
+    west = np.clip(west, LONGITUDES[0], LONGITUDES[-1] - res)
 
-    return north, south, east, west
+    return south + res, south, west + res, west
@@ -6,22 +6,108 @@ their geocode reference of a brazilian city as specified
 by IBGE:
 https://ibge.gov.br/explica/codigos-dos-municipios.php
 
+The JSON file is only read when a lookup is first needed,
+and kept as numpy arrays sorted by geocode. A binary copy
+of these arrays is stored at `globals.CACHE_DIR`, so other
+processes can skip parsing the JSON. The copy is rebuilt
+whenever `municipios.json` is modified.
+
 Methods
 -------
 
 from_geocode(geocode):
                 Returns a tuple (latitude, longitude)
+
+from_geocodes(geocodes):
+                Returns two arrays (latitudes, longitudes)
+
+geocodes(uf):
+                Returns the list of geocodes of a state, or
+                every geocode if no state is given
+
+table():
+                Returns the columns of `municipios.json` as
+                numpy arrays sorted by geocode
 """
-import pandas as pd
+import os
 import json
+import logging
+import numpy as np
+
+from typing import Iterable, Optional
+
+from cds_weather.globals import CACHE_DIR, DATA_DIR
+
+MUNICIPIOS_JSON = DATA_DIR / "municipios.json"
+MUNICIPIOS_CACHE = CACHE_DIR / "municipios.npz"
+
+# set to False to always parse the JSON file
+USE_CACHE = True
+
+_table = None
+_index = None
+
+
+def _parse_json() -> dict:
+    with open(MUNICIPIOS_JSON) as mun_json:
+        mun_decoded = mun_json.read().encode().decode("utf-8-sig")
+    municipios = sorted(json.loads(mun_decoded), key=lambda m: m["geocodigo"])
 
-from cds_weather.globals import DATA_DIR
+    return dict(
+        geocodigo=np.array([m["geocodigo"] for m in municipios], dtype=np.int64),
+        municipio=np.array([m["municipio"] for m in municipios], dtype=str),
+        latitude=np.array([m["latitude"] for m in municipios], dtype=np.float64),
+        longitude=np.array([m["longitude"] for m in municipios], dtype=np.float64),
+        codigo_uf=np.array([m["codigo_uf"] for m in municipios], dtype=np.int64),
+        fuso_horario=np.array([m["fuso_horario"] for m in municipios], dtype=str),
+    )
+
+
+def _load_cache() -> Optional[dict]:
+    try:
+        if MUNICIPIOS_CACHE.stat().st_mtime < MUNICIPIOS_JSON.stat().st_mtime:
+            return None
+        with np.load(MUNICIPIOS_CACHE) as cached:
+            return {column: cached[column] for column in cached.files}
+    except (OSError, ValueError):
+        return None
+
+
+def _store_cache(table: dict):
+    try:
+        MUNICIPIOS_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = MUNICIPIOS_CACHE.with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(tmp, **table)
+        os.replace(tmp, MUNICIPIOS_CACHE)
+    except OSError as e:
+        logging.warning(f"Could not store {MUNICIPIOS_CACHE}: {e}")
+
+
+def table() -> dict:
+    """
+    Returns the columns of `municipios.json` as numpy arrays, sorted
+    by geocode. Loaded once per process, from the binary cache if
+    available.
+
+    Returns:
+        table (dict): Arrays `geocodigo`, `municipio`, `latitude`,
+                      `longitude`, `codigo_uf` and `fuso_horario`.
+    """
+    global _table, _index
+    if _table is None:
+        loaded = _load_cache() if USE_CACHE else None
+        if loaded is None:
+            loaded = _parse_json()
+            if USE_CACHE:
+                _store_cache(loaded)
+        _index = {g: i for i, g in enumerate(loaded["geocodigo"].tolist())}
+        _table = loaded
+    return _table
 
 
-mun_json = open(f"{DATA_DIR}/municipios.json")
-mun_decoded = mun_json.read().encode().decode("utf-8-sig")
-municipios = json.loads(mun_decoded)
-mun_json.close()
+def _row(geocode: int) -> int:
+    table()
+    return _index[int(geocode)]
 
 
 def from_geocode(geocode: int) -> tuple:
@@ -40,10 +126,64 @@ def from_geocode(geocode: int) -> tuple:
         lon (float)   : Longitude of geocode in degrees
                         between -180 and 180. Represents
                         the West and East coordinates.
+
+    Raises:
+        KeyError      : If the geocode is not found.
+    """
+    row = _row(geocode)
+    return float(_table["latitude"][row]), float(_table["longitude"][row])
+
+
+def from_geocodes(geocodes: Iterable[int]) -> tuple:
+    """
+    Returns latitudes and longitudes given many city geocodes.
+
+    Params:
+        geocodes (iterable) : Geocodes in IBGE's geocode format.
+
+    Returns:
+        lats (ndarray)      : Latitude of each geocode, in order.
+        lons (ndarray)      : Longitude of each geocode, in order.
+
+    Raises:
+        KeyError            : If any geocode is not found.
     """
-    df = pd.DataFrame(municipios)
-    df = df.set_index("geocodigo")
+    columns = table()
+    geocodes = np.asarray(list(geocodes), dtype=np.int64)
+    rows = np.searchsorted(columns["geocodigo"], geocodes)
+    rows = np.clip(rows, 0, len(columns["geocodigo"]) - 1)
+
+    missing = columns["geocodigo"][rows] != geocodes
+    if missing.any():
+        raise KeyError(geocodes[missing].tolist())
+    return columns["latitude"][rows], columns["longitude"][rows]
+
+
+def geocodes(uf: Optional[int] = None) -> list:
+    """
+    Returns the geocodes stored in `municipios.json`.
+
+    Params:
+        uf (opt(int)) : IBGE code of a brazilian state (`codigo_uf`),
+                        e.g. 33 for Rio de Janeiro. If None, every
+                        geocode is returned.
+
+    Returns:
+        geocodes (list): Geocodes in IBGE's format.
+    """
+    columns = table()
+    if uf is None:
+        return columns["geocodigo"].tolist()
+    return columns["geocodigo"][columns["codigo_uf"] == int(uf)].tolist()
+
 
-    lat = df.loc[geocode].latitude
-    lon = df.loc[geocode].longitude
-    return lat, lon
+def __getattr__(name):
+    # `municipios` was a list of dicts parsed at import time,
+    # it is now built from the lazy table when accessed
+    if name == "municipios":
+        columns = table()
+        return [
+            dict(zip(columns, values))
+            for values in zip(*(c.tolist() for c in columns.values()))
+        ]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
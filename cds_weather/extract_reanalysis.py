@@ -35,6 +35,13 @@ Data will be collected within a 3 hour range along each day of the month,
 the highest and lowest values are stored and the mean is taken with all
 the values from the day.
 
+Files are requested in NetCDF by default. With `format="grib"`, the files
+are downloaded in GRIB, the native format of ERA5, and parsed by the
+streaming decoder of the `grib` module into the same DataFrame.
+
+pandas and xarray are imported by the functions that parse the files, so
+importing this module doesn't load them (@see `benchmarks/import_time.py`).
+
 Methods
 -------
 
@@ -42,7 +49,8 @@ Methods
                  the city specified by its geocode. The data can be retrieved
                  for certain day of the year and within a time range. As much
                  bigger the time interval chosen, as long will take to download
-                 the requested data.
+                 the requested data. The requests are planned by the `planner`
+                 module, so only the days in the range are requested.
                  @warning: for some reason, even if requested by Copernicus
                            website, trying to retrieve a date range with the
                            current month and the last days of the past month
@@ -50,34 +58,66 @@ Methods
                            not choose the current one.
                  @warning: date 2022-08-01 is corrupting all data retrieved.
 
-    _parse_data(data, columns_name) : Groups data by date and aggregate values
-                                      to max, min and avg values.
+    download_batch() : Requests many cities at once, selected by a list of
+                       geocodes, a state code or "all". The cities are grouped
+                       in regions (@see `regions` module) and each region is
+                       downloaded in a single request.
 
-    _retrieve_data(row) : Uses numpy.mean() to aggregate all data from the four
-                          coordinate points collected from a specific geocode
-                          coordinate.
-                          @see `extract_coodinates` module.
+    _daily_aggregates(ds, geocode) : Averages all variables over the four
+                                     coordinate points collected from a specific
+                                     geocode coordinate and aggregates them by
+                                     date to min, mean and max values.
+                                     @see `extract_coodinates` module.
 
     to_dataframe(file) : Will handle the NetCDF file and retrieve its values
                          using numpy `load_dataset()` method and return a
-                         DataFrame with the format above.
+                         DataFrame with the format above. If a geocode
+                         is passed, only its four coordinates are parsed.
+                         With `max_memory`, the file is read lazily in
+                         chunks of days, for files larger than the memory.
+                         GRIB files are decoded message by message.
+
+    last_update() : Most recent date available in the dataset.
+
+    to_dataframe_batch(files) : Parses every geocode of the files returned by
+                                `download_batch()` into a single DataFrame.
+
+    to_dataframe_many(paths, workers) : Parses many files in a pool of
+                                        processes into a single DataFrame.
+
+    Downloaded files can be merged into a compact archive (@see `archive`
+    module), which `to_dataframe()` reads for any geocode and date range.
 """
 
+import os
 import re
+import shutil
 import logging
-import numpy as np
-import pandas as pd
-import xarray as xr
-import metpy.calc as mpcalc
 
 from pathlib import Path
-from functools import reduce
-from metpy.units import units
-from typing import Optional, Union
+from typing import Iterable, Optional, Union
 from datetime import datetime, timedelta
 
 from cds_weather.extract_coordinates import do_area
-from cds_weather import extract_latlons, connection, globals
+from cds_weather import (
+    archive,
+    connection,
+    executor,
+    extract_latlons,
+    globals,
+    grib,
+    humidity,
+    metrics,
+    planner,
+    regions,
+    spatial,
+)
+
+DATASET = "reanalysis-era5-single-levels"
+# days of delay of the dataset updates
+UPDATE_DELAY = 7
+# extension of the files downloaded in each format
+EXTENSIONS = {"netcdf": ".nc", "grib": ".grib"}
 
 
 def download(
@@ -87,6 +127,8 @@ def download(
     data_dir: Optional[str] = None,
     uid: Optional[str] = None,
     key: Optional[str] = None,
+    use_cache: bool = True,
+    format: str = "netcdf",
 ):
     """
     Creates the request for Copernicus API. Extracts the latitude and
@@ -102,7 +144,9 @@ def download(
     closest coordinates from Rio de Janeiro coordinates, which can be found
     at `municipios.json`. A file in the NetCDF format will be downloaded as
     specified in `data_dir` attribute with the format GEOCODE_PASTDATE_DATE.nc,
-    returned as a variable to be used in `to_dataframe()` method.
+    returned as a variable to be used in `to_dataframe()` method. The
+    date range is split into exact requests by `planner.plan()`, long
+    ranges are downloaded in parts and joined in the same file.
 
     Attrs:
         geocode (opt(int or str)): Geocode of a specific city in Brazil,
@@ -116,19 +160,204 @@ def download(
                         `connection.connect()` method.
         key (opt(str)): API Key from Copernicus User page, it will be used with
                         `connection.connect()` method.
+        use_cache (bool): If True, the request goes through the local cache
+                          (@see `cache` module) and only data not downloaded
+                          before is requested to the API.
+        format (str): "netcdf" or "grib", the format of the file requested.
+                      GRIB files are named GEOCODE_PASTDATE_DATE.grib.
 
     Returns:
         `data_dir/filename` that can later be used to transform into DataFrame
         with `to_dataframe()` method.
     """
 
-    help = "Use `help(extract_reanalysis.download())` for more info."
-    conn = connection.connect(uid, key)
-    format = "%Y-%m-%d"
-    iso_format = "YYYY-MM-DD"
-    re_format = r"\d{4}-\d{2}-\d{2}"
-    today = datetime.now()
+    extension = _extension(format)
+    connection.connect(uid, key)
+    data_dir = _data_dir(data_dir)
+    dates = _request_dates(past_date, date)
+    if dates is None:
+        return None
+    start, end, suffix = dates
+    filename = f"{geocode}_{suffix}{extension}"
+
+    try:
+        with metrics.timer("lookup", geocodes=1):
+            lat, lon = extract_latlons.from_geocode(geocode)
+            north, south, east, west = do_area(lat, lon)
+
+        _retrieve(
+            None,
+            planner.plan(start, end, [north, west, south, east], format=format),
+            f"{data_dir}/{filename}",
+            use_cache,
+        )
+        logging.info(f"{filename} downloaded at {data_dir}.")
+
+        return f"{data_dir}/{filename}"
+
+    except Exception as e:
+        logging.error(e)
+
+
+def download_batch(
+    geocodes: Union[int, str, Iterable[Union[int, str]]] = "all",
+    past_date: Optional[str] = None,
+    date: Optional[str] = None,
+    data_dir: Optional[str] = None,
+    uid: Optional[str] = None,
+    key: Optional[str] = None,
+    max_region_size: float = regions.MAX_REGION_SIZE,
+    use_cache: bool = True,
+    workers: int = executor.MAX_WORKERS,
+    journal: Optional[str] = None,
+    format: str = "netcdf",
+) -> dict:
+    """
+    Downloads the data of many cities with one request per region instead
+    of one request per geocode. The `do_area` cells of the cities are
+    covered by the bounding boxes calculated in `regions.bounding_boxes()`
+    and each box is downloaded once, usage:
+
+    download_batch(geocodes="all", past_date='2022-10-01', date='2022-10-04')
+    download_batch(geocodes=33, date='2022-10-04')
+    download_batch(geocodes=[3304557, 3303302], date='2022-10-04')
+
+    Files are named REGION_N_W_S_E_PASTDATE_DATE.nc and the series of each
+    geocode can be extracted with `to_dataframe(file, geocode)` or, for the
+    whole batch, with `to_dataframe_batch()`.
+
+    Attrs:
+        geocodes (int, str or iterable): "all", a state code (`codigo_uf`)
+                                         or a list of geocodes.
+        past_date (opt(str)): Format 'YYYY-MM-DD', see `download()`.
+        date (opt(str)): Format 'YYYY-MM-DD', see `download()`.
+        data_dir (opt(str)): Path in which the NetCDF files will be downloaded.
+        uid (opt(str)): UID from Copernicus User page.
+        key (opt(str)): API Key from Copernicus User page.
+        max_region_size (float): Maximum width and height of each region,
+                                 in degrees.
+        use_cache (bool): If True, the requests go through the local cache.
+        workers (int): Number of requests sent at the same time.
+        journal (opt(str)): Journal of the downloads, if the batch is
+                            interrupted, it can be called again with the
+                            same journal to resume (@see `executor` module).
+        format (str): "netcdf" or "grib", the format of the files requested.
 
+    Returns:
+        A dict mapping each downloaded file to the geocodes it contains.
+        Regions that failed to download are logged and left out.
+    """
+    extension = _extension(format)
+    connection.connect(uid, key)
+    data_dir = _data_dir(data_dir)
+    dates = _request_dates(past_date, date)
+    if dates is None:
+        return dict()
+    start, end, suffix = dates
+
+    boxes = regions.bounding_boxes(regions.select(geocodes), max_region_size)
+    logging.info(f"{len(boxes)} regions will be requested.")
+
+    targets = dict()
+    for area, geocodes_in_box in boxes:
+        coords = "_".join(f"{c:g}" for c in area)
+        target = f"{data_dir}/REGION_{coords}_{suffix}{extension}"
+        targets[target] = (
+            _jobs(planner.plan(start, end, area, format=format), target),
+            geocodes_in_box,
+        )
+
+    # regions joined in a previous run of the same journal
+    done = executor.read_journal(journal) if journal else dict()
+    files = dict()
+    for target, (region_jobs, geocodes_in_box) in list(targets.items()):
+        ids = [executor.job_id(job) for job in region_jobs]
+        if os.path.exists(target) and all(
+            done.get(i, {}).get("state") == "done" for i in ids
+        ):
+            files[target] = geocodes_in_box
+            del targets[target]
+
+    jobs = [job for region_jobs, _ in targets.values() for job in region_jobs]
+    results = executor.run(jobs, workers=workers, use_cache=use_cache, journal=journal)
+
+    for target, (region_jobs, geocodes_in_box) in targets.items():
+        region_results = {
+            executor.job_id(job): results[executor.job_id(job)] for job in region_jobs
+        }
+        try:
+            _join(region_jobs, target, region_results)
+            logging.info(f"{target} downloaded.")
+            files[target] = geocodes_in_box
+
+        except Exception as e:
+            logging.error(e)
+
+    return files
+
+
+def _retrieve(
+    conn,
+    requests: list,
+    target: str,
+    use_cache: bool = True,
+    workers: int = 1,
+):
+    """
+    Retrieves the requests planned by `planner.plan()` into a single file.
+    When there is more than one request, each one is downloaded to a part
+    file by `executor.run()` and the parts are concatenated along time.
+    GRIB parts are sequences of messages, so their bytes are concatenated.
+    Without `conn`, each request takes a client of `connection.client()`.
+    """
+    jobs = _jobs(requests, target)
+    results = executor.run(jobs, conn, workers=workers, use_cache=use_cache)
+    _join(jobs, target, results)
+    return target
+
+
+def _jobs(requests: list, target: str) -> list:
+    if len(requests) == 1:
+        return [dict(dataset=DATASET, request=requests[0], target=target)]
+    return [
+        dict(dataset=DATASET, request=request, target=f"{target}.{i}.part")
+        for i, request in enumerate(requests)
+    ]
+
+
+def _join(jobs: list, target: str, results: dict):
+    failed = [r["error"] for r in results.values() if r["state"] == "failed"]
+    if failed:
+        raise Exception(f"{len(failed)} requests failed for {target}: {failed[0]}")
+
+    if len(jobs) > 1 and grib.is_grib(target):
+        with open(target, "wb") as f:
+            for job in jobs:
+                with open(job["target"], "rb") as part:
+                    shutil.copyfileobj(part, f)
+        for job in jobs:
+            os.remove(job["target"])
+
+    elif len(jobs) > 1:
+        import xarray as xr
+
+        parts = [xr.load_dataset(job["target"], engine="netcdf4") for job in jobs]
+        merged = xr.concat(parts, dim="time").sortby("time")
+        # each part is packed with its own scale and offset
+        for var in merged.data_vars.values():
+            var.encoding = dict()
+        merged.to_netcdf(target)
+        for job in jobs:
+            os.remove(job["target"])
+
+
+def _extension(format: str) -> str:
+    if format not in EXTENSIONS:
+        raise ValueError(f"Unknown format {format}. Options: {list(EXTENSIONS)}")
+    return EXTENSIONS[format]
+
+
+def _data_dir(data_dir: Optional[str] = None):
     if data_dir:
         data_dir = Path(str(data_dir))
         data_dir.mkdir(parents=True, exist_ok=True)
@@ -136,96 +365,33 @@ def download(
     if not data_dir:
         data_dir = globals.DATA_DIR
 
-    if date:
-        ini_date = datetime.strptime(date, format)
-        year, month, day = date.split("-")
-        filename = f'{geocode}_{date.replace("-","")}.nc'
-        # dataset has maximum of 7 days of update delay.
-        # in order to prevent requesting invalid dates,
-        # the max date is 7 days from today's date
-        max_update_delay = today - timedelta(days=7)
-        if ini_date > max_update_delay:
-            raise Exception(
-                f"""
-                    Invalid date. The last update date is:
-                    {datetime.strftime(max_update_delay, format)}
-                    {help}
-            """
-            )
-
-        # check for right initial date format
-        if not re.match(re_format, date):
-            return logging.error(
-                f"""
-                    Invalid initial date. Format:
-                    {iso_format}
-                    {help}
-            """
-            )
-
-        # an end date can be passed to define the date range
-        # if there is no end date, only the day specified on
-        # `date` will be downloaded
-        if past_date:
-            end_date = datetime.strptime(past_date, format)
-
-            # check for right end date format
-            if not re.match(re_format, past_date):
-                return logging.error(
-                    f"""
-                        Invalid end date. Format:
-                        {iso_format}
-                        {help}
-                """
-                )
+    return data_dir
 
-            # safety limit for Copernicus limit and file size: 2 years
-            max_api_query = timedelta(days=731)
-            if ini_date - end_date > max_api_query:
-                return logging.error(
-                    f"""
-                        Maximum query reached.
-                        {help}
-                """
-                )
 
-            # end date can't be bigger than initial date
-            if end_date >= ini_date:
-                return logging.error(
-                    f"""
-                        Past date can't be more recent than the initial date.
-                        {help}
-                """
-                )
+def last_update() -> str:
+    """
+    Returns the most recent date that can be requested, 'YYYY-MM-DD'.
+    """
+    return (datetime.now() - timedelta(days=UPDATE_DELAY)).strftime("%Y-%m-%d")
 
-            filename = f"{geocode}_{past_date}_{date}.nc"
-            filename = filename.replace("-", "")
-
-            # the date range will be responsible for match the requests
-            # if the date is across months. For example a week that ends
-            # after the month.
-            df = pd.date_range(start=past_date, end=date)
-            year_set = set()
-            month_set = set()
-            day_set = set()
-            for date in df:
-                date_f = str(date)
-                iso_form = date_f.split(" ")[0]
-                year_, month_, day_ = iso_form.split("-")
-                year_set.add(year_)
-                month_set.add(month_)
-                day_set.add(day_)
-
-            # parsing the correct types
-            month = list(month_set)
-            day = list(day_set)
-            day.sort()
-            if len(year_set) == 1:
-                year = str(list(year_set)[0])
-            else:
-                year = list(year)
 
-    else:
+def _request_dates(past_date: Optional[str] = None, date: Optional[str] = None):
+    """
+    Validates the date range. Returns None if the dates are invalid,
+    the error is logged. There is no limit for the range, long ranges
+    are split by `planner.plan()`.
+
+    Returns:
+        (start, end, suffix): First and last days of the range and the
+                              dates to be used in the filename.
+    """
+    help = "Use `help(extract_reanalysis.download())` for more info."
+    format = "%Y-%m-%d"
+    iso_format = "YYYY-MM-DD"
+    re_format = r"\d{4}-\d{2}-\d{2}"
+    today = datetime.now()
+
+    if not date:
         raise Exception(
             f"""
             Bad usage.
@@ -233,91 +399,389 @@ def download(
         """
         )
 
-    try:
-        lat, lon = extract_latlons.from_geocode(geocode)
-        north, south, east, west = do_area(lat, lon)
-
-        conn.retrieve(
-            "reanalysis-era5-single-levels",
-            {
-                "product_type": "reanalysis",
-                "variable": [
-                    "2m_temperature",
-                    "total_precipitation",
-                    "2m_dewpoint_temperature",
-                    "mean_sea_level_pressure",
-                ],
-                "year": year,
-                "month": month,
-                "day": day,
-                "time": [
-                    "00:00",
-                    "03:00",
-                    "06:00",
-                    "09:00",
-                    "12:00",
-                    "15:00",
-                    "18:00",
-                    "21:00",
-                ],
-                "area": [
-                    north,
-                    west,
-                    south,
-                    east,
-                ],
-                "format": "netcdf",
-            },
-            f"{data_dir}/{filename}",
+    # check for right initial date format
+    if not re.match(re_format, date):
+        return logging.error(
+            f"""
+                Invalid initial date. Format:
+                {iso_format}
+                {help}
+        """
         )
-        logging.info(f"NetCDF {filename} downloaded at {data_dir}.")
 
-        return f"{data_dir}/{filename}"
+    ini_date = datetime.strptime(date, format)
+    suffix = date.replace("-", "")
+    # dataset has maximum of 7 days of update delay.
+    # in order to prevent requesting invalid dates,
+    # the max date is 7 days from today's date
+    max_update_delay = today - timedelta(days=UPDATE_DELAY)
+    if ini_date > max_update_delay:
+        raise Exception(
+            f"""
+                Invalid date. The last update date is:
+                {datetime.strftime(max_update_delay, format)}
+                {help}
+        """
+        )
 
-    except Exception as e:
-        logging.error(e)
+    # an end date can be passed to define the date range
+    # if there is no end date, only the day specified on
+    # `date` will be downloaded
+    if not past_date:
+        return date, date, suffix
 
+    # check for right end date format
+    if not re.match(re_format, past_date):
+        return logging.error(
+            f"""
+                Invalid end date. Format:
+                {iso_format}
+                {help}
+        """
+        )
 
-def _parse_data(data, column_name):
-    df = pd.DataFrame(data)
-    df["date"] = df["date"].dt.floor("D")
-    result = df.groupby("date").agg(
-        var_min=("var", "min"), var_med=("var", "mean"), var_max=("var", "max")
-    )
+    # end date can't be bigger than initial date
+    end_date = datetime.strptime(past_date, format)
+    if end_date >= ini_date:
+        return logging.error(
+            f"""
+                Past date can't be more recent than the initial date.
+                {help}
+        """
+        )
+
+    suffix = f"{past_date}_{date}".replace("-", "")
+    return past_date, date, suffix
+
+
+# output column prefix of each variable, in the order of the DataFrame
+COLUMNS = {"t2m": "temp", "tp": "precip", "msl": "pressao", "rh": "umid"}
+AGGREGATES = {"min": "min", "med": "mean", "max": "max"}
+# float64 arrays alive at the same time while parsing a time step,
+# counting the loaded variables, unit conversions and aggregation
+MEMORY_FACTOR = 6
+
+
+def _daily_aggregates(ds, geocode: str):
+    """
+    Averages every variable over the coordinates of the dataset and
+    aggregates the time series into daily min, mean and max values,
+    for all variables at once.
+    """
+    with metrics.timer("to_dataframe.aggregate", geocode=geocode) as m:
+        spatial = ds[list(COLUMNS)].mean(dim=["latitude", "longitude"], skipna=False)
+        df = spatial.to_dataframe()[list(COLUMNS)]
+        df.index = df.index.floor("D").rename("date")
+
+        daily = df.groupby(level="date").agg(list(AGGREGATES.values()))
+        daily.columns = [
+            f"{COLUMNS[var]}_{name}"
+            for var, agg in daily.columns
+            for name, func in AGGREGATES.items()
+            if func == agg
+        ]
+        daily.insert(0, "geocodigo", geocode)
+        m["rows"] = len(daily)
+        return daily
+
+
+def _convert(ds):
+    """
+    Parses the units of a loaded dataset to br's units and computes
+    the relative humidity, in place of the dewpoint temperature.
+    """
+    import xarray as xr
+
+    with metrics.timer("to_dataframe.convert", values=ds.t2m.size):
+        t2m = ds.t2m - 273.15
+        tp = ds.tp * 1000
+        msl = ds.msl / 100
+        d2m = ds.d2m - 273.15
+        # relative_humidity = temperature/dewpoint_temperature
+        with metrics.timer("to_dataframe.humidity", values=d2m.size):
+            humidity.relative_humidity(t2m.values, d2m.values, out=d2m.values)
+        return xr.Dataset(dict(t2m=t2m, tp=tp, msl=msl, rh=d2m))
+
+
+def _load(ds):
+    with metrics.timer("to_dataframe.load") as m:
+        ds = ds.load()
+        m["bytes"] = ds.nbytes
+        return ds
+
+
+def _time_chunks(ds, max_memory: int) -> list:
+    """
+    Splits the time dimension in slices of whole days, each one using
+    at most `max_memory` bytes once loaded and converted. A single day
+    is the smallest slice.
+    """
+    step_bytes = ds.latitude.size * ds.longitude.size * 8 * MEMORY_FACTOR
+    max_steps = max(1, int(max_memory // step_bytes))
+
+    days = ds.time.dt.floor("D").values
+    # index of the first time step of each day
+    starts = [0] + [i for i in range(1, len(days)) if days[i] != days[i - 1]]
+    starts.append(len(days))
+
+    chunks, begin = [], 0
+    for start, end in zip(starts[1:], starts[2:] + [None]):
+        if end is None or end - begin > max_steps:
+            chunks.append(slice(begin, start))
+            begin = start
+    return chunks
+
+
+def to_dataframe(
+    file,
+    geocode: Optional[Union[int, str]] = None,
+    max_memory: Optional[int] = None,
+    past_date: Optional[str] = None,
+    date: Optional[str] = None,
+):
+    """
+    Parses a NetCDF file into a DataFrame with the format described above.
+    If `geocode` is passed, only the four coordinates of its `do_area` are
+    taken from the file, so a file downloaded with `download_batch()` can
+    be parsed for each of the cities it covers. Otherwise, all coordinates
+    in the file are used and the geocode is taken from the filename.
+
+    If `max_memory` is passed, the file is read lazily and processed in
+    chunks of whole days, each one using around `max_memory` bytes at most,
+    so files larger than the memory available can be parsed.
+
+    GRIB files are decoded message by message (@see `grib` module), which
+    never loads the whole file, so `max_memory` isn't needed for them.
+
+    `file` may also be the root of an archive (@see `archive` module), read
+    for the `geocode` from `past_date` to `date` without opening any of
+    the downloaded files, usage:
+
+    to_dataframe(archive.ARCHIVE_DIR, 3304557, past_date='2021-01-01')
+
+    Raises:
+        ValueError : If the cell of the geocode isn't in the grid of the file.
+    """
+    import pandas as pd
+    import xarray as xr
+
+    if archive.is_archive(file):
+        if geocode is None:
+            raise ValueError("A geocode is needed to read from an archive")
+        ds = archive.dataset(geocode, past_date or date, date, root=file)
+        return _daily_aggregates(_convert(_load(ds)), str(geocode))
+
+    if grib.is_grib(file):
+        if geocode is None:
+            match = _GEOCODE_FILE.match(Path(file).name)
+            if not match:
+                raise ValueError(f"Geocode of {file} needed to parse GRIB files")
+            geocode = match.group(1)
+        return grib.to_dataframe(file, [geocode])
+
+    with xr.open_dataset(file, engine="netcdf4") as ds:
+        if geocode is None:
+            geocode = str(file).split("/")[-1].split("_")[0]
+        else:
+            with metrics.timer("lookup", geocodes=1):
+                lat, lon = extract_latlons.from_geocode(int(geocode))
+                north, south, east, west = do_area(lat, lon)
+            # nearest within half a cell, the coordinates are float32
+            try:
+                ds = ds.sel(
+                    latitude=[north, south],
+                    longitude=[west, east],
+                    method="nearest",
+                    tolerance=globals.GRID_RESOLUTION / 2,
+                )
+            except KeyError:
+                raise ValueError(f"The cell of {geocode} is not in the grid of {file}")
+            geocode = str(geocode)
+
+        if max_memory is None:
+            return _daily_aggregates(_convert(_load(ds)), geocode)
+
+        dfs = [
+            _daily_aggregates(_convert(_load(ds.isel(time=chunk))), geocode)
+            for chunk in _time_chunks(ds, max_memory)
+        ]
+        with metrics.timer("to_dataframe.merge", frames=len(dfs)):
+            return pd.concat(dfs)
+
+
+def to_dataframe_batch(files: dict):
+    """
+    Parses the files returned by `download_batch()` into a single
+    DataFrame, with the series of every geocode contained in them.
+    Cities sharing a `do_area` cell (@see `spatial` module) have the
+    same series, so each cell is parsed once and copied to its cities.
+    GRIB files are read once for all their geocodes.
+    """
+    import pandas as pd
+
+    dfs = []
+    for file, geocodes in files.items():
+        if grib.is_grib(file):
+            dfs.append(grib.to_dataframe(file, geocodes))
+            continue
+        parsed = dict()
+        for in_cell in spatial.groups(geocodes).values():
+            df = to_dataframe(file, in_cell[0])
+            parsed[in_cell[0]] = df
+            for geocode in in_cell[1:]:
+                parsed[geocode] = df.assign(geocodigo=str(geocode))
+        dfs += [parsed[int(g)] for g in geocodes if int(g) in parsed]
 
-    result.columns = result.columns.str.replace("var", column_name)
-    return result
+    with metrics.timer("to_dataframe.merge", frames=len(dfs)):
+        return pd.concat(dfs)
 
 
-def _retrieve_data(row):
-    parsed_date = row.time.values.astype("M8[ms]").astype("O")
-    avg_vals = np.mean(row.values)
-    return dict(date=parsed_date, var=avg_vals)
+_GEOCODE_FILE = re.compile(r"^(\d{7})_")
 
 
-def to_dataframe(file):
-    # Load netCDF file into xarray dataset
-    ds = xr.load_dataset(file, engine="netcdf4")
-    geocode = file.split("/")[-1].split("_")[0]
+def _file_geocodes(file: str, lats, lons) -> list:
+    """
+    Geocode of a file downloaded by `download()`, or the cities whose
+    cells are inside the grid of any other file, like the regions of
+    `download_batch()`.
+    """
+    match = _GEOCODE_FILE.match(Path(file).name)
+    if match:
+        return [int(match.group(1))]
+    return spatial.in_bbox(lats.max(), lons.min(), lats.min(), lons.max(), cells=True)
 
-    # Parse units to br's units
-    t2m = ds.t2m - 273.15
-    tp = ds.tp * 1000
-    msl = ds.msl / 100
-    d2m = ds.d2m - 273.15
-    # relative_humidity = temperature/dewpoint_temperature
-    rh = (
-        mpcalc.relative_humidity_from_dewpoint(t2m * units.degC, d2m * units.degC) * 100
+
+def _columns(file: str, geocodes: Optional[list], max_memory: Optional[int]) -> dict:
+    """
+    Parses a file in a worker of `to_dataframe_many()`. Returns numpy
+    arrays instead of a DataFrame, which are faster to send back.
+    """
+    import numpy as np
+    import xarray as xr
+
+    if geocodes is None and grib.is_grib(file):
+        geocodes = _file_geocodes(file, *grib.grid(file))
+    elif geocodes is None:
+        with xr.open_dataset(file, engine="netcdf4") as ds:
+            geocodes = _file_geocodes(file, ds.latitude.values, ds.longitude.values)
+    if not geocodes:
+        raise ValueError(f"No city found in the grid of {file}")
+
+    dfs = []
+    groups = spatial.groups(geocodes)
+    if grib.is_grib(file):
+        # same order as the NetCDF files, cities sorted by cell
+        in_order = [geocode for in_cell in groups.values() for geocode in in_cell]
+        df = grib.to_dataframe(file, in_order)
+        dfs = [(part, int(g)) for g, part in df.groupby("geocodigo", sort=False)]
+    else:
+        for in_cell in groups.values():
+            df = to_dataframe(file, in_cell[0], max_memory)
+            dfs += [(df, geocode) for geocode in in_cell]
+
+    columns = dict(
+        date=np.concatenate([df.index.values.astype("datetime64[D]") for df, _ in dfs]),
+        geocodigo=np.concatenate(
+            [np.full(len(df), geocode, dtype=np.int32) for df, geocode in dfs]
+        ),
     )
+    for column in dfs[0][0].columns[1:]:
+        columns[column] = np.concatenate([df[column].values for df, _ in dfs])
+    return columns
+
+
+def to_dataframe_many(
+    paths: Union[Iterable[str], dict],
+    workers: Optional[int] = None,
+    max_memory: Optional[int] = None,
+    errors: str = "log",
+):
+    """
+    Parses many NetCDF or GRIB files in a pool of processes into a single
+    DataFrame, with the format of `to_dataframe()`, usage:
 
-    temperature = _parse_data([_retrieve_data(v) for v in t2m], "temp")
-    precipitation = _parse_data([_retrieve_data(v) for v in tp], "precip")
-    rel_hum = _parse_data([_retrieve_data(v) for v in rh], "umid")
-    pressure = _parse_data([_retrieve_data(v) for v in msl], "pressao")
+    to_dataframe_many(Path("data").glob("*.nc"), workers=8)
+    to_dataframe_many(download_batch(geocodes=33, date='2022-10-04'))
 
-    dfs = [temperature, precipitation, pressure, rel_hum]
-    merged_dfs = reduce(lambda l, r: pd.merge(l, r, on=["date"]), dfs)
+    Each file is parsed by a worker process, which returns the columns as
+    numpy arrays, concatenated into the table at the end. The geocodes of
+    each file are the ones of the dict returned by `download_batch()` or,
+    for a list of paths, the geocode in the name of the files downloaded
+    by `download()`, or the cities whose cells are inside the grid of the
+    file otherwise.
+
+    Attrs:
+        paths (iterable or dict): Paths of the files, or a dict mapping
+                                  each file to its geocodes.
+        workers (opt(int)): Number of processes, the number of CPUs by
+                            default. With 1, files are parsed serially in
+                            the current process.
+        max_memory (opt(int)): Memory used to parse each file, see
+                               `to_dataframe()`.
+        errors (str): "log" to skip the files that fail, logging the
+                      errors, or "raise" to raise the first error.
 
-    geocodes = [geocode for r in range(len(merged_dfs))]
-    merged_dfs.insert(0, "geocodigo", geocodes)
-    return merged_dfs
+    Returns:
+        DataFrame with the series of every file, empty with the columns
+        of `to_dataframe()` if none was parsed. Files that failed are
+        listed with their errors in `df.attrs["errors"]`.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if errors not in ("log", "raise"):
+        raise ValueError(f"Unknown errors option {errors}. Options: log, raise")
+    # the same file given twice, as a str and a Path, is parsed once
+    if isinstance(paths, dict):
+        in_file = dict()
+        for file, geocodes in paths.items():
+            in_file.setdefault(str(file), []).extend(int(g) for g in geocodes)
+        tasks = [(file, list(dict.fromkeys(g))) for file, g in in_file.items()]
+    else:
+        tasks = [(file, None) for file in dict.fromkeys(str(f) for f in paths)]
+
+    workers = min(workers or os.cpu_count() or 1, max(1, len(tasks)))
+    results, failed = dict(), dict()
+
+    def collect(file, get_result):
+        try:
+            results[file] = get_result()
+        except Exception as e:
+            if errors == "raise":
+                raise
+            logging.error(f"{file} failed: {e}")
+            failed[file] = str(e)
+
+    if workers == 1:
+        for file, geocodes in tasks:
+            collect(file, lambda: _columns(file, geocodes, max_memory))
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # HDF5 isn't safe to use in forked processes
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [
+                (file, pool.submit(_columns, file, geocodes, max_memory))
+                for file, geocodes in tasks
+            ]
+            for file, future in futures:
+                collect(file, future.result)
+
+    with metrics.timer("to_dataframe.merge", frames=len(results)):
+        parts = [results[file] for file, _ in tasks if file in results]
+        if parts:
+            columns = {c: np.concatenate([p[c] for p in parts]) for c in parts[0]}
+        else:
+            # no file parsed, same columns as `to_dataframe()`
+            columns = dict(date=np.array([], dtype="datetime64[D]"), geocodigo=[])
+            for prefix in COLUMNS.values():
+                for name in AGGREGATES:
+                    columns[f"{prefix}_{name}"] = np.array([], dtype=np.float64)
+        dates = columns.pop("date").astype("datetime64[ns]")
+        dates = pd.DatetimeIndex(dates, name="date")
+        df = pd.DataFrame(columns, index=dates)
+        df["geocodigo"] = df["geocodigo"].astype(str)
+        df.attrs["errors"] = failed
+        return df
@@ -2,17 +2,18 @@
 Globals variables used within cds_weather app.
 """
 
-import numpy as np
 from pathlib import Path
 import os
 
 workdir = os.path.dirname(os.path.realpath(__file__))
 
 
-LONGITUDES = list(np.arange(-90.0, 90.25, 0.25))
-LATITUDES = list(np.arange(-180.0, 180.25, 0.25))
+GRID_RESOLUTION = 0.25
+LATITUDES = [-90.0 + i * GRID_RESOLUTION for i in range(721)]
+LONGITUDES = [-180.0 + i * GRID_RESOLUTION for i in range(1441)]
 
 PROJECT_DIR = Path(workdir).parent
 DATA_DIR = PROJECT_DIR / "data"
+CACHE_DIR = DATA_DIR / "cache"
 
 CDSAPIRC_PATH = Path.home() / ".cdsapirc"
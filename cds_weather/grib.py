@@ -0,0 +1,485 @@
+"""
+Streaming decoder of the GRIB files of `reanalysis-era5-single-levels`.
+
+GRIB is the native format of ERA5: requesting it skips the conversion to
+NetCDF in the Copernicus queue and the files are smaller. A GRIB file is
+a sequence of messages, each one with a single variable at a single time.
+The decoder reads the file message by message with `eccodes`, keeping
+only the four grid points of the `do_area` cell of each city, and updates
+the daily min, sum, count and max of every cell as the messages arrive.
+The whole file is never loaded, the memory used depends on the number
+of cells and days, not on the size of the grid.
+
+Values are converted and aggregated as in `extract_reanalysis.to_dataframe()`:
+the relative humidity is computed on each grid point, the variables are
+averaged over the four points of the cell and then aggregated by day, so
+both formats give the same DataFrame.
+
+Methods
+-------
+
+messages(file)            : Yields the variable, time and values of each
+                            message of a file.
+
+grid(file)                : Latitudes and longitudes of the first message.
+
+to_dataframe(file, geocodes) : Parses a GRIB file into a DataFrame with
+                               the format of `to_dataframe_batch()`.
+
+write(file, ds)           : Writes a Dataset with the variables of the
+                            NetCDF files as GRIB messages.
+"""
+
+import logging
+import numpy as np
+
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from cds_weather import humidity, metrics, spatial
+
+# ERA5 short names, as named in the NetCDF files
+SHORT_NAMES = {"2t": "t2m", "tp": "tp", "msl": "msl", "2d": "d2m"}
+PARAM_IDS = {"t2m": 167, "tp": 228, "msl": 151, "d2m": 168}
+EXTENSIONS = (".grib", ".grb", ".grib1", ".grib2")
+
+# output columns, in the order of `extract_reanalysis.to_dataframe()`
+VARIABLES = ["temp", "precip", "pressao", "umid"]
+AGGREGATES = ["min", "med", "max"]
+# bits of the simple packing used by `write()`
+BITS_PER_VALUE = 24
+
+
+def is_grib(file) -> bool:
+    return Path(str(file)).suffix.lower() in EXTENSIONS
+
+
+def _grid(handle) -> tuple:
+    """
+    Latitudes and longitudes of a regular lat/lon message, with the
+    longitudes between -180 and 180.
+    """
+    import eccodes
+
+    ni = eccodes.codes_get(handle, "Ni")
+    nj = eccodes.codes_get(handle, "Nj")
+    lat0 = eccodes.codes_get(handle, "latitudeOfFirstGridPointInDegrees")
+    lon0 = eccodes.codes_get(handle, "longitudeOfFirstGridPointInDegrees")
+    dlat = eccodes.codes_get(handle, "jDirectionIncrementInDegrees")
+    dlon = eccodes.codes_get(handle, "iDirectionIncrementInDegrees")
+    if not eccodes.codes_get(handle, "jScansPositively"):
+        dlat = -dlat
+    lats = lat0 + dlat * np.arange(nj)
+    lons = (lon0 + dlon * np.arange(ni) + 180) % 360 - 180
+    return lats, lons
+
+
+def _read(f) -> bytes:
+    """
+    Reads the next message of a file, skipping any bytes before it.
+    Returns an empty bytes object at the end of the file.
+    """
+    header = b""
+    while True:
+        header = (header + f.read(16 - len(header)))[-16:]
+        if len(header) < 8:
+            return b""
+        start = header.find(b"GRIB")
+        if start == 0:
+            break
+        header = header[start:] if start > 0 else header[-3:]
+    if header[7] == 1:
+        size = int.from_bytes(header[4:7], "big")
+        if size & 0x800000:
+            size, header = _large_size(f, header)
+    else:
+        size = int.from_bytes(header[8:16], "big")
+    return header[:size] + f.read(max(0, size - len(header)))
+
+
+def _large_size(f, message: bytes) -> tuple:
+    """
+    Length of a GRIB 1 message with the high bit of its length set. Over
+    16 MB, ECMWF stores the length divided by 120 and the padding to be
+    subtracted in place of the length of the binary data section, which
+    is then smaller than 120. Messages between 8 and 16 MB have the high
+    bit set by their own length.
+
+    Returns:
+        The length of the message and its bytes read so far.
+    """
+    flags = message[15]
+    offset = 8
+    for present in (True, flags & 0x80, flags & 0x40):
+        if present:
+            message += f.read(max(0, offset + 3 - len(message)))
+            offset += int.from_bytes(message[offset : offset + 3], "big")
+    message += f.read(max(0, offset + 3 - len(message)))
+
+    size = int.from_bytes(message[4:7], "big")
+    padding = int.from_bytes(message[offset : offset + 3], "big")
+    if padding < 120:
+        size = (size & 0x7FFFFF) * 120 - padding + 4
+    return size, message
+
+
+def _sections(message: bytes) -> tuple:
+    """
+    Offsets of the product definition (PDS), grid (GDS), bitmap (BMS)
+    and binary data (BDS) sections of a GRIB 1 message.
+    """
+    pds = 8
+    flags = message[pds + 7]
+    gds = pds + int.from_bytes(message[pds : pds + 3], "big")
+    bms = gds + (int.from_bytes(message[gds : gds + 3], "big") if flags & 0x80 else 0)
+    bds = bms + (int.from_bytes(message[bms : bms + 3], "big") if flags & 0x40 else 0)
+    return pds, gds, bms, bds
+
+
+def _layout_key(message: bytes, sections: tuple) -> bytes:
+    """
+    The message headers without the reference time: every message of a
+    variable in a request has the same key.
+    """
+    pds, gds, bms, bds = sections
+    return (
+        message[pds : pds + 12]
+        + message[pds + 17 : pds + 24]
+        + message[pds + 25 : bms]
+        + bytes([message[bds + 3] & 0xF0])
+    )
+
+
+def _reference_time(message: bytes) -> np.datetime64:
+    pds = message[8:]
+    year = (pds[24] - 1) * 100 + pds[12]
+    return np.datetime64(
+        f"{year:04d}-{pds[13]:02d}-{pds[14]:02d}T{pds[15]:02d}:{pds[16]:02d}", "ns"
+    )
+
+
+def _signed(data: bytes) -> int:
+    # GRIB 1 integers have a sign bit instead of the two's complement
+    value = int.from_bytes(data, "big")
+    sign_bit = 1 << (8 * len(data) - 1)
+    return -(value & (sign_bit - 1)) if value & sign_bit else value
+
+
+def _unpack(message: bytes, sections: tuple, size: int) -> Optional[np.ndarray]:
+    """
+    Unpacks the values of a GRIB 1 message with simple packing, as
+    (reference + packed * 2 ** binary scale) / 10 ** decimal scale.
+    Returns None for widths other than 0, 8, 16, 24 or 32 bits.
+    """
+    pds, _, _, bds = sections
+    binary_scale = _signed(message[bds + 4 : bds + 6])
+    decimal_scale = _signed(message[pds + 26 : pds + 28])
+    # reference value, a 32 bits IBM floating point number
+    ibm = message[bds + 6 : bds + 10]
+    reference = int.from_bytes(ibm[1:], "big") * 16.0 ** ((ibm[0] & 0x7F) - 64 - 6)
+    reference = -reference if ibm[0] & 0x80 else reference
+
+    bits = message[bds + 10]
+    data = message[bds + 11 : bds + 11 + (size * bits + 7) // 8]
+    if bits == 0:
+        packed = np.zeros(size)
+    elif bits in (8, 16, 32):
+        packed = np.frombuffer(data, dtype=f">u{bits // 8}", count=size)
+    elif bits == 24:
+        octets = np.frombuffer(data, dtype=np.uint8, count=3 * size).reshape(size, 3)
+        octets = octets.astype(np.uint32)
+        packed = octets[:, 0] << 16 | octets[:, 1] << 8 | octets[:, 2]
+    else:
+        return None
+    return (packed * 2.0**binary_scale + reference) * 10.0**-decimal_scale
+
+
+def _decode(message: bytes) -> tuple:
+    """
+    Decodes a message with `eccodes`.
+
+    Returns:
+        The layout of the message, a dict with its `variable`, the `lats`
+        and `lons` of its grid, the `offset` of its valid time to its
+        reference time and whether it is `simple` enough for `_unpack()`,
+        followed by its valid time and its values.
+    """
+    import eccodes
+
+    def datetime(date: int, time: int) -> np.datetime64:
+        return np.datetime64(
+            f"{date // 10000:04d}-{date // 100 % 100:02d}-{date % 100:02d}"
+            f"T{time // 100:02d}:{time % 100:02d}",
+            "ns",
+        )
+
+    handle = eccodes.codes_new_from_message(message)
+    try:
+        get = eccodes.codes_get_long
+        reference = datetime(get(handle, "dataDate"), get(handle, "dataTime"))
+        valid = datetime(get(handle, "validityDate"), get(handle, "validityTime"))
+        lats, lons = _grid(handle)
+        layout = dict(
+            variable=SHORT_NAMES.get(eccodes.codes_get_string(handle, "shortName")),
+            lats=lats,
+            lons=lons,
+            offset=valid - reference,
+            simple=(
+                get(handle, "edition") == 1
+                and not get(handle, "bitmapPresent")
+                and message[_sections(message)[3] + 3] & 0xF0 == 0
+                and get(handle, "numberOfValues") == lats.size * lons.size
+            ),
+        )
+        values = eccodes.codes_get_values(handle)
+        if get(handle, "bitmapPresent"):
+            missing = eccodes.codes_get_double(handle, "missingValue")
+            values[values == missing] = np.nan
+        return layout, valid, values
+    finally:
+        eccodes.codes_release(handle)
+
+
+def messages(file: str) -> Iterator[tuple]:
+    """
+    Reads a GRIB file message by message.
+
+    Creating an `eccodes` handle costs more than unpacking the values of
+    a small grid, so `eccodes` only decodes the first message of each
+    variable. The next GRIB 1 messages with the same headers and simple
+    packing, as the ones of ERA5, are unpacked with numpy, any other
+    message is decoded by `eccodes`.
+
+    Returns:
+        Iterator of (variable, time, lats, lons, values) tuples, with the
+        NetCDF name of the variable, its valid time as numpy datetime64,
+        the coordinates of the grid and the values with shape (lats, lons),
+        NaN where a bitmap marks them as missing. Messages of other
+        variables are skipped.
+    """
+    layouts = dict()
+    with open(file, "rb") as f:
+        while True:
+            message = _read(f)
+            if not message:
+                break
+
+            key, sections, values = None, None, None
+            if message[7] == 1:
+                sections = _sections(message)
+                key = _layout_key(message, sections)
+            layout = layouts.get(key)
+            if layout is not None and layout["variable"] is None:
+                continue
+            if layout is not None and layout["simple"]:
+                size = layout["lats"].size * layout["lons"].size
+                values = _unpack(message, sections, size)
+                time = _reference_time(message) + layout["offset"]
+            if values is None:
+                layout, time, values = _decode(message)
+                if key is not None:
+                    layouts[key] = layout
+                if layout["variable"] is None:
+                    continue
+
+            lats, lons = layout["lats"], layout["lons"]
+            yield layout["variable"], time, lats, lons, values.reshape(
+                lats.size, lons.size
+            )
+
+
+def grid(file: str) -> tuple:
+    """
+    Returns the latitudes and longitudes of the first message of a file,
+    without decoding its values.
+    """
+    import eccodes
+
+    with open(file, "rb") as f:
+        handle = eccodes.codes_grib_new_from_file(f)
+        if handle is None:
+            raise ValueError(f"No GRIB message in {file}")
+        try:
+            return _grid(handle)
+        finally:
+            eccodes.codes_release(handle)
+
+
+def _points(cells: list, lats, lons) -> tuple:
+    """
+    Rows and columns of the four points of each cell in the grid, the
+    nearest grid points as in `to_dataframe()`.
+    """
+    north, south, east, west = (np.array(c) for c in zip(*cells))
+    rows = [np.abs(lats[:, None] - lat[None, :]).argmin(0) for lat in (north, south)]
+    cols = [np.abs(lons[:, None] - lon[None, :]).argmin(0) for lon in (west, east)]
+    # points of each cell in the order (n, w), (n, e), (s, w), (s, e)
+    return (
+        np.stack([rows[0], rows[0], rows[1], rows[1]], axis=1),
+        np.stack([cols[0], cols[1], cols[0], cols[1]], axis=1),
+    )
+
+
+class _Days:
+    """
+    Daily min, sum, count and max of each cell, updated by time step.
+    """
+
+    def __init__(self, n_cells: int):
+        self.n_cells = n_cells
+        self.stats = dict()
+
+    def update(self, time, values: np.ndarray):
+        # values with shape (variables, cells)
+        day = time.astype("datetime64[D]")
+        if day not in self.stats:
+            shape = values.shape
+            self.stats[day] = [
+                np.full(shape, np.inf),
+                np.zeros(shape),
+                np.zeros(shape),
+                np.full(shape, -np.inf),
+            ]
+        low, total, count, high = self.stats[day]
+        valid = ~np.isnan(values)
+        np.fmin(low, values, out=low)
+        np.fmax(high, values, out=high)
+        total += np.where(valid, values, 0)
+        count += valid
+
+    def table(self) -> tuple:
+        """
+        Returns the days and an array with shape (days, cells, 12), with
+        the min, mean and max of each variable.
+        """
+        days = sorted(self.stats)
+        table = np.empty((len(days), self.n_cells, len(VARIABLES) * 3))
+        for i, day in enumerate(days):
+            low, total, count, high = self.stats[day]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = total / count
+            low = np.where(count > 0, low, np.nan)
+            high = np.where(count > 0, high, np.nan)
+            # columns ordered by variable, then min, mean, max
+            table[i] = np.stack([low, mean, high], axis=1).reshape(-1, self.n_cells).T
+        return np.array(days, dtype="datetime64[ns]"), table
+
+
+def _step(fields: dict) -> np.ndarray:
+    """
+    Converts the points of a time step and averages each cell, as in
+    `extract_reanalysis._convert()`. Returns (variables, cells) values.
+    """
+    t2m = fields["t2m"] - 273.15
+    d2m = fields["d2m"] - 273.15
+    humidity.relative_humidity(t2m, d2m, out=d2m)
+    points = [t2m, fields["tp"] * 1000, fields["msl"] / 100, d2m]
+    return np.stack([p.mean(axis=1) for p in points])
+
+
+def to_dataframe(file, geocodes: Iterable[int]):
+    """
+    Parses a GRIB file into a DataFrame with the format of
+    `extract_reanalysis.to_dataframe_batch()`, indexed by date with the
+    `geocodigo` column. The file is read once for all the geocodes,
+    cities sharing a cell (@see `spatial` module) are aggregated once.
+
+    Attrs:
+        file (str): Path of the GRIB file.
+        geocodes (iterable): Cities to be parsed, their cells must be
+                             inside the grid of the file.
+
+    Returns:
+        DataFrame with the series of each geocode, in the given order.
+    """
+    import pandas as pd
+
+    geocodes = list(dict.fromkeys(int(g) for g in geocodes))
+    groups = spatial.groups(geocodes)
+    cells = list(groups)
+    if not cells:
+        raise ValueError(f"No city to be parsed in {file}")
+
+    days, points = _Days(len(cells)), None
+    pending = dict()
+    decoded = 0
+
+    with metrics.timer("to_dataframe.load", format="grib") as m:
+        for variable, time, lats, lons, values in messages(file):
+            if points is None:
+                points = _points(cells, lats, lons)
+            decoded += 1
+            step = pending.setdefault(time, dict())
+            step[variable] = values[points]
+            if len(step) == len(PARAM_IDS):
+                days.update(time, _step(pending.pop(time)))
+        m["messages"] = decoded
+
+    if pending:
+        logging.warning(f"{len(pending)} incomplete time steps in {file} skipped.")
+
+    dates, table = days.table()
+    index = {g: i for i, in_cell in enumerate(groups.values()) for g in in_cell}
+    order = [g for g in geocodes if g in index]
+    rows = table[:, [index[g] for g in order], :]
+
+    with metrics.timer("to_dataframe.merge", frames=len(order)):
+        columns = [f"{v}_{a}" for v in VARIABLES for a in AGGREGATES]
+        df = pd.DataFrame(
+            rows.transpose(1, 0, 2).reshape(-1, len(columns)),
+            columns=columns,
+            index=pd.DatetimeIndex(np.tile(dates, len(order)), name="date"),
+        )
+        df.insert(0, "geocodigo", np.repeat([str(g) for g in order], len(dates)))
+        return df
+
+
+def write(file: str, ds, bits_per_value: int = BITS_PER_VALUE) -> str:
+    """
+    Writes a Dataset with the `t2m`, `tp`, `msl` and `d2m` variables on
+    a regular lat/lon grid, like the NetCDF files of the API, as GRIB 1
+    messages, one per variable and time, ordered by time.
+    """
+    import eccodes
+
+    lats, lons = ds.latitude.values, ds.longitude.values
+    sample = eccodes.codes_grib_new_from_samples("regular_ll_sfc_grib1")
+    grid = dict(
+        Ni=len(lons),
+        Nj=len(lats),
+        latitudeOfFirstGridPointInDegrees=float(lats[0]),
+        latitudeOfLastGridPointInDegrees=float(lats[-1]),
+        longitudeOfFirstGridPointInDegrees=float(lons[0]) % 360,
+        longitudeOfLastGridPointInDegrees=float(lons[-1]) % 360,
+        iDirectionIncrementInDegrees=abs(float(lons[1] - lons[0]))
+        if len(lons) > 1
+        else 0.25,
+        jDirectionIncrementInDegrees=abs(float(lats[1] - lats[0]))
+        if len(lats) > 1
+        else 0.25,
+        jScansPositively=int(len(lats) > 1 and lats[1] > lats[0]),
+        bitsPerValue=bits_per_value,
+    )
+    for key, value in grid.items():
+        eccodes.codes_set(sample, key, value)
+
+    try:
+        with open(file, "wb") as f:
+            for time in ds.time.values:
+                stamp = str(np.datetime_as_string(time, unit="m"))
+                for variable, param in PARAM_IDS.items():
+                    handle = eccodes.codes_clone(sample)
+                    eccodes.codes_set(handle, "paramId", param)
+                    eccodes.codes_set(
+                        handle, "dataDate", int(stamp[:10].replace("-", ""))
+                    )
+                    eccodes.codes_set(
+                        handle, "dataTime", int(stamp[11:].replace(":", ""))
+                    )
+                    values = ds[variable].sel(time=time).values.astype(np.float64)
+                    eccodes.codes_set_values(handle, values.ravel())
+                    eccodes.codes_write(handle, f)
+                    eccodes.codes_release(handle)
+    finally:
+        eccodes.codes_release(sample)
+    return str(file)
@@ -0,0 +1,98 @@
+"""
+Relative humidity from the temperature and the dewpoint temperature.
+
+The relative humidity is the ratio between the saturation vapor pressure
+at the dewpoint and at the temperature. The saturation vapor pressure is
+given by Bolton (1980), the Magnus formula used by MetPy:
+
+    es(T) = 6.112 hPa * exp(17.67 * T / (T + 243.5)),  T in celsius
+
+so the relative humidity can be computed with numpy only, without the
+unit arrays of MetPy:
+
+    rh = 100 * exp(17.67 * Td / (Td + 243.5) - 17.67 * T / (T + 243.5))
+
+The numpy kernel keeps the dtype of the input, using a single temporary
+array, and can write the result in place. MetPy is still available as
+a reference backend, if installed. Recent MetPy releases compute the
+saturation vapor pressure with Ambaum (2020) instead of Bolton, which
+differs from the numpy kernel by less than 0.3 percentage points.
+
+Methods
+-------
+
+relative_humidity(temperature, dewpoint, backend) : Relative humidity in %.
+"""
+
+import numpy as np
+
+from typing import Optional
+
+# backend used by `extract_reanalysis.to_dataframe()`
+BACKEND = "numpy"
+BACKENDS = ["numpy", "metpy"]
+
+_A = 17.67
+_B = 243.5
+
+
+def _numpy(temperature, dewpoint, out: Optional[np.ndarray] = None) -> np.ndarray:
+    temperature = np.asarray(temperature)
+    dewpoint = np.asarray(dewpoint)
+    if out is None:
+        out = np.empty(np.broadcast(temperature, dewpoint).shape, dewpoint.dtype)
+
+    # T / (T + B) = 1 - B / (T + B), which only reads each input once,
+    # so `out` may be one of the inputs
+    tmp = np.add(temperature, _B, dtype=out.dtype)
+    np.divide(_B, tmp, out=tmp)
+
+    np.add(dewpoint, _B, out=out)
+    np.divide(_B, out, out=out)
+
+    np.subtract(tmp, out, out=out)
+    out *= _A
+    np.exp(out, out=out)
+    out *= 100
+    return out
+
+
+def _metpy(temperature, dewpoint, out: Optional[np.ndarray] = None) -> np.ndarray:
+    import metpy.calc as mpcalc
+    from metpy.units import units
+
+    rh = mpcalc.relative_humidity_from_dewpoint(
+        np.asarray(temperature) * units.degC, np.asarray(dewpoint) * units.degC
+    )
+    rh = np.asarray(rh.to("percent").magnitude)
+    if out is None:
+        return rh
+    out[...] = rh
+    return out
+
+
+def relative_humidity(
+    temperature,
+    dewpoint,
+    backend: Optional[str] = None,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Returns the relative humidity in percentage.
+
+    Attrs:
+        temperature (array_like): Temperature in celsius degrees.
+        dewpoint (array_like): Dewpoint temperature in celsius degrees.
+        backend (opt(str)): "numpy" or "metpy", `BACKEND` by default.
+        out (opt(ndarray)): Array where the result is written, it may be
+                            the `dewpoint` array itself.
+
+    Returns:
+        rh (ndarray): Relative humidity, 100 at saturation.
+    """
+    backend = backend or BACKEND
+    if backend == "numpy":
+        return _numpy(temperature, dewpoint, out)
+    if backend == "metpy":
+        return _metpy(temperature, dewpoint, out)
+    raise ValueError(f"Unknown backend {backend}. Options: {BACKENDS}")
@@ -0,0 +1,173 @@
+"""
+Incremental updates, requesting only the days not stored yet.
+
+A watermark is the most recent date stored for a geocode. It is read from
+the database table (@see `loader.latest_dates()`) or, without a database,
+from the names of the files downloaded by `download()`, with the format
+GEOCODE_PASTDATE_DATE.nc or GEOCODE_DATE.nc (.grib in GRIB), and from the
+`watermarks.json` file that `update()` keeps in the data directory. Each
+geocode is then missing the days from its watermark to the last date
+available in the dataset, which has a delay of
+`extract_reanalysis.UPDATE_DELAY` days.
+
+Geocodes missing the same days are grouped and requested together with
+`download_batch()`, so a daily update costs a single day of data for the
+cities, regardless of the range already stored.
+
+Methods
+-------
+
+watermarks(conn, data_dir) : Most recent date stored for each geocode.
+
+gaps(geocodes, marks)      : Groups the geocodes by the range they miss.
+
+update(geocodes, conn)     : Downloads the missing ranges and, if a
+                             connection is passed, loads them into
+                             the database.
+"""
+
+import re
+import json
+import logging
+
+from pathlib import Path
+from typing import Iterable, Optional, Union
+from datetime import datetime, timedelta
+
+from cds_weather import extract_reanalysis, globals, loader, regions
+
+_FILENAME = re.compile(r"^(\d{7})_(\d{8})(?:_(\d{8}))?\.(?:nc|grib)$")
+WATERMARKS_FILE = "watermarks.json"
+
+
+def _read_marks(data_dir: Path) -> dict:
+    try:
+        with open(Path(data_dir) / WATERMARKS_FILE) as f:
+            return {int(geocode): date for geocode, date in json.load(f).items()}
+    except (OSError, ValueError):
+        return dict()
+
+
+def _write_marks(data_dir: Path, new_marks: dict):
+    marks = _read_marks(data_dir)
+    for geocode, date in new_marks.items():
+        marks[geocode] = max(marks.get(geocode, date), date)
+    with open(Path(data_dir) / WATERMARKS_FILE, "w") as f:
+        json.dump({str(g): d for g, d in sorted(marks.items())}, f, indent=1)
+
+
+def _from_files(data_dir: Path) -> dict:
+    marks = _read_marks(data_dir)
+    for file in Path(data_dir).iterdir():
+        match = _FILENAME.match(file.name)
+        if not match:
+            continue
+        geocode = int(match.group(1))
+        last = match.group(3) or match.group(2)
+        last = f"{last[:4]}-{last[4:6]}-{last[6:]}"
+        marks[geocode] = max(marks.get(geocode, last), last)
+    return marks
+
+
+def watermarks(conn=None, data_dir: Optional[str] = None) -> dict:
+    """
+    Returns the most recent date stored for each geocode.
+
+    Attrs:
+        conn (opt): psycopg2 or sqlite3 connection with the table of `loader`.
+                    If not passed, the dates are taken from the filenames.
+        data_dir (opt(str)): Directory of the downloaded files, used when
+                             there is no connection. `globals.DATA_DIR`
+                             by default.
+
+    Returns:
+        marks (dict): Date 'YYYY-MM-DD' of each geocode.
+    """
+    if conn is not None:
+        return loader.latest_dates(conn)
+    return _from_files(data_dir or globals.DATA_DIR)
+
+
+def gaps(
+    geocodes: Iterable[int],
+    marks: dict,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+) -> dict:
+    """
+    Groups the geocodes by the range of days they are missing.
+
+    Attrs:
+        geocodes (iterable): Geocodes to be updated.
+        marks (dict): Watermarks returned by `watermarks()`.
+        start (opt(str)): First date of geocodes without a watermark,
+                          'YYYY-MM-DD'. If None, these are skipped.
+        end (opt(str)): Last date to be requested. By default, the last
+                        date available, `extract_reanalysis.last_update()`.
+
+    Returns:
+        gaps (dict): {(first, last): [geocodes]} of each missing range.
+    """
+    end = end or extract_reanalysis.last_update()
+    groups = dict()
+    skipped = 0
+
+    for geocode in geocodes:
+        mark = marks.get(geocode)
+        if mark:
+            first = datetime.strptime(mark, "%Y-%m-%d") + timedelta(days=1)
+            first = first.strftime("%Y-%m-%d")
+        elif start:
+            first = start
+        else:
+            skipped += 1
+            continue
+
+        if first <= end:
+            groups.setdefault((first, end), []).append(geocode)
+
+    if skipped:
+        logging.warning(f"{skipped} geocodes without data and start date skipped.")
+    return groups
+
+
+def update(
+    geocodes: Union[int, str, Iterable[Union[int, str]]] = "all",
+    conn=None,
+    data_dir: Optional[str] = None,
+    start: Optional[str] = None,
+    **kwargs,
+) -> dict:
+    """
+    Downloads the days each geocode is missing. With a connection, the
+    watermarks are read from the database and the new data is parsed and
+    loaded into it, otherwise the watermarks come from `data_dir`.
+
+    Attrs:
+        geocodes (int, str or iterable): "all", a state code or geocodes.
+        conn (opt): psycopg2 or sqlite3 connection.
+        data_dir (opt(str)): Directory of the downloaded files.
+        start (opt(str)): First date of geocodes without any data stored.
+        kwargs: Passed to `extract_reanalysis.download_batch()`.
+
+    Returns:
+        files (dict): Files downloaded, mapped to the geocodes they contain.
+    """
+    selected = regions.select(geocodes)
+    missing = gaps(selected, watermarks(conn, data_dir), start)
+    logging.info(f"{len(missing)} ranges missing for {len(selected)} geocodes.")
+
+    files = dict()
+    for (first, last), group in sorted(missing.items()):
+        past_date = first if first < last else None
+        downloaded = extract_reanalysis.download_batch(
+            group, past_date=past_date, date=last, data_dir=data_dir, **kwargs
+        )
+        if conn is not None and downloaded:
+            loader.load(extract_reanalysis.to_dataframe_batch(downloaded), conn)
+        elif downloaded:
+            done = [g for in_file in downloaded.values() for g in in_file]
+            _write_marks(data_dir or globals.DATA_DIR, {g: last for g in done})
+        files.update(downloaded)
+
+    return files
@@ -0,0 +1,228 @@
+"""
+Sparse weights to interpolate gridded fields to every city at once.
+
+The value of a city is a weighted sum of a few grid points close to it.
+Storing these weights as a sparse matrix of shape (cities, grid points),
+a field with shape (time, latitude, longitude) can be turned into a
+(time, cities) table with a single matrix product, instead of selecting
+and averaging the coordinates of each geocode.
+
+Two methods are available:
+
+mean     : Plain average of the four coordinates returned by
+           `extract_coordinates.do_area`, the same values of `to_dataframe()`.
+bilinear : Bilinear interpolation of the four grid points enclosing the
+           city coordinate.
+
+The grid is described by its extent, in the Copernicus `area` order
+[north, west, south, east], with points every `globals.GRID_RESOLUTION`
+degrees. Latitudes are ordered from north to south and longitudes from
+west to east, as in the NetCDF files returned by the API. Cities with
+any grid point outside the extent are left out of the matrix. Matrices
+are cached in `globals.CACHE_DIR`, keyed by method and extent, and built
+again whenever `municipios.json` is modified.
+
+Methods
+-------
+
+weight_matrix(extent, method) : Returns the sparse weight matrix of a grid
+                                extent and the geocodes of its rows.
+
+interpolate(field, method)    : Interpolates a DataArray with latitude and
+                                longitude dimensions to every city in its
+                                extent, returns a DataFrame with a column
+                                for each geocode.
+"""
+
+import os
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from pathlib import Path
+from typing import Optional
+
+from cds_weather import extract_latlons, globals
+from cds_weather.extract_coordinates import do_area_many
+
+METHODS = ["mean", "bilinear"]
+
+
+def _grid_shape(extent: list) -> tuple:
+    north, west, south, east = extent
+    n_lats = int(round((north - south) / globals.GRID_RESOLUTION)) + 1
+    n_lons = int(round((east - west) / globals.GRID_RESOLUTION)) + 1
+    return n_lats, n_lons
+
+
+def _grid_index(extent: list, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Flat index of grid points in a field of the extent, -1 if the point
+    is outside of it.
+    """
+    north, west, _, _ = extent
+    n_lats, n_lons = _grid_shape(extent)
+    i_lat = np.rint((north - lats) / globals.GRID_RESOLUTION).astype(int)
+    i_lon = np.rint((lons - west) / globals.GRID_RESOLUTION).astype(int)
+    inside = (i_lat >= 0) & (i_lat < n_lats) & (i_lon >= 0) & (i_lon < n_lons)
+    return np.where(inside, i_lat * n_lons + i_lon, -1)
+
+
+def _mean_weights(lats: np.ndarray, lons: np.ndarray) -> tuple:
+    north, south, east, west = do_area_many(lats, lons)
+    points_lat = np.stack([north, north, south, south], axis=1)
+    points_lon = np.stack([west, east, west, east], axis=1)
+    weights = np.full(points_lat.shape, 0.25)
+    return points_lat, points_lon, weights
+
+
+def _bilinear_weights(lats: np.ndarray, lons: np.ndarray) -> tuple:
+    res = globals.GRID_RESOLUTION
+    south = np.floor(lats / res) * res
+    west = np.floor(lons / res) * res
+    north, east = south + res, west + res
+
+    # relative position of the city inside its cell
+    y = (lats - south) / res
+    x = (lons - west) / res
+
+    points_lat = np.stack([north, north, south, south], axis=1)
+    points_lon = np.stack([west, east, west, east], axis=1)
+    weights = np.stack([y * (1 - x), y * x, (1 - y) * (1 - x), (1 - y) * x], axis=1)
+    return points_lat, points_lon, weights
+
+
+def _cache_file(extent: list, method: str, cache_dir: Path) -> Path:
+    coords = "_".join(f"{c:g}" for c in extent)
+    return Path(cache_dir) / f"weights_{method}_{coords}.npz"
+
+
+def _load_cache(file: Path) -> Optional[tuple]:
+    try:
+        if file.stat().st_mtime < extract_latlons.MUNICIPIOS_JSON.stat().st_mtime:
+            return None
+        with np.load(file) as cached:
+            matrix = sparse.csr_matrix(
+                (cached["data"], cached["indices"], cached["indptr"]),
+                shape=tuple(cached["shape"]),
+            )
+            return matrix, cached["geocodes"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _store_cache(file: Path, matrix, geocodes: np.ndarray):
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = file.with_suffix(f".{os.getpid()}.tmp.npz")
+    np.savez(
+        tmp,
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        shape=np.array(matrix.shape),
+        geocodes=geocodes,
+    )
+    os.replace(tmp, file)
+    logging.info(f"Weight matrix stored at {file}")
+
+
+def _build(extent: list, method: str) -> tuple:
+    municipios = extract_latlons.table()
+    geocodes = municipios["geocodigo"]
+    lats, lons = municipios["latitude"], municipios["longitude"]
+
+    if method == "mean":
+        points_lat, points_lon, weights = _mean_weights(lats, lons)
+    else:
+        points_lat, points_lon, weights = _bilinear_weights(lats, lons)
+
+    index = _grid_index(extent, points_lat, points_lon)
+    # points without weight, e.g. cities exactly over a grid
+    # line on bilinear interpolation, may be outside the extent
+    unused = weights == 0
+    inside = ((index >= 0) | unused).all(axis=1)
+    index = np.where(unused, 0, index)
+    index, weights, geocodes = index[inside], weights[inside], geocodes[inside]
+
+    rows = np.repeat(np.arange(len(geocodes)), index.shape[1])
+    n_lats, n_lons = _grid_shape(extent)
+    matrix = sparse.csr_matrix(
+        (weights.ravel(), (rows, index.ravel())),
+        shape=(len(geocodes), n_lats * n_lons),
+    )
+    matrix.eliminate_zeros()
+    return matrix, geocodes
+
+
+def weight_matrix(
+    extent: list,
+    method: str = "mean",
+    cache_dir: Optional[str] = None,
+) -> tuple:
+    """
+    Returns the weights to interpolate a field of the grid `extent` to
+    the cities inside it. The matrix is loaded from the cache if it was
+    built before for the same extent and method, after the last change
+    of `municipios.json`.
+
+    Params:
+        extent (list)       : [north, west, south, east] of the grid.
+        method (str)        : "mean" or "bilinear".
+        cache_dir (opt(str)): Directory of the cached matrices. Default
+                              directory is `globals.CACHE_DIR`.
+
+    Returns:
+        matrix (csr_matrix) : Weights with shape (cities, grid points),
+                              grid points are flattened in (lat, lon) order.
+        geocodes (ndarray)  : Geocode of each row of the matrix.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}. Options: {METHODS}")
+
+    extent = [float(c) for c in extent]
+    cache_dir = Path(cache_dir or globals.CACHE_DIR)
+    file = _cache_file(extent, method, cache_dir)
+
+    cached = _load_cache(file)
+    if cached is not None:
+        return cached
+
+    matrix, geocodes = _build(extent, method)
+    _store_cache(file, matrix, geocodes)
+    return matrix, geocodes
+
+
+def interpolate(
+    field,
+    method: str = "mean",
+    cache_dir: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Interpolates a field to every city inside its extent.
+
+    Params:
+        field (xr.DataArray): Values with `latitude` and `longitude`
+                              dimensions, e.g. `ds.t2m` with shape
+                              (time, latitude, longitude).
+        method (str)        : "mean" or "bilinear".
+        cache_dir (opt(str)): Directory of the cached matrices.
+
+    Returns:
+        DataFrame with the remaining dimension as index and a column
+        for each geocode inside the extent.
+    """
+    if field.ndim not in (2, 3):
+        raise ValueError(f"Expected 2 or 3 dimensions, got {field.dims}")
+
+    field = field.sortby("latitude", ascending=False).sortby("longitude")
+    lats, lons = field.latitude.values, field.longitude.values
+    extent = [lats[0], lons[0], lats[-1], lons[-1]]
+    matrix, geocodes = weight_matrix(extent, method, cache_dir)
+
+    field = field.transpose(..., "latitude", "longitude")
+    values = field.values.reshape(-1, len(lats) * len(lons))
+    result = matrix.dot(values.T).T
+
+    index = field[field.dims[0]].to_index() if field.ndim == 3 else None
+    return pd.DataFrame(result, index=index, columns=geocodes)
@@ -0,0 +1,192 @@
+"""
+Bulk load the DataFrames of `to_dataframe()` into the database.
+
+Data is stored in the table defined at `reanalysis_era5_single_levels.sql`,
+with one row per date and geocode. Inserting row by row is slow for large
+backfills, so the loader uses PostgreSQL `COPY` to fill a temporary staging
+table and then upserts the whole batch into the table with a single
+`INSERT ... ON CONFLICT (date, geocode) DO UPDATE` statement. Rows already
+in the table are replaced by the new values.
+
+A SQLite database can be used instead of PostgreSQL, for tests or to keep
+the data locally. In this case the rows are upserted with `executemany`.
+
+Methods
+-------
+
+create_table(conn) : Creates the table, if it doesn't exist yet.
+
+load(df, conn)     : Upserts the rows of the DataFrame returned by
+                     `to_dataframe()` or `to_dataframe_batch()`.
+
+latest_dates(conn) : Returns the most recent date stored for each geocode.
+"""
+
+import io
+import logging
+import sqlite3
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+DDL_FILE = Path(__file__).parent / "reanalysis_era5_single_levels.sql"
+TABLE = '"Municipio"."clima_copernicus"'
+# tables in SQLite don't have a schema
+SQLITE_TABLE = "clima_copernicus"
+
+COLUMNS = [
+    "date",
+    "geocode",
+    "temp_min",
+    "temp_max",
+    "temp_med",
+    "precip_min",
+    "precip_max",
+    "precip_med",
+    "umid_min",
+    "umid_med",
+    "umid_max",
+    "pressao_min",
+    "pressao_med",
+    "pressao_max",
+]
+KEY = ["date", "geocode"]
+
+# rows sent to the database at once
+BATCH_SIZE = 500_000
+
+
+def _is_sqlite(conn) -> bool:
+    return isinstance(conn, sqlite3.Connection)
+
+
+def _table(conn, table: Optional[str]) -> str:
+    if table:
+        return table
+    return SQLITE_TABLE if _is_sqlite(conn) else TABLE
+
+
+def create_table(conn, table: Optional[str] = None):
+    """
+    Creates the table from `reanalysis_era5_single_levels.sql`.
+
+    Attrs:
+        conn: psycopg2 or sqlite3 connection.
+        table (opt(str)): Name of the table, `TABLE` by default.
+    """
+    ddl = DDL_FILE.read_text().replace(TABLE, _table(conn, table))
+    cursor = conn.cursor()
+    cursor.execute(ddl)
+    conn.commit()
+    cursor.close()
+
+
+def _rows(df: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Parses the DataFrame of `to_dataframe()` to the table columns.
+    """
+    import pandas as pd
+
+    rows = df.reset_index().rename(columns={"geocodigo": "geocode"})
+    rows["date"] = pd.to_datetime(rows["date"]).dt.strftime("%Y-%m-%d")
+    rows["geocode"] = rows["geocode"].astype(int)
+    # a row can only be upserted once per statement
+    return rows[COLUMNS].drop_duplicates(KEY, keep="last")
+
+
+def _upsert_sql(table: str, source: str) -> str:
+    columns = ", ".join(COLUMNS)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS if c not in KEY)
+    return (
+        f"INSERT INTO {table} ({columns}) {source} "
+        f"ON CONFLICT ({', '.join(KEY)}) DO UPDATE SET {updates}"
+    )
+
+
+def _load_postgres(rows: "pd.DataFrame", conn, table: str, batch_size: int):
+    cursor = conn.cursor()
+    cursor.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS _staging_clima "
+        f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"
+    )
+    columns = ", ".join(COLUMNS)
+    copy_sql = f"COPY _staging_clima ({columns}) FROM STDIN WITH (FORMAT csv)"
+    upsert_sql = _upsert_sql(table, f"SELECT {columns} FROM _staging_clima")
+
+    for start in range(0, len(rows), batch_size):
+        buffer = io.StringIO()
+        rows.iloc[start : start + batch_size].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+        cursor.execute(upsert_sql)
+        cursor.execute("TRUNCATE _staging_clima")
+
+    conn.commit()
+    cursor.close()
+
+
+def _load_sqlite(rows: "pd.DataFrame", conn, table: str, batch_size: int):
+    placeholders = ", ".join("?" for _ in COLUMNS)
+    upsert_sql = _upsert_sql(table, f"VALUES ({placeholders})")
+    # sqlite3 only binds Python objects, NaN values are stored as NULL
+    values = rows.astype(object).where(rows.notna(), None)
+
+    with conn:
+        for start in range(0, len(values), batch_size):
+            batch = values.iloc[start : start + batch_size]
+            conn.executemany(upsert_sql, batch.itertuples(index=False, name=None))
+
+
+def load(
+    df: "pd.DataFrame",
+    conn,
+    table: Optional[str] = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Upserts the rows of a DataFrame in the format of `to_dataframe()`,
+    indexed by date with a `geocodigo` column, into the table.
+
+    Attrs:
+        df (DataFrame): Data to be loaded.
+        conn: psycopg2 connection or, for a local database, a sqlite3
+              connection.
+        table (opt(str)): Name of the table, `TABLE` by default.
+        batch_size (int): Rows sent to the database at once.
+
+    Returns:
+        rows (int): Number of rows loaded.
+    """
+    rows = _rows(df)
+    table = _table(conn, table)
+
+    if _is_sqlite(conn):
+        _load_sqlite(rows, conn, table, batch_size)
+    else:
+        _load_postgres(rows, conn, table, batch_size)
+
+    logging.info(f"{len(rows)} rows loaded into {table}.")
+    return len(rows)
+
+
+def latest_dates(conn, table: Optional[str] = None) -> dict:
+    """
+    Returns the most recent date stored for each geocode.
+
+    Attrs:
+        conn: psycopg2 or sqlite3 connection.
+        table (opt(str)): Name of the table, `TABLE` by default.
+
+    Returns:
+        dates (dict): Date 'YYYY-MM-DD' of each geocode in the table.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT geocode, MAX(date) FROM {_table(conn, table)} GROUP BY geocode"
+    )
+    dates = {int(geocode): str(date)[:10] for geocode, date in cursor.fetchall()}
+    cursor.close()
+    return dates
@@ -0,0 +1,262 @@
+"""
+Timings and counters of each stage of the extraction.
+
+Stages are measured with `timer(stage)`, a context manager that emits an
+event with the duration of the block and the counters set inside it, like
+the bytes of a download. Events are dicts sent to every hook added with
+`add_hook()`:
+
+    {"stage": "download", "start": 1665400000.0, "seconds": 12.5,
+     "queued": 9.1, "running": 2.9, "bytes": 1048576, ...}
+
+Without hooks, `timer()` returns a shared no-op context and nothing is
+measured, so the instrumentation costs a function call per stage. Hooks
+can also be added with the `ADCLIMA_METRICS` environment variable, with
+the path of a JSON lines file.
+
+Stages
+------
+
+connect              : `connection.connect()`.
+lookup               : Coordinates and `do_area` of the geocodes.
+download             : Each request, with the seconds `queued` and
+                       `running` at the API, the `transfer` of the file,
+                       its `bytes` and `throughput` in bytes per second.
+to_dataframe.load    : Reading the NetCDF data into memory.
+to_dataframe.convert : Unit conversion, including `to_dataframe.humidity`.
+to_dataframe.aggregate : Daily min, mean and max.
+to_dataframe.merge   : Concatenation of the DataFrames of chunks or geocodes.
+
+Methods
+-------
+
+add_hook(hook)       : Calls `hook(event)` for every event.
+
+remove_hook(hook)    : Stops sending events to the hook.
+
+timer(stage)         : Measures a block of code as a stage.
+
+emit(stage, seconds) : Sends an event measured elsewhere.
+
+JsonLinesExporter    : Hook appending each event to a JSON lines file.
+
+PrometheusExporter   : Hook summing the events per stage, exported in the
+                       Prometheus text format.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+from typing import Callable, Optional
+
+_hooks = []
+_lock = threading.Lock()
+# download measured by the thread, @see `cdsapi_info()`
+_local = threading.local()
+
+
+def add_hook(hook: Callable[[dict], None]):
+    """
+    Sends every event to `hook`, a callable receiving the event dict.
+    """
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[dict], None]):
+    with _lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def enabled() -> bool:
+    return bool(_hooks)
+
+
+def emit(stage: str, seconds: float, start: Optional[float] = None, **fields):
+    """
+    Sends an event to the hooks. Errors of the hooks are logged, so the
+    extraction isn't interrupted by them.
+    """
+    if not _hooks:
+        return
+    event = dict(stage=stage, start=start or time.time() - seconds, seconds=seconds)
+    event.update(fields)
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as e:
+            logging.warning(f"Metrics hook {hook} failed: {e}")
+
+
+class _Timer(dict):
+    """
+    Context of a stage, the counters of the event are set as items.
+    """
+
+    def __init__(self, stage: str, fields: dict):
+        super().__init__(fields)
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+        self.counter = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is not None:
+            self["error"] = error_type.__name__
+        emit(self.stage, time.perf_counter() - self.counter, self.start, **self)
+        return False
+
+
+class _NullTimer(dict):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+_NULL = _NullTimer()
+
+
+def timer(stage: str, **fields):
+    """
+    Measures the block as a stage, usage:
+
+    with metrics.timer("download", dataset=dataset) as m:
+        ...
+        m["bytes"] = os.path.getsize(target)
+
+    Attrs:
+        stage (str): Name of the stage.
+        fields: Labels and counters added to the event.
+    """
+    if not _hooks:
+        return _NULL
+    return _Timer(stage, fields)
+
+
+def cdsapi_info(message, *args, **kwargs):
+    """
+    `info_callback` of the `cdsapi` clients. Records when each request
+    changes state, in the thread running it, and logs the message as
+    the client would do.
+    """
+    states = getattr(_local, "states", None)
+    if states is not None and isinstance(message, str):
+        if message.startswith("Request is "):
+            states[message[len("Request is ") :]] = time.perf_counter()
+    logging.getLogger("cdsapi").info(message, *args, **kwargs)
+
+
+def track_states() -> dict:
+    """
+    Starts recording the state changes of the request made by the thread,
+    returns the dict {state: perf_counter} filled by `cdsapi_info()`.
+    """
+    _local.states = dict()
+    return _local.states
+
+
+def download_fields(states: dict, start: float, end: float, size: int) -> dict:
+    """
+    Splits the duration of a request by the states recorded, with the
+    transfer counted from its completion. Clients that don't report the
+    states have the whole duration counted as transfer.
+    """
+    fields = dict(bytes=size)
+    queued = states.get("queued")
+    running = states.get("running")
+    completed = states.get("completed")
+    if queued is not None:
+        fields["queued"] = (running or completed or end) - queued
+    if running is not None:
+        fields["running"] = (completed or end) - running
+    transfer = end - (completed or start)
+    fields["transfer"] = transfer
+    fields["throughput"] = size / transfer if transfer > 0 else 0.0
+    _local.states = None
+    return fields
+
+
+class JsonLinesExporter:
+    """
+    Appends each event to a JSON lines file, opened on the first event.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.lock = threading.Lock()
+
+    def __call__(self, event: dict):
+        line = json.dumps(event, default=str) + "\n"
+        with self.lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+class PrometheusExporter:
+    """
+    Sums the duration, calls and numeric counters of each stage, exported
+    as the counters `adclima_stage_seconds_total`, `adclima_stage_calls_total`
+    and `adclima_stage_<counter>_total`, labeled by stage. Fields that can't
+    be summed are left out, the throughput is given by the bytes and the
+    transfer seconds.
+    """
+
+    PREFIX = "adclima_stage"
+    IGNORED = {"stage", "start", "attempt", "throughput"}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = dict()
+
+    def __call__(self, event: dict):
+        stage = event["stage"]
+        with self.lock:
+            totals = self.totals.setdefault(stage, dict(calls=0))
+            totals["calls"] += 1
+            for name, value in event.items():
+                if name in self.IGNORED or isinstance(value, bool):
+                    continue
+                if isinstance(value, (int, float)):
+                    totals[name] = totals.get(name, 0) + value
+
+    def text(self) -> str:
+        """
+        Returns the counters in the Prometheus text exposition format.
+        """
+        with self.lock:
+            names = sorted({name for totals in self.totals.values() for name in totals})
+            lines = []
+            for name in names:
+                metric = f"{self.PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for stage, totals in sorted(self.totals.items()):
+                    if name in totals:
+                        lines.append(f'{metric}{{stage="{stage}"}} {totals[name]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Writes the counters to a file, e.g. for the textfile collector of
+        the Prometheus node exporter. The file is replaced atomically.
+        """
+        part = f"{path}.part"
+        with open(part, "w") as f:
+            f.write(self.text())
+        os.replace(part, path)
+
+
+if os.environ.get("ADCLIMA_METRICS"):
+    add_hook(JsonLinesExporter(os.environ["ADCLIMA_METRICS"]))
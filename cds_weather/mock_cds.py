@@ -0,0 +1,466 @@
+"""
+Local stand-in for the Copernicus API, to test the downloads offline.
+
+Implements the part of the CDS API v2 used by `cdsapi.Client`: the status,
+the submission of a request, the state of its task, the download of the
+result and its deletion. Requests to `reanalysis-era5-single-levels` are
+answered with synthetic files of the requested area, days and times (@see
+`synthetic` module), in NetCDF or GRIB. Clients are pointed at the server
+with its `url` and any key in the `<uid>:<key>` format:
+
+    server = mock_cds.start(queue_delay=2, bandwidth=5e6)
+    client = cdsapi.Client(url=server.url, key=mock_cds.KEY)
+    ...
+    server.stop()
+
+or, for `connection.connect()`, with the `CDSAPI_URL` and `CDSAPI_KEY`
+environment variables. The server simulates the behaviour of the API that
+limits the throughput of the downloads:
+
+- queue delay: requests wait in the queue a random time with mean
+  `queue_delay` seconds, then for one of the `max_running` slots;
+- job states: each job is "queued", "running" for `run_time` seconds and
+  then "completed" or, with probability `failure_rate`, "failed";
+- rate limits: more than `rate_limit` submissions in a second are
+  answered with 429;
+- intermittent failures: with probability `error_rate`, calls to the API
+  are answered with 503 and, with probability `drop_rate`, downloads are
+  cut halfway;
+- bandwidth: downloads share `bandwidth` bytes per second.
+
+Usage from the command line, serving until interrupted:
+
+    python -m cds_weather.mock_cds --port 8080 --queue-delay 5 --max-running 4
+
+Methods
+-------
+
+start(host, port, **options) : Starts a server in a background thread.
+
+main(argv)                   : Runs a server in the foreground.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+
+from typing import Optional
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DATASET = "reanalysis-era5-single-levels"
+# accepted by `cdsapi.Client`, the server doesn't check the credentials
+KEY = "123456:00000000-0000-4000-8000-000000000000"
+API_PATH = "/api/v2"
+
+DEFAULTS = dict(
+    # mean seconds in the queue before waiting for a slot
+    queue_delay=0.0,
+    # seconds running after getting a slot
+    run_time=0.0,
+    # jobs running at the same time
+    max_running=4,
+    # submissions per second, None for no limit
+    rate_limit=None,
+    # probability of a job ending as "failed"
+    failure_rate=0.0,
+    # probability of a 503 answer to a call
+    error_rate=0.0,
+    # probability of a download cut halfway
+    drop_rate=0.0,
+    # bytes per second shared by the downloads, None for no limit
+    bandwidth=None,
+    seed=0,
+)
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = {"netcdf": "application/x-netcdf", "grib": "application/x-grib"}
+EXTENSIONS = {"netcdf": ".nc", "grib": ".grib"}
+REQUIRED = ["variable", "year", "month", "day", "time", "area"]
+
+_ROUTES = [
+    ("GET", re.compile(r"/status\.json$"), "status"),
+    ("POST", re.compile(r"/resources/(?P<name>[\w.-]+)$"), "submit"),
+    ("GET", re.compile(r"/tasks/(?P<rid>[\w-]+)$"), "task"),
+    ("DELETE", re.compile(r"/tasks/(?P<rid>[\w-]+)$"), "delete"),
+    ("GET", re.compile(r"/download/(?P<rid>[\w-]+)\.\w+$"), "download"),
+    ("HEAD", re.compile(r"/download/(?P<rid>[\w-]+)\.\w+$"), "download"),
+]
+
+
+class _Error(Exception):
+    """
+    Answered with the `code` status and a `message` in the JSON body,
+    which `cdsapi` raises as an exception.
+    """
+
+    def __init__(self, code: int, message: str, reason: str = ""):
+        super().__init__(message)
+        self.code = code
+        self.reason = reason or message
+
+
+class Server(ThreadingHTTPServer):
+    """
+    HTTP server holding the jobs and the counters of the mock API,
+    created by `start()`. `stats` counts the calls by endpoint and the
+    simulated failures, `url` is the one given to `cdsapi.Client`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, options: dict, data_dir: str):
+        super().__init__(address, _Handler)
+        self.options = {**DEFAULTS, **options}
+        self.data_dir = data_dir
+        self.random = random.Random(self.options["seed"])
+        self.lock = threading.Lock()
+        self.jobs = dict()
+        self.stats = dict()
+        self._count = 0
+        # time each running slot is free again
+        self._slots = [0.0] * max(1, self.options["max_running"])
+        self._submissions = deque()
+        # time the link is free for the next chunk
+        self._link_free = 0.0
+        self._write_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PATH}"
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + n
+
+    def chance(self, name: str) -> bool:
+        with self.lock:
+            return self.random.random() < self.options[name]
+
+    def submit(self, request: dict) -> dict:
+        """
+        Creates a job, its start and end times are drawn at submission.
+
+        Raises:
+            _Error : 429 if the rate limit is exceeded.
+        """
+        now = time.monotonic()
+        with self.lock:
+            limit = self.options["rate_limit"]
+            while self._submissions and self._submissions[0] <= now - 1:
+                self._submissions.popleft()
+            if limit is not None and len(self._submissions) >= limit:
+                raise _Error(429, "Too many requests", "Rate limit exceeded")
+            self._submissions.append(now)
+
+            delay = self.options["queue_delay"]
+            ready = now + (self.random.expovariate(1 / delay) if delay > 0 else 0.0)
+            start = max(ready, heapq.heappop(self._slots))
+            end = start + self.options["run_time"]
+            heapq.heappush(self._slots, end)
+
+            self._count += 1
+            rid = f"{self._count:08d}-{self.random.getrandbits(32):08x}"
+            job = dict(
+                request_id=rid,
+                request=request,
+                start=start,
+                end=end,
+                failed=self.random.random() < self.options["failure_rate"],
+                file=None,
+                lock=threading.Lock(),
+            )
+            self.jobs[rid] = job
+        return job
+
+    def result(self, job: dict) -> str:
+        """
+        Writes the synthetic file of a job once, on its completion.
+        """
+        from cds_weather import synthetic
+
+        # the netCDF library isn't thread safe, files are written one at a time
+        with job["lock"], self._write_lock:
+            if job["file"] is None:
+                format = job["request"].get("format", "netcdf")
+                file = os.path.join(
+                    self.data_dir, job["request_id"] + EXTENSIONS[format]
+                )
+                synthetic.write_request(job["request"], file)
+                job["file"] = file
+        return job["file"]
+
+    def throttle(self, size: int):
+        """
+        Waits for the time of sending `size` bytes on the link shared by
+        the downloads.
+        """
+        bandwidth = self.options["bandwidth"]
+        if not bandwidth:
+            return
+        with self.lock:
+            start = max(time.monotonic(), self._link_free)
+            self._link_free = end = start + size / bandwidth
+        time.sleep(max(0.0, end - time.monotonic()))
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="mock-cds", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and removes the files of the jobs.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: Server
+
+    def log_message(self, format, *args):
+        logging.debug(f"mock_cds: {format % args}")
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_HEAD(self):
+        self._route("HEAD")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def _route(self, method: str):
+        path = self.path.split("?")[0]
+        body = self._body()
+        try:
+            for route_method, pattern, name in _ROUTES:
+                match = pattern.search(path)
+                if route_method == method and match:
+                    break
+            else:
+                raise _Error(404, f"Not found: {method} {path}")
+
+            self.server.count(name)
+            if name != "status" and not self.headers.get("Authorization"):
+                raise _Error(401, "Authentication failed", "Missing credentials")
+            if name != "status" and self.server.chance("error_rate"):
+                self.server.count("errors")
+                raise _Error(503, "Service unavailable", "Service temporarily down")
+            getattr(self, f"_{name}")(body=body, **match.groupdict())
+
+        except _Error as e:
+            if e.code == 429:
+                self.server.count("rate_limited")
+            self._json(dict(message=str(e), reason=e.reason), e.code)
+        except Exception as e:
+            logging.exception(f"mock_cds: {method} {path} failed")
+            self._json(dict(message=str(e), reason="Internal error"), 500)
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json(self, reply: dict, code: int = 200):
+        data = json.dumps(reply).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _job(self, rid: str) -> dict:
+        job = self.server.jobs.get(rid)
+        if job is None:
+            raise _Error(404, f"Request {rid} not found")
+        return job
+
+    def _status(self, body: bytes):
+        self._json(dict(info=["Welcome to the mock CDS"], warning=[]))
+
+    def _submit(self, body: bytes, name: str):
+        if name != DATASET:
+            raise _Error(404, f"Resource {name} not found")
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            raise _Error(400, "Invalid request", "The body is not JSON")
+        missing = [key for key in REQUIRED if key not in request]
+        if missing:
+            raise _Error(400, "Invalid request", f"Missing {missing}")
+        if request.get("format", "netcdf") not in EXTENSIONS:
+            raise _Error(400, "Invalid request", f"Unknown format {request['format']}")
+
+        job = self.server.submit(request)
+        self._json(self._reply(job), 202)
+
+    def _task(self, body: bytes, rid: str):
+        self._json(self._reply(self._job(rid)))
+
+    def _reply(self, job: dict) -> dict:
+        now = time.monotonic()
+        rid = job["request_id"]
+        if now < job["start"]:
+            return dict(state="queued", request_id=rid)
+        if now < job["end"]:
+            return dict(state="running", request_id=rid)
+        if job["failed"]:
+            self.server.count("failed")
+            return dict(
+                state="failed",
+                request_id=rid,
+                error=dict(
+                    message="Request failed",
+                    reason="Temporarily unable to retrieve the data",
+                    context=dict(traceback=""),
+                ),
+            )
+
+        file = self.server.result(job)
+        format = job["request"].get("format", "netcdf")
+        return dict(
+            state="completed",
+            request_id=rid,
+            location=f"{API_PATH}/download/{os.path.basename(file)}",
+            content_length=os.path.getsize(file),
+            content_type=CONTENT_TYPES[format],
+        )
+
+    def _delete(self, body: bytes, rid: str):
+        job = self.server.jobs.pop(rid, None)
+        if job is not None and job["file"] is not None:
+            os.remove(job["file"])
+        self._json(dict())
+
+    def _download(self, body: bytes, rid: str):
+        job = self._job(rid)
+        if job["file"] is None:
+            raise _Error(404, f"Result of {rid} not ready")
+
+        size = os.path.getsize(job["file"])
+        first = 0
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match:
+            first = min(int(match.group(1)), size)
+        length = size - first
+
+        self.send_response(206 if match else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        if match:
+            self.send_header("Content-Range", f"bytes {first}-{size - 1}/{size}")
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+
+        # the connection is closed before the end of the file
+        cut = first + length // 2 if self.server.chance("drop_rate") else size
+        with open(job["file"], "rb") as f:
+            f.seek(first)
+            position = first
+            while position < cut:
+                chunk = f.read(min(CHUNK_SIZE, cut - position))
+                self.server.throttle(len(chunk))
+                self.wfile.write(chunk)
+                position += len(chunk)
+                self.server.count("bytes", len(chunk))
+
+        if cut < size:
+            self.server.count("dropped")
+            self.close_connection = True
+
+
+def start(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    data_dir: Optional[str] = None,
+    **options,
+) -> Server:
+    """
+    Starts a mock API in a background thread, usage:
+
+    server = mock_cds.start(queue_delay=2, max_running=2, error_rate=0.05)
+    os.environ.update(CDSAPI_URL=server.url, CDSAPI_KEY=mock_cds.KEY)
+    connection.reset()
+    ...
+    server.stop()
+
+    Attrs:
+        host (str): Address to listen on.
+        port (int): Port to listen on, 0 for any free port.
+        data_dir (opt(str)): Directory of the files of the jobs, a temporary
+                             one by default. Removed by `stop()`.
+        options: Overrides of `DEFAULTS`, the simulated behaviour.
+
+    Returns:
+        The running `Server`, with the `url` of the API.
+    """
+    unknown = set(options) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown options: {sorted(unknown)}")
+    if data_dir is None:
+        data_dir = tempfile.mkdtemp(prefix="mock_cds_")
+    os.makedirs(data_dir, exist_ok=True)
+    return Server((host, port), options, data_dir).start()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--data-dir")
+    parser.add_argument("--queue-delay", type=float)
+    parser.add_argument("--run-time", type=float)
+    parser.add_argument("--max-running", type=int)
+    parser.add_argument("--rate-limit", type=float)
+    parser.add_argument("--failure-rate", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--drop-rate", type=float)
+    parser.add_argument("--bandwidth", type=float, help="Bytes per second.")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = vars(parser.parse_args(argv))
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.pop("verbose") else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    host, port, data_dir = args.pop("host"), args.pop("port"), args.pop("data_dir")
+    options = {key: value for key, value in args.items() if value is not None}
+    server = start(host, port, data_dir, **options)
+    print(f"Mock CDS API at {server.url}, key {KEY}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Streaming pipeline where files are parsed and loaded while the next ones
+are still downloading.
+
+Requests spend most of their time in the Copernicus queue, while parsing
+and loading are bound by the CPU and the database. Instead of running the
+stages one after the other, each stage runs in its own threads, connected
+to the next one by a bounded queue:
+
+    items -> download (N threads) -> parse (M threads) -> load (1 thread)
+
+When a queue is full, the stage before it waits, so a slow database holds
+the parsing and a slow parser holds new downloads: no more than
+`queue_size` parsed DataFrames wait in memory. A failure in a stage is
+passed along with its item, so the other items keep flowing. The single
+call functions `download()`, `download_batch()` and `to_dataframe()`
+are still available, this module only connects them.
+
+Methods
+-------
+
+run(items, download, parse, load) : Runs each item through the stages,
+                                    yielding (item, result, error) in the
+                                    order they finish.
+
+stream(geocodes, past_date, date) : Yields the DataFrame of each region
+                                    as soon as it is downloaded and parsed.
+"""
+
+import queue
+import logging
+import threading
+
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+from cds_weather import executor, extract_reanalysis, regions
+
+# items waiting between two stages
+QUEUE_SIZE = 2
+PARSE_WORKERS = 1
+
+_STOP = object()
+
+
+class Cancelled(Exception):
+    """
+    Item not processed because the consumer stopped the pipeline.
+    """
+
+
+def _feed(items: Iterable, outbox: queue.Queue, cancel: threading.Event):
+    try:
+        for item in items:
+            if cancel.is_set():
+                break
+            outbox.put((item, item, None))
+    except Exception as e:
+        logging.error(f"Pipeline input failed: {e}")
+    finally:
+        outbox.put(_STOP)
+
+
+def _stage(
+    func: Callable,
+    inbox: queue.Queue,
+    outbox: queue.Queue,
+    workers: int,
+    cancel: threading.Event,
+    name: str,
+) -> list:
+    """
+    Starts `workers` threads applying `func` to the values of the inbox.
+    The last thread to finish passes the stop mark to the outbox.
+    """
+    running = [workers]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            entry = inbox.get()
+            if entry is _STOP:
+                # the other threads of the stage also have to stop
+                inbox.put(_STOP)
+                break
+            item, value, error = entry
+            if error is None and cancel.is_set():
+                error = Cancelled(name)
+            if error is None:
+                try:
+                    value = func(value)
+                except Exception as e:
+                    value, error = None, e
+            outbox.put((item, value, error))
+
+        with lock:
+            running[0] -= 1
+            if not running[0]:
+                outbox.put(_STOP)
+
+    threads = [
+        threading.Thread(target=work, name=f"{name}-{i}", daemon=True)
+        for i in range(max(1, workers))
+    ]
+    running[0] = len(threads)
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def run(
+    items: Iterable,
+    download: Callable,
+    parse: Callable,
+    load: Optional[Callable] = None,
+    download_workers: int = executor.MAX_WORKERS,
+    parse_workers: int = PARSE_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+) -> Iterator[tuple]:
+    """
+    Runs the items through the download, parse and load stages, usage:
+
+    for item, rows, error in pipeline.run(units, download, parse, load):
+        ...
+
+    Attrs:
+        items (iterable): Units of work, consumed as the downloads start.
+        download (callable): Receives an item, returns what `parse` takes,
+                             like the files of `download_batch()`.
+        parse (callable): Receives the downloaded value, returns what
+                          `load` takes, like a DataFrame.
+        load (opt(callable)): Receives the parsed value, called by a single
+                              thread. Without it, the parsed values are
+                              yielded.
+        download_workers (int): Downloads at the same time.
+        parse_workers (int): Threads parsing at the same time.
+        queue_size (int): Values waiting between two stages.
+
+    Returns:
+        Iterator of (item, result, error) tuples in the order the items
+        finish. `result` is None when `error`, the exception raised by a
+        stage, isn't. Stopping the iteration cancels the items not started.
+    """
+    cancel = threading.Event()
+    pending = queue.Queue(maxsize=max(1, download_workers))
+    downloaded = queue.Queue(maxsize=max(1, queue_size))
+    parsed = queue.Queue(maxsize=max(1, queue_size))
+    results = queue.Queue(maxsize=max(1, queue_size)) if load else parsed
+
+    threading.Thread(
+        target=_feed, args=(items, pending, cancel), name="feed", daemon=True
+    ).start()
+    _stage(download, pending, downloaded, download_workers, cancel, "download")
+    _stage(parse, downloaded, parsed, parse_workers, cancel, "parse")
+    if load:
+        _stage(load, parsed, results, 1, cancel, "load")
+
+    finished = False
+    try:
+        while True:
+            entry = results.get()
+            if entry is _STOP:
+                finished = True
+                return
+            yield entry
+    finally:
+        if not finished:
+            # downloads already running finish, the others are skipped
+            cancel.set()
+            while results.get() is not _STOP:
+                pass
+
+
+def stream(
+    geocodes: Union[int, str, Iterable[Union[int, str]]] = "all",
+    past_date: Optional[str] = None,
+    date: Optional[str] = None,
+    max_region_size: float = regions.MAX_REGION_SIZE,
+    download_workers: int = executor.MAX_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+    **kwargs,
+) -> Iterator:
+    """
+    Downloads the regions of `download_batch()` concurrently and yields the
+    DataFrame of each one as soon as it is parsed, usage:
+
+    for df in pipeline.stream(33, past_date='2022-10-01', date='2022-10-04'):
+        loader.load(df, conn)
+
+    Attrs:
+        geocodes (int, str or iterable): "all", a state code or geocodes.
+        past_date (opt(str)): Format 'YYYY-MM-DD', see `download()`.
+        date (opt(str)): Format 'YYYY-MM-DD', see `download()`.
+        max_region_size (float): Maximum width and height of each region.
+        download_workers (int): Regions downloaded at the same time.
+        queue_size (int): DataFrames waiting to be consumed.
+        kwargs: Passed to `download_batch()`, like `data_dir` or `journal`.
+
+    Returns:
+        Iterator of DataFrames, in the format of `to_dataframe_batch()`.
+        Regions that fail are logged and skipped.
+    """
+    boxes = regions.bounding_boxes(regions.select(geocodes), max_region_size)
+
+    def download(geocodes_in_box):
+        files = extract_reanalysis.download_batch(
+            geocodes_in_box,
+            past_date=past_date,
+            date=date,
+            max_region_size=max_region_size,
+            workers=1,
+            **kwargs,
+        )
+        if not files:
+            raise Exception("download failed")
+        return files
+
+    items = (geocodes_in_box for _, geocodes_in_box in boxes)
+    for _, df, error in run(
+        items,
+        download,
+        extract_reanalysis.to_dataframe_batch,
+        download_workers=download_workers,
+        queue_size=queue_size,
+    ):
+        if error is None:
+            yield df
+        else:
+            logging.error(f"Region failed: {error}")
@@ -0,0 +1,136 @@
+"""
+Split a date range into exact requests for the Copernicus API.
+
+The API expands the `year`, `month` and `day` values of a request as a
+cross product. A range that crosses months, like 2021-12-25 to 2022-01-05,
+would request every listed day in both months of both years if sent as a
+single request. The planner groups the months that share the same days and
+the years that share the same months, so every request is a product of its
+values that contains only days of the range.
+
+Each request also respects the limit of fields (variables x times x days)
+accepted by the API, being split when larger. There is no limit on the size
+of the range: long ranges are simply planned as more requests.
+
+Methods
+-------
+
+plan(past_date, date, area) : Returns the list of requests covering the range.
+
+fields(request)             : Estimated number of fields of a request.
+"""
+
+from typing import Optional
+from datetime import datetime, timedelta
+
+from cds_weather.cache import request_days
+
+# maximum number of fields of a request accepted by the API
+MAX_FIELDS = 120_000
+
+VARIABLES = [
+    "2m_temperature",
+    "total_precipitation",
+    "2m_dewpoint_temperature",
+    "mean_sea_level_pressure",
+]
+
+TIMES = ["00:00", "03:00", "06:00", "09:00", "12:00", "15:00", "18:00", "21:00"]
+
+
+def fields(request: dict) -> int:
+    """
+    Returns the number of fields the API will extract for a request,
+    one field per variable, time and day.
+    """
+    n_variables = len(request.get("variable", []))
+    n_times = len(request.get("time", []))
+    return n_variables * n_times * len(request_days(request))
+
+
+def _group(past_date: str, date: str) -> list:
+    # days of each month
+    months = dict()
+    first = datetime.strptime(past_date, "%Y-%m-%d")
+    last = datetime.strptime(date, "%Y-%m-%d")
+    for i in range((last - first).days + 1):
+        day = first + timedelta(days=i)
+        key = (f"{day.year}", f"{day.month:02d}")
+        months.setdefault(key, []).append(f"{day.day:02d}")
+
+    # months of each year that share the same days
+    by_days = dict()
+    for (year, month), days in months.items():
+        by_days.setdefault(tuple(days), dict()).setdefault(year, []).append(month)
+
+    # years that share the same months and days
+    groups = dict()
+    for days, years in by_days.items():
+        for year, year_months in years.items():
+            groups.setdefault((days, tuple(year_months)), []).append(year)
+
+    return [
+        (years, list(year_months), list(days))
+        for (days, year_months), years in groups.items()
+    ]
+
+
+def _split(request: dict, max_fields: int) -> list:
+    if fields(request) <= max_fields:
+        return [request]
+
+    for key in ["year", "month", "day"]:
+        values = request[key]
+        if len(values) > 1:
+            half = len(values) // 2
+            first, second = dict(request), dict(request)
+            first[key], second[key] = values[:half], values[half:]
+            return _split(first, max_fields) + _split(second, max_fields)
+
+    raise ValueError(
+        f"A single day has more than {max_fields} fields, "
+        "request less variables or times."
+    )
+
+
+def plan(
+    past_date: str,
+    date: str,
+    area: list,
+    variables: Optional[list] = None,
+    times: Optional[list] = None,
+    max_fields: int = MAX_FIELDS,
+    format: str = "netcdf",
+) -> list:
+    """
+    Plans the requests for a date range. Every request only contains days
+    within the range and at most `max_fields` fields.
+
+    Params:
+        past_date (str)      : First day of the range, 'YYYY-MM-DD'.
+        date (str)           : Last day of the range, 'YYYY-MM-DD'.
+        area (list)          : [north, west, south, east] of the requests.
+        variables (opt(list)): Variables requested, `VARIABLES` by default.
+        times (opt(list))    : Times of the day requested, `TIMES` by default.
+        max_fields (int)     : Maximum number of fields of a single request.
+        format (str)         : Format of the file returned by the API.
+
+    Returns:
+        requests (list): Bodies of the `reanalysis-era5-single-levels`
+                         requests, ordered by date.
+    """
+    requests = []
+    for years, months, days in _group(past_date, date):
+        request = {
+            "product_type": "reanalysis",
+            "variable": list(variables or VARIABLES),
+            "year": years,
+            "month": months,
+            "day": days,
+            "time": list(times or TIMES),
+            "area": list(area),
+            "format": format,
+        }
+        requests.extend(_split(request, max_fields))
+
+    return sorted(requests, key=lambda r: request_days(r)[0])
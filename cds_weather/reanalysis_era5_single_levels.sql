@@ -1,6 +1,6 @@
-CREATE TABLE "Municipio"."clima_copernicus" (
-    date datetime UNIQUE CONSTRAINT,
-    geocode int UNIQUE CONSTRAINT,
+CREATE TABLE IF NOT EXISTS "Municipio"."clima_copernicus" (
+    date date NOT NULL,
+    geocode int NOT NULL,
     temp_min real,
     temp_max real,
     temp_med real,
@@ -13,4 +13,5 @@ CREATE TABLE "Municipio"."clima_copernicus" (
     pressao_min real,
     pressao_med real,
     pressao_max real,
+    PRIMARY KEY (date, geocode)
 );
@@ -0,0 +1,123 @@
+"""
+Group cities into rectangular regions to be requested at once.
+
+Each city needs only the four grid points returned by `extract_coordinates.do_area`,
+so requesting every city on its own means one Copernicus job per geocode. When
+many cities are needed, the grid points from all of them can be covered by a few
+bounding boxes instead, that are downloaded once and sliced locally afterwards.
+A single box covering the whole country would also include a lot of ocean and
+empty cells, so the boxes are split until they respect a maximum size in degrees.
+
+Methods
+-------
+
+select(geocodes)              : Resolves a selection of geocodes, a state code
+                                or "all" into a list of geocodes.
+
+cells(geocodes)               : Returns the `do_area` of each geocode.
+
+bounding_boxes(geocodes, max) : Returns the smallest boxes, in the same order
+                                as the Copernicus `area` ([N, W, S, E]), that
+                                cover the cells of the geocodes and the geocodes
+                                each box contains.
+"""
+
+from typing import Iterable, Union
+
+from cds_weather import extract_latlons, spatial
+
+# maximum width or height of a region, in degrees
+MAX_REGION_SIZE = 10.0
+
+
+def select(geocodes: Union[int, str, Iterable[Union[int, str]]]) -> list:
+    """
+    Resolves the cities to be requested.
+
+    Params:
+        geocodes (int, str or iterable): "all" for every city in
+                        `municipios.json`, a two-digit state code
+                        (`codigo_uf`) for every city of a state, or
+                        a single or a list of geocodes.
+
+    Returns:
+        geocodes (list): Geocodes in IBGE's format.
+    """
+    if isinstance(geocodes, str) and geocodes.lower() == "all":
+        return extract_latlons.geocodes()
+
+    if isinstance(geocodes, (int, str)):
+        if len(str(geocodes)) == 2:
+            return extract_latlons.geocodes(uf=int(geocodes))
+        return [int(geocodes)]
+
+    return list(dict.fromkeys(int(g) for g in geocodes))
+
+
+def cells(geocodes: Iterable[int]) -> dict:
+    """
+    Returns a dict with the (north, south, east, west) tuple of each geocode.
+    Geocodes not found in `municipios.json` are logged and left out.
+    """
+    return {
+        geocode: area
+        for area, in_cell in spatial.groups(geocodes).items()
+        for geocode in in_cell
+    }
+
+
+def _bbox(areas: dict, keys: list) -> list:
+    lats = [c for k in keys for c in areas[k][:2]]
+    lons = [c for k in keys for c in areas[k][2:]]
+    return [max(lats), min(lons), min(lats), max(lons)]
+
+
+def _split(areas: dict, keys: list, max_size: float, weights: dict) -> list:
+    north, west, south, east = _bbox(areas, keys)
+    height, width = north - south, east - west
+
+    if (height <= max_size and width <= max_size) or len(keys) == 1:
+        return [([north, west, south, east], keys)]
+
+    # bisect along the longest side at the median city
+    axis = 0 if height >= width else 2
+    ordered = sorted(keys, key=lambda k: areas[k][axis])
+    total, count, half = sum(weights[k] for k in keys), 0, 0
+    while half < len(ordered) - 1 and 2 * (count + weights[ordered[half]]) <= total:
+        count += weights[ordered[half]]
+        half += 1
+    half = max(half, 1)
+    return _split(areas, ordered[:half], max_size, weights) + _split(
+        areas, ordered[half:], max_size, weights
+    )
+
+
+def bounding_boxes(
+    geocodes: Iterable[int],
+    max_size: float = MAX_REGION_SIZE,
+) -> list:
+    """
+    Covers the `do_area` cells of the geocodes with rectangular regions.
+    The bounding box of all cells is bisected along its longest side until
+    each region is at most `max_size` degrees wide and high, then each region
+    is shrunk to the cells it actually contains. Cities sharing a cell
+    (@see `spatial` module) are kept in the same region.
+
+    Params:
+        geocodes (iterable): Geocodes in IBGE's format.
+        max_size (float)   : Maximum width and height of a region, in degrees.
+
+    Returns:
+        regions (list): List of tuples ([north, west, south, east], geocodes),
+                        one for each region to be requested.
+    """
+    groups = spatial.groups(geocodes)
+    if not groups:
+        return []
+    # regions are split by cells, each cell standing for its cities
+    areas = {area: area for area in groups}
+    weights = {area: len(in_cell) for area, in_cell in groups.items()}
+    return [
+        (box, [g for area in in_box for g in groups[area]])
+        for box, in_box in _split(areas, list(groups), max_size, weights)
+    ]
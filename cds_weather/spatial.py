@@ -0,0 +1,141 @@
+"""
+Spatial index of the cities by the grid cell of `do_area`.
+
+Cities close to each other snap to the same four grid points, so their
+series are the same: of the 5570 cities in `municipios.json`, only around
+3260 cells are distinct. The index groups the geocodes by the
+(north, south, east, west) tuple of their cell, so batches download and
+aggregate each cell once and copy the result to every city in it.
+
+The index is built on the first lookup, from the arrays of
+`extract_latlons.table()`, and kept for the process.
+
+Methods
+-------
+
+index()                       : Returns the geocodes of each cell.
+
+cell(geocode)                 : Returns the cell of a geocode.
+
+groups(geocodes)              : Groups some geocodes by their cells.
+
+at_point(lat, lon)            : Cities whose cell contains the point.
+
+in_bbox(north, west, south, east) : Cities inside a bounding box.
+"""
+
+import logging
+
+from typing import Iterable
+
+from cds_weather import extract_latlons, metrics
+from cds_weather.extract_coordinates import do_area_many
+
+_index = None
+_cells = None
+# tolerance of the float32 coordinates of the files
+_EPS = 1e-4
+
+
+def _build():
+    global _index, _cells
+    columns = extract_latlons.table()
+    areas = do_area_many(columns["latitude"], columns["longitude"])
+    cells = dict(zip(columns["geocodigo"].tolist(), zip(*(a.tolist() for a in areas))))
+
+    index = dict()
+    for geocode, area in cells.items():
+        index.setdefault(area, []).append(geocode)
+    _index, _cells = index, cells
+
+
+def index() -> dict:
+    """
+    Returns a dict mapping the (north, south, east, west) tuple of each
+    cell to the geocodes in it, for every city in `municipios.json`.
+    """
+    if _index is None:
+        _build()
+    return _index
+
+
+def cell(geocode: int) -> tuple:
+    """
+    Returns the (north, south, east, west) tuple of the cell of a geocode.
+
+    Raises:
+        KeyError : If the geocode is not found.
+    """
+    if _cells is None:
+        _build()
+    return _cells[int(geocode)]
+
+
+def groups(geocodes: Iterable[int]) -> dict:
+    """
+    Groups the geocodes by their cells. Geocodes not found in
+    `municipios.json` are logged and left out.
+
+    Returns:
+        groups (dict): {(north, south, east, west): [geocodes]}, in the
+                       order the geocodes were given.
+    """
+    if _cells is None:
+        _build()
+
+    with metrics.timer("lookup") as m:
+        result = dict()
+        for geocode in geocodes:
+            area = _cells.get(int(geocode))
+            if area is None:
+                logging.error(f"Geocode {geocode} not found.")
+                continue
+            result.setdefault(area, []).append(int(geocode))
+        m["geocodes"] = sum(len(g) for g in result.values())
+        m["cells"] = len(result)
+        return result
+
+
+def at_point(lat: float, lon: float) -> list:
+    """
+    Returns the geocodes of the cities whose `do_area` cell contains the
+    point, the cities that share its series.
+    """
+    north, south, east, west = (float(c) for c in do_area_many(lat, lon))
+    return list(index().get((north, south, east, west), []))
+
+
+def in_bbox(
+    north: float,
+    west: float,
+    south: float,
+    east: float,
+    cells: bool = False,
+) -> list:
+    """
+    Returns the geocodes of the cities inside a bounding box, in the same
+    order as the Copernicus `area` ([N, W, S, E]).
+
+    Attrs:
+        north, west, south, east (float): Limits of the box, in degrees.
+        cells (bool): If True, the cities whose whole cell is inside the
+                      box are returned, instead of the ones whose
+                      coordinates are inside it. These are the cities
+                      a file with the grid of the box can be parsed for.
+
+    Returns:
+        geocodes (list): Sorted geocodes in IBGE's format.
+    """
+    if not cells:
+        columns = extract_latlons.table()
+        lats, lons = columns["latitude"], columns["longitude"]
+        inside = (lats <= north) & (lats >= south) & (lons >= west) & (lons <= east)
+        return columns["geocodigo"][inside].tolist()
+
+    north, west = north + _EPS, west - _EPS
+    south, east = south - _EPS, east + _EPS
+    result = []
+    for (n, s, e, w), geocodes in index().items():
+        if n <= north and s >= south and w >= west and e <= east:
+            result += geocodes
+    return sorted(result)
@@ -0,0 +1,216 @@
+"""
+Columnar store of the daily data, in Parquet files.
+
+The DataFrames returned by `to_dataframe()` are stored as a Parquet dataset
+partitioned by state (`codigo_uf`) and year, with the directory structure
+`codigo_uf=33/year=2022/`. Columns use compact types: date32 dates, int32
+geocodes and float32 values. Rows are sorted by geocode and date, so the
+statistics of each row group let queries skip the ones that don't match.
+
+Queries only read the partitions and row groups of the requested states,
+geocodes and dates, so the data of a state for many years can be read
+without opening any NetCDF file. Writing data that is already stored
+replaces the previous rows of the same date and geocode.
+
+Methods
+-------
+
+write(df)                           : Stores a DataFrame in the format of
+                                      `to_dataframe()`.
+
+query(geocodes, uf, start, end)     : Reads the rows matching the filters.
+"""
+
+import os
+import uuid
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pds
+
+from pathlib import Path
+from typing import Iterable, Optional
+
+from cds_weather import globals
+
+STORE_DIR = globals.DATA_DIR / "parquet"
+PARTITIONS = ["codigo_uf", "year"]
+ROWS_PER_GROUP = 64 * 1024
+
+VALUES = [
+    "temp_min",
+    "temp_med",
+    "temp_max",
+    "precip_min",
+    "precip_med",
+    "precip_max",
+    "pressao_min",
+    "pressao_med",
+    "pressao_max",
+    "umid_min",
+    "umid_med",
+    "umid_max",
+]
+
+SCHEMA = pa.schema(
+    [
+        ("date", pa.date32()),
+        ("geocode", pa.int32()),
+        *[(column, pa.float32()) for column in VALUES],
+        ("codigo_uf", pa.int32()),
+        ("year", pa.int32()),
+    ]
+)
+
+
+def _partitioning():
+    return pds.partitioning(
+        pa.schema([("codigo_uf", pa.int32()), ("year", pa.int32())]), flavor="hive"
+    )
+
+
+def _dataset(root: Path):
+    return pds.dataset(
+        root, format="parquet", partitioning=_partitioning(), schema=SCHEMA
+    )
+
+
+def _to_table(df: pd.DataFrame) -> pa.Table:
+    rows = df.reset_index().rename(columns={"geocodigo": "geocode"})
+    dates = pd.to_datetime(rows["date"])
+    geocodes = rows["geocode"].astype(np.int32)
+
+    columns = dict(date=dates.dt.date, geocode=geocodes)
+    columns.update({c: rows[c].astype(np.float32) for c in VALUES})
+    # the first two digits of a geocode are the code of its state
+    columns["codigo_uf"] = (geocodes // 100_000).astype(np.int32)
+    columns["year"] = dates.dt.year.astype(np.int32)
+    return pa.Table.from_pandas(pd.DataFrame(columns), SCHEMA, preserve_index=False)
+
+
+def write(df: pd.DataFrame, root: Optional[str] = None) -> int:
+    """
+    Stores the rows of a DataFrame in the format of `to_dataframe()`,
+    indexed by date with a `geocodigo` column. Partitions that receive
+    new rows are rewritten with the stored rows of other dates and
+    geocodes, in a temporary directory renamed into place once written.
+
+    Attrs:
+        df (DataFrame): Data to be stored.
+        root (opt(str)): Directory of the dataset, `STORE_DIR` by default.
+
+    Returns:
+        rows (int): Number of rows of `df` stored, a row repeated for the
+                    same date and geocode is stored once.
+    """
+    root = Path(root or STORE_DIR)
+    new = _to_table(df).to_pandas()
+    new = new.drop_duplicates(["date", "geocode"], keep="last")
+    rows = len(new)
+    if not rows:
+        return 0
+    partitions = new[PARTITIONS].drop_duplicates()
+
+    if root.exists():
+        expression = None
+        for uf, year in partitions.itertuples(index=False):
+            match = (pds.field("codigo_uf") == uf) & (pds.field("year") == year)
+            expression = match if expression is None else expression | match
+        stored = _dataset(root).to_table(filter=expression).to_pandas()
+        new = pd.concat([stored, new])
+        new = new.drop_duplicates(["date", "geocode"], keep="last")
+
+    new = new.sort_values(["codigo_uf", "year", "geocode", "date"])
+
+    # partitions are written aside, in a directory ignored by the queries,
+    # and renamed into place, the stored rows are kept if the write fails
+    staging = root / f".tmp-{uuid.uuid4().hex}"
+    try:
+        pds.write_dataset(
+            pa.Table.from_pandas(new, SCHEMA, preserve_index=False),
+            staging,
+            format="parquet",
+            partitioning=_partitioning(),
+            basename_template="part-{i}.parquet",
+            max_rows_per_group=ROWS_PER_GROUP,
+            min_rows_per_group=min(ROWS_PER_GROUP, len(new)),
+        )
+        for partition in sorted(staging.glob("*/*")):
+            _replace(partition, root / partition.relative_to(staging))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return rows
+
+
+def _replace(partition: Path, target: Path):
+    """
+    Moves a partition written aside to the place of the stored one.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if not target.exists():
+        os.rename(partition, target)
+        return
+    old = target.with_name(f".old-{uuid.uuid4().hex}")
+    os.rename(target, old)
+    try:
+        os.rename(partition, target)
+    except OSError:
+        os.rename(old, target)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def query(
+    geocodes: Optional[Iterable[int]] = None,
+    uf: Optional[int] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    columns: Optional[list] = None,
+    root: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Reads the stored rows that match every filter passed.
+
+    Attrs:
+        geocodes (opt(iterable)): Geocodes to be read.
+        uf (opt(int)): State code (`codigo_uf`) to be read.
+        start (opt(str)): First date, 'YYYY-MM-DD'.
+        end (opt(str)): Last date, 'YYYY-MM-DD'.
+        columns (opt(list)): Value columns to be read, all by default.
+        root (opt(str)): Directory of the dataset, `STORE_DIR` by default.
+
+    Returns:
+        DataFrame with `date`, `geocode` and the value columns, sorted by
+        geocode and date.
+    """
+    filters = []
+    if geocodes is not None:
+        geocodes = [int(g) for g in geocodes]
+        # states of the geocodes prune the partitions
+        ufs = sorted({g // 100_000 for g in geocodes})
+        filters.append(pds.field("codigo_uf").isin(ufs))
+        filters.append(pds.field("geocode").isin(geocodes))
+    if uf is not None:
+        filters.append(pds.field("codigo_uf") == int(uf))
+    if start is not None:
+        start = pd.Timestamp(start)
+        filters.append(pds.field("year") >= start.year)
+        filters.append(pds.field("date") >= pa.scalar(start.date(), pa.date32()))
+    if end is not None:
+        end = pd.Timestamp(end)
+        filters.append(pds.field("year") <= end.year)
+        filters.append(pds.field("date") <= pa.scalar(end.date(), pa.date32()))
+
+    expression = None
+    for f in filters:
+        expression = f if expression is None else expression & f
+
+    columns = ["date", "geocode"] + list(columns or VALUES)
+    root = Path(root or STORE_DIR)
+    if not root.exists():
+        return pd.DataFrame(columns=columns)
+
+    table = _dataset(root).to_table(columns=columns, filter=expression)
+    df = table.to_pandas()
+    return df.sort_values(["geocode", "date"]).reset_index(drop=True)
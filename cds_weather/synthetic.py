@@ -0,0 +1,149 @@
+"""
+Synthetic ERA5 single levels files, for benchmarks and tests.
+
+Writes NetCDF files with the layout of the files returned by the API for
+`reanalysis-era5-single-levels`: `t2m`, `tp`, `msl` and `d2m` variables on
+the 0.25 degree grid, with `time`, `latitude` (north to south) and
+`longitude` (west to east) dimensions, packed as int16 with a scale factor
+and an offset. Values follow a plausible daily and latitudinal cycle, with
+random noise, so they behave like real data without requesting the API.
+
+Methods
+-------
+
+dataset(area, start, end)         : Returns the synthetic xarray Dataset.
+
+write(file, area, start, end)     : Writes the synthetic Dataset to a NetCDF
+                                    or GRIB file.
+
+write_request(request, file)      : Writes the file that the API would return
+                                    for a `reanalysis-era5-single-levels`
+                                    request, used by fake clients. GRIB
+                                    requests are written by `grib.write()`.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from typing import Optional
+
+from cds_weather import globals, grib
+from cds_weather.cache import request_days
+
+TIMES = ["00:00", "03:00", "06:00", "09:00", "12:00", "15:00", "18:00", "21:00"]
+
+ATTRS = {
+    "t2m": dict(units="K", long_name="2 metre temperature"),
+    "tp": dict(units="m", long_name="Total precipitation"),
+    "msl": dict(units="Pa", long_name="Mean sea level pressure"),
+    "d2m": dict(units="K", long_name="2 metre dewpoint temperature"),
+}
+
+
+def dataset(
+    area: list,
+    start: str,
+    end: str,
+    times: Optional[list] = None,
+    seed: int = 0,
+) -> xr.Dataset:
+    """
+    Returns a synthetic ERA5 dataset.
+
+    Attrs:
+        area (list): [north, west, south, east] of the grid, in degrees.
+        start (str): First day, 'YYYY-MM-DD'.
+        end (str): Last day, 'YYYY-MM-DD'.
+        times (opt(list)): Times of each day, `TIMES` by default.
+        seed (int): Seed of the random noise.
+
+    Returns:
+        xr.Dataset with the `t2m`, `tp`, `msl` and `d2m` variables.
+    """
+    return _dataset(area, pd.date_range(start, end), times, seed)
+
+
+def _dataset(area: list, days, times: Optional[list], seed: int) -> xr.Dataset:
+    north, west, south, east = [float(c) for c in area]
+    res = globals.GRID_RESOLUTION
+    lats = np.arange(north, south - res / 2, -res, dtype=np.float32)
+    lons = np.arange(west, east + res / 2, res, dtype=np.float32)
+
+    days = pd.DatetimeIndex(days)
+    offsets = pd.to_timedelta([f"{t}:00" for t in times or TIMES])
+    time = (days.values[:, None] + offsets.values[None, :]).ravel()
+
+    rng = np.random.default_rng(seed)
+    shape = (len(time), len(lats), len(lons))
+    hours = pd.DatetimeIndex(time).hour.values[:, None, None]
+    daily = np.cos((hours - 15) / 24 * 2 * np.pi)
+    latitude = np.abs(lats)[None, :, None]
+
+    t2m = 303 - 0.4 * latitude + 5 * daily + rng.normal(0, 1.5, shape)
+    d2m = t2m - rng.gamma(2.0, 2.5, shape)
+    tp = rng.gamma(0.3, 0.0015, shape) * (rng.random(shape) < 0.3)
+    msl = 101_300 + 8 * latitude - 150 * daily + rng.normal(0, 120, shape)
+
+    variables = dict(t2m=t2m, tp=tp, msl=msl, d2m=d2m)
+    dims = ("time", "latitude", "longitude")
+    return xr.Dataset(
+        {
+            name: (dims, values.astype(np.float32), ATTRS[name])
+            for name, values in variables.items()
+        },
+        coords=dict(time=time, latitude=lats, longitude=lons),
+    )
+
+
+def _encoding(ds: xr.Dataset) -> dict:
+    """
+    int16 packing, as in the files returned by the API. Values are packed
+    in [-32766, 32766], -32767 is the missing value.
+    """
+    encoding = dict()
+    for name, var in ds.data_vars.items():
+        low, high = float(var.min()), float(var.max())
+        scale = (high - low) / (2**16 - 4) or 1.0
+        encoding[name] = dict(
+            dtype="int16",
+            scale_factor=scale,
+            add_offset=(high + low) / 2,
+            _FillValue=-32767,
+        )
+    return encoding
+
+
+def write(
+    file: str,
+    area: list,
+    start: str,
+    end: str,
+    times: Optional[list] = None,
+    seed: int = 0,
+    format: str = "netcdf",
+) -> str:
+    """
+    Writes a synthetic ERA5 NetCDF file, see `dataset()`, or a GRIB file
+    with `format="grib"`.
+
+    Returns:
+        file (str): Path of the file written.
+    """
+    ds = dataset(area, start, end, times, seed)
+    if format == "grib":
+        return grib.write(file, ds)
+    ds.to_netcdf(file, engine="netcdf4", encoding=_encoding(ds))
+    return str(file)
+
+
+def write_request(request: dict, file: str, seed: int = 0) -> str:
+    """
+    Writes the file the API would return for a request, with the area,
+    days and times of the request, in the format of the request.
+    """
+    ds = _dataset(request["area"], request_days(request), request.get("time"), seed)
+    if request.get("format") == "grib":
+        return grib.write(file, ds)
+    ds.to_netcdf(file, engine="netcdf4", encoding=_encoding(ds))
+    return str(file)
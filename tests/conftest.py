@@ -0,0 +1,10 @@
+"""
+pyproj, imported by MetPy in the tests comparing with it, crashes the
+interpreter at exit when it is loaded after the libraries of eccodes, so
+it is loaded before any test imports eccodes.
+"""
+
+try:
+    import pyproj  # noqa: F401
+except ImportError:
+    pass
@@ -0,0 +1,65 @@
+"""
+Tests of the compact archive of the downloaded files.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cds_weather import archive
+
+LATITUDES = [-22.75, -23.0]
+LONGITUDES = [-43.5, -43.25]
+
+
+def _netcdf(file, t2m: float) -> str:
+    times = pd.date_range("2022-01-01", periods=8, freq="3h")
+    shape = (len(times), len(LATITUDES), len(LONGITUDES))
+    values = np.linspace(0, 1, np.prod(shape)).reshape(shape)
+    ds = xr.Dataset(
+        dict(
+            t2m=(("time", "latitude", "longitude"), t2m + values),
+            tp=(("time", "latitude", "longitude"), 1e-3 * values),
+            msl=(("time", "latitude", "longitude"), 101300 + values),
+            d2m=(("time", "latitude", "longitude"), t2m - 5 + values),
+        ),
+        coords=dict(time=times, latitude=LATITUDES, longitude=LONGITUDES),
+    )
+    ds.to_netcdf(file, engine="netcdf4")
+    return str(file)
+
+
+def _t2m(root) -> np.ndarray:
+    (name, meta), *_ = archive.stores(root).items()
+    chunk = meta["chunks"]["2022-01"]
+    _, packed = archive._read_chunk(root / name, "2022-01", chunk, mmap=False)
+    return archive._decode(packed, chunk["scale"], chunk["offset"])[0]
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_replace_chunk(tmp_path, compress):
+    root = tmp_path / "archive"
+    archive.add(_netcdf(tmp_path / "first.nc", 280.0), root, compress=compress)
+    archive.add(_netcdf(tmp_path / "second.nc", 300.0), root, compress=compress)
+
+    np.testing.assert_allclose(_t2m(root).min(), 300.0, atol=1e-3)
+    # only the files of the current version are kept
+    (store,) = root.iterdir()
+    assert len(list(store.iterdir())) == 3
+
+
+def test_interrupted_add_keeps_the_previous_chunk(tmp_path, monkeypatch):
+    root = tmp_path / "archive"
+    archive.add(_netcdf(tmp_path / "first.nc", 280.0), root)
+
+    def interrupted(store, meta):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(archive, "_write_meta", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        archive.add(_netcdf(tmp_path / "second.nc", 300.0), root, compress=False)
+
+    t2m = _t2m(root)
+    np.testing.assert_allclose(t2m.min(), 280.0, atol=1e-3)
+    np.testing.assert_allclose(t2m.max(), 281.0, atol=1e-3)
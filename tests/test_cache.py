@@ -0,0 +1,173 @@
+"""
+Tests of the local cache of requests.
+"""
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cds_weather import cache
+
+AREA = [-22.75, -43.5, -23.0, -43.25]
+
+
+def _packed(file, start: str, t2m: float) -> str:
+    """
+    Writes a day of a constant `t2m`, packed as int16 with the scale and
+    offset of its own range, as the files of the API.
+    """
+    times = pd.date_range(start, periods=8, freq="3h")
+    values = np.full((len(times), 2, 2), t2m) + np.linspace(0, 1, 4).reshape(2, 2)
+    ds = xr.Dataset(
+        dict(t2m=(("time", "latitude", "longitude"), values)),
+        coords=dict(time=times, latitude=AREA[0::2], longitude=AREA[1::2]),
+    )
+    encoding = dict(
+        t2m=dict(dtype="int16", scale_factor=1 / 65532, add_offset=t2m + 0.5)
+    )
+    ds.to_netcdf(file, engine="netcdf4", encoding=encoding)
+    return str(file)
+
+
+def test_assemble_keeps_values_of_every_file(tmp_path):
+    first = _packed(tmp_path / "first.nc", "2022-01-01", 280.0)
+    second = _packed(tmp_path / "second.nc", "2022-01-02", 300.0)
+    target = tmp_path / "target.nc"
+
+    cache._assemble(
+        {first: ["2022-01-01"], second: ["2022-01-02"]},
+        dict(area=AREA),
+        str(target),
+    )
+
+    with xr.open_dataset(target, engine="netcdf4") as ds:
+        t2m = ds.t2m.values
+    np.testing.assert_allclose(t2m[:8].min(), 280.0, atol=1e-3)
+    np.testing.assert_allclose(t2m[8:].min(), 300.0, atol=1e-3)
+    np.testing.assert_allclose(t2m[8:].max(), 301.0, atol=1e-3)
+
+
+class _FailingClient:
+    def retrieve(self, dataset: str, request: dict, target: str):
+        with open(target, "wb") as f:
+            f.write(b"partial")
+        raise ConnectionError("connection reset")
+
+
+def test_fetch_removes_part_file_on_failure(tmp_path):
+    request = dict(area=AREA, year="2022", month="01", day=["01"], time=["00:00"])
+    with pytest.raises(ConnectionError):
+        cache._fetch(_FailingClient(), "dataset", request, tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+class _Client:
+    """
+    Writes the days and area of each request, with values given by the
+    time and the coordinates only, so any split of a request has the
+    same values.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def retrieve(self, dataset: str, request: dict, target: str):
+        self.requests.append(request)
+        north, west, south, east = request["area"]
+        days = pd.DatetimeIndex(cache.request_days(request))
+        times = (days.values[:, None] + pd.to_timedelta(TIMES).values).ravel()
+        lats = np.arange(north, south - 0.125, -0.25)
+        lons = np.arange(west, east + 0.125, 0.25)
+        hours = (times - np.datetime64("2022-01-01")) / np.timedelta64(1, "h")
+        values = hours[:, None, None] + lats[:, None] + 0.1 * lons[None, :]
+        ds = xr.Dataset(
+            dict(t2m=(("time", "latitude", "longitude"), values)),
+            coords=dict(time=times, latitude=lats, longitude=lons),
+        )
+        ds.to_netcdf(target, engine="netcdf4")
+
+
+TIMES = ["00:00:00", "12:00:00"]
+
+
+def _request(first: int, last: int, area=AREA) -> dict:
+    return dict(
+        product_type="reanalysis",
+        format="netcdf",
+        variable=["2m_temperature"],
+        time=[t[:5] for t in TIMES],
+        area=area,
+        year="2022",
+        month="01",
+        day=[f"{d:02d}" for d in range(first, last + 1)],
+    )
+
+
+def test_partial_overlap_matches_direct_download(tmp_path):
+    client = _Client()
+    cache_dir = tmp_path / "cache"
+    area = [-22.0, -44.0, -23.0, -43.0]
+    cache.retrieve(
+        client, "dataset", _request(1, 10, area), tmp_path / "a.nc", cache_dir
+    )
+    cache.retrieve(
+        client, "dataset", _request(16, 20, area), tmp_path / "b.nc", cache_dir
+    )
+
+    # days 1 to 20 of a smaller area, days 11 to 15 are missing
+    target = tmp_path / "target.nc"
+    cache.retrieve(client, "dataset", _request(5, 18), target, cache_dir)
+    assert cache.request_days(client.requests[-1]) == [
+        f"2022-01-{d}" for d in range(11, 16)
+    ]
+
+    direct = tmp_path / "direct.nc"
+    _Client().retrieve("dataset", _request(5, 18), direct)
+    with xr.open_dataset(target, engine="netcdf4") as result:
+        with xr.open_dataset(direct, engine="netcdf4") as expected:
+            xr.testing.assert_allclose(result.load(), expected.load())
+
+
+def test_evict_keeps_pinned_files(tmp_path):
+    client = _Client()
+    for first in (1, 11):
+        target = tmp_path / f"{first}.nc"
+        cache.retrieve(client, "dataset", _request(first, first + 9), target, tmp_path)
+    manifest = cache._read_manifest(tmp_path)
+    files = sorted(tmp_path / e["file"] for e in manifest.values())
+
+    pin = cache._pin(files[0])
+    try:
+        removed = cache.evict(0, tmp_path)
+        assert files[0].exists() and not files[1].exists()
+        assert removed > 0
+    finally:
+        pin.close()
+    cache.evict(0, tmp_path)
+    assert not files[0].exists()
+    assert cache._read_manifest(tmp_path) == dict()
+
+
+def _retrieve_days(cache_dir: str, first: int):
+    client = _Client()
+    for day in range(first, first + 5):
+        target = f"{cache_dir}/{first}_{day}.target"
+        cache.retrieve(client, "dataset", _request(day, day), target, cache_dir)
+
+
+def test_processes_share_the_manifest(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_retrieve_days, args=(str(tmp_path), first))
+        for first in (1, 11, 21)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    assert len(cache._read_manifest(tmp_path)) == 15
@@ -0,0 +1,156 @@
+"""
+Tests of the manifests of the `adclima` command.
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+from cds_weather import cli, executor, extract_latlons, extract_reanalysis, regions
+
+RIO_DE_JANEIRO = 3304557
+NITEROI = 3303302
+
+
+def _manifest(tmp_path, **keys) -> str:
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(keys))
+    return str(path)
+
+
+def test_read_manifest_defaults(tmp_path):
+    path = _manifest(
+        tmp_path, geocodes=[RIO_DE_JANEIRO], start="2022-01-01", end="2022-01-31"
+    )
+    manifest = cli.read_manifest(path)
+
+    assert manifest["geocodes"] == [RIO_DE_JANEIRO]
+    assert manifest["sink"] == "none"
+    assert manifest["max_region_size"] == regions.MAX_REGION_SIZE
+    assert manifest["journal"] == str(tmp_path / "manifest.journal")
+    journal = str(tmp_path / "run.journal")
+    path = _manifest(
+        tmp_path, uf=[33], start="2022-01-01", end="2022-01-31", journal=journal
+    )
+    assert cli.read_manifest(path)["journal"] == journal
+
+
+@pytest.mark.parametrize(
+    "keys, error",
+    [
+        (dict(geocodes="all", start="2022-01-01"), "missing \\['end'\\]"),
+        (dict(start="2022-01-01", end="2022-01-31"), "no `geocodes` nor `uf`"),
+        (
+            dict(geocodes=[], uf=[], start="2022-01-01", end="2022-01-31"),
+            "no `geocodes`",
+        ),
+        (dict(uf=[33], start="2022-01-01", end="2022-01-31", workes=4), "workes"),
+    ],
+)
+def test_read_manifest_validation(tmp_path, keys, error):
+    with pytest.raises(ValueError, match=error):
+        cli.read_manifest(_manifest(tmp_path, **keys))
+
+
+def test_months():
+    assert cli._months("2022-01-15", "2022-03-10") == [
+        ("2022-01-15", "2022-01-31"),
+        ("2022-02-01", "2022-02-28"),
+        ("2022-03-01", "2022-03-10"),
+    ]
+    assert cli._months("2024-02-10", "2024-02-29") == [("2024-02-10", "2024-02-29")]
+    assert cli._months("2022-12-31", "2023-01-01") == [
+        ("2022-12-31", "2022-12-31"),
+        ("2023-01-01", "2023-01-01"),
+    ]
+    assert cli._months("2022-02-01", "2022-01-31") == []
+
+
+def test_units(tmp_path):
+    path = _manifest(
+        tmp_path,
+        geocodes=[RIO_DE_JANEIRO, NITEROI],
+        uf=[33],
+        start="2022-01-20",
+        end="2022-02-10",
+        max_region_size=1.0,
+    )
+    manifest = cli.read_manifest(path)
+    units = cli.units(manifest)
+    boxes = regions.bounding_boxes(extract_latlons.geocodes(uf=33), 1.0)
+
+    assert len(units) == 2 * len(boxes)
+    assert len({u["id"] for u in units}) == len(units)
+    assert {(u["start"], u["end"]) for u in units} == {
+        ("2022-01-20", "2022-01-31"),
+        ("2022-02-01", "2022-02-10"),
+    }
+    # the geocodes of uf 33 are selected once
+    january = [g for u in units if u["start"] == "2022-01-20" for g in u["geocodes"]]
+    assert sorted(january) == sorted(extract_latlons.geocodes(uf=33))
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """
+    Fake `_download()`, failing for the units in `downloads["fail"]`.
+    """
+    calls = dict(done=[], fail=set())
+
+    def download(unit, manifest):
+        if unit["id"] in calls["fail"]:
+            raise Exception("download failed")
+        calls["done"].append(unit["id"])
+        return {unit["id"]: unit["geocodes"]}
+
+    def to_dataframe_batch(files):
+        ((_, geocodes),) = files.items()
+        return pd.DataFrame(dict(geocodigo=[str(g) for g in geocodes]))
+
+    monkeypatch.setattr(cli, "_download", download)
+    monkeypatch.setattr(extract_reanalysis, "to_dataframe_batch", to_dataframe_batch)
+    return calls
+
+
+def test_run_resumes_from_the_journal(tmp_path, downloads, capsys):
+    path = _manifest(
+        tmp_path, uf=[33], start="2022-01-01", end="2022-03-31", max_region_size=2.0
+    )
+    manifest = cli.read_manifest(path)
+    units = cli.units(manifest)
+    ids = [u["id"] for u in units]
+    downloads["fail"] = {ids[0]}
+
+    assert not cli.run(manifest)
+    assert sorted(downloads["done"]) == sorted(ids[1:])
+    assert cli.status(manifest) == dict(done=len(ids) - 1, failed=1, pending=0)
+    journal = executor.read_journal(manifest["journal"])
+    assert journal[ids[0]]["error"] == "download failed"
+    for unit in units[1:]:
+        assert journal[unit["id"]]["rows"] == len(unit["geocodes"])
+
+    # only the failed unit runs again
+    downloads["done"].clear()
+    downloads["fail"] = set()
+    assert cli.run(manifest)
+    assert downloads["done"] == [ids[0]]
+    assert cli.status(manifest) == dict(done=len(ids), failed=0, pending=0)
+    assert f"1 of {len(ids)} units pending" in capsys.readouterr().out
+
+    assert cli.run(manifest)
+    assert downloads["done"] == [ids[0]]
+    assert f"0 of {len(ids)} units pending" in capsys.readouterr().out
+
+
+def test_main(tmp_path, downloads, capsys):
+    path = _manifest(
+        tmp_path, geocodes=[RIO_DE_JANEIRO], start="2022-01-01", end="2022-02-28"
+    )
+
+    assert cli.main(["status", path]) == 0
+    assert capsys.readouterr().out == "0 done, 0 failed, 2 pending\n"
+    journal = str(tmp_path / "other.journal")
+    assert cli.main(["run", path, "--journal", journal, "--workers", "1"]) == 0
+    assert len(executor.read_journal(journal)) == 2
+    assert not (tmp_path / "manifest.journal").exists()
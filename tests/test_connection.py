@@ -0,0 +1,83 @@
+"""
+Tests of the pool of clients of the API.
+"""
+
+import threading
+
+import pytest
+
+from cds_weather import connection
+
+
+class _Client:
+    pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """
+    Pool of fake clients, counting the validations of the credentials.
+    """
+    validations = []
+
+    def validate(interactive):
+        validations.append(interactive)
+        connection._validated = True
+
+    monkeypatch.setattr(connection, "_validate", validate)
+    monkeypatch.setattr(connection, "_new_client", _Client)
+    connection.reset()
+    yield validations
+    connection.reset()
+
+
+def test_credentials_are_validated_once(pool):
+    connection.connect(interactive=False)
+    with connection.client(interactive=False):
+        pass
+    assert pool == [False]
+
+    connection.reset()
+    connection.connect(interactive=False)
+    assert pool == [False, False]
+
+
+def test_clients_are_lent_to_one_thread_at_a_time(pool):
+    with connection.client() as first:
+        with connection.client() as second:
+            assert first is not second
+    # idle clients are reused, the last returned first
+    with connection.client() as again:
+        assert again is first
+    assert connection._clients.qsize() == 2
+
+
+def test_threads_never_share_a_client(pool):
+    in_use, lent, lock = set(), [], threading.Lock()
+    barrier = threading.Barrier(8)
+
+    def borrow():
+        with connection.client() as client:
+            with lock:
+                assert id(client) not in in_use
+                in_use.add(id(client))
+                lent.append(client)
+            barrier.wait()
+            with lock:
+                in_use.remove(id(client))
+
+    threads = [threading.Thread(target=borrow) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(client) for client in lent}) == 8
+
+
+def test_reset_drops_the_pool(pool):
+    with connection.client() as client:
+        pass
+    connection.reset()
+    with connection.client() as new:
+        assert new is not client
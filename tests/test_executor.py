@@ -0,0 +1,77 @@
+"""
+Tests of the concurrent download executor.
+"""
+
+import time
+import threading
+
+import requests
+
+from cds_weather import connection, executor
+
+
+def _http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} Error", response=response)
+
+
+def test_transient_errors():
+    assert executor._is_transient(ConnectionError())
+    assert executor._is_transient(requests.ConnectionError())
+    assert executor._is_transient(requests.Timeout())
+    assert executor._is_transient(requests.exceptions.ChunkedEncodingError())
+    assert executor._is_transient(_http_error(429))
+    assert executor._is_transient(_http_error(503))
+
+
+def test_permanent_errors():
+    assert not executor._is_transient(_http_error(400))
+    assert not executor._is_transient(_http_error(404))
+    assert not executor._is_transient(Exception("request 5005000 failed"))
+    assert not executor._is_transient(Exception("no connection to the variable"))
+
+
+class _Client:
+    """
+    Fails if two threads retrieve with it at the same time.
+    """
+
+    def __init__(self):
+        self.targets = []
+        self._busy = threading.Lock()
+
+    def retrieve(self, dataset: str, request: dict, target: str):
+        if not self._busy.acquire(blocking=False):
+            raise AssertionError("client used by two threads at once")
+        try:
+            time.sleep(0.01)
+            self.targets.append(target)
+            with open(target, "w") as f:
+                f.write(dataset)
+        finally:
+            self._busy.release()
+
+
+def test_jobs_take_clients_of_their_own(tmp_path, monkeypatch):
+    clients = []
+
+    def new_client():
+        clients.append(_Client())
+        return clients[-1]
+
+    monkeypatch.setattr(connection, "_validated", True)
+    monkeypatch.setattr(connection, "_clients", None)
+    monkeypatch.setattr(connection, "_new_client", new_client)
+    jobs = [
+        dict(dataset="dataset", request=dict(day=i), target=str(tmp_path / f"{i}.nc"))
+        for i in range(16)
+    ]
+
+    results = executor.run(jobs, workers=8, retries=0)
+
+    assert all(r["state"] == "done" for r in results.values())
+    assert sum(len(c.targets) for c in clients) == 16
+    assert len(clients) <= 8
+    # every client is back in the pool
+    assert connection._clients.qsize() == len(clients)
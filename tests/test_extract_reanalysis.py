@@ -0,0 +1,290 @@
+"""
+Regression tests of `extract_reanalysis.to_dataframe()` against the
+per-row implementation it replaced.
+"""
+
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cds_weather import extract_reanalysis
+
+GEOCODE = "3304557"
+LATITUDES = [-22.75, -23.0]
+# the cell of Rio de Janeiro is between -43.25 and -43.0
+LONGITUDES = [-43.5, -43.25]
+CELL_LONGITUDES = [-43.5, -43.25, -43.0]
+
+# tolerance of each column group, relative to the previous implementation
+RTOL = 1e-9
+TOLERANCES = {
+    "temp": dict(rtol=RTOL, atol=0),
+    "precip": dict(rtol=RTOL, atol=0),
+    "pressao": dict(rtol=RTOL, atol=0),
+    # the previous implementation used MetPy, whose Ambaum (2020) saturation
+    # vapor pressure differs from the Bolton kernel of `humidity` by up to
+    # 0.3 percentage points (@see tests/test_humidity.py)
+    "umid": dict(rtol=0, atol=0.3),
+}
+
+
+def _netcdf(path, days: int = 10, seed: int = 0, longitudes=LONGITUDES) -> str:
+    """
+    Writes a NetCDF file with the layout of the API, with random values
+    around the ones of Rio de Janeiro, every 3 hours.
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2022-01-01", periods=days * 8, freq="3h")
+    shape = (len(times), len(LATITUDES), len(longitudes))
+    t2m = 298 + 5 * rng.standard_normal(shape)
+    variables = dict(
+        t2m=t2m,
+        d2m=t2m - rng.uniform(0, 10, shape),
+        tp=rng.uniform(0, 2e-3, shape),
+        msl=101300 + 300 * rng.standard_normal(shape),
+    )
+    ds = xr.Dataset(
+        {name: (("time", "latitude", "longitude"), v) for name, v in variables.items()},
+        coords=dict(time=times, latitude=LATITUDES, longitude=longitudes),
+    )
+    file = path / f"{GEOCODE}_20220101_20220110.nc"
+    ds.to_netcdf(file, engine="netcdf4")
+    return str(file)
+
+
+def _previous_to_dataframe(file) -> pd.DataFrame:
+    """
+    `to_dataframe()` before the vectorized aggregation: the spatial mean
+    of each time step in Python, aggregated by day for each variable and
+    merged by date.
+    """
+    mpcalc = pytest.importorskip("metpy.calc")
+    from metpy.units import units
+
+    def parse_data(data, column_name):
+        df = pd.DataFrame(data)
+        df["date"] = df["date"].dt.floor("D")
+        result = df.groupby("date").agg(
+            var_min=("var", "min"), var_med=("var", "mean"), var_max=("var", "max")
+        )
+        result.columns = result.columns.str.replace("var", column_name)
+        return result
+
+    def retrieve_data(row):
+        parsed_date = row.time.values.astype("M8[ms]").astype("O")
+        return dict(date=parsed_date, var=np.mean(row.values))
+
+    ds = xr.load_dataset(file, engine="netcdf4")
+    t2m = ds.t2m - 273.15
+    tp = ds.tp * 1000
+    msl = ds.msl / 100
+    d2m = ds.d2m - 273.15
+    rh = (
+        mpcalc.relative_humidity_from_dewpoint(t2m * units.degC, d2m * units.degC) * 100
+    )
+
+    dfs = [
+        parse_data([retrieve_data(v) for v in t2m], "temp"),
+        parse_data([retrieve_data(v) for v in tp], "precip"),
+        parse_data([retrieve_data(v) for v in msl], "pressao"),
+        parse_data([retrieve_data(v) for v in rh], "umid"),
+    ]
+    merged = reduce(lambda left, right: pd.merge(left, right, on=["date"]), dfs)
+    merged.insert(0, "geocodigo", [GEOCODE] * len(merged))
+    return merged
+
+
+def test_to_dataframe_matches_previous(tmp_path):
+    file = _netcdf(tmp_path)
+    expected = _previous_to_dataframe(file)
+    result = extract_reanalysis.to_dataframe(file)
+
+    assert list(result.columns) == list(expected.columns)
+    assert list(result.index.astype("datetime64[ns]")) == list(
+        expected.index.astype("datetime64[ns]")
+    )
+    assert (result["geocodigo"] == GEOCODE).all()
+    for column in expected.columns[1:]:
+        tolerance = TOLERANCES[column.split("_")[0]]
+        np.testing.assert_allclose(
+            result[column].values,
+            expected[column].values,
+            err_msg=column,
+            **tolerance,
+        )
+
+
+@pytest.mark.parametrize("days_per_chunk", [1, 3, 10])
+def test_time_chunks_hold_whole_days(tmp_path, days_per_chunk):
+    file = _netcdf(tmp_path)
+    with xr.open_dataset(file, engine="netcdf4") as ds:
+        step_bytes = ds.latitude.size * ds.longitude.size * 8
+        max_memory = days_per_chunk * 8 * step_bytes * extract_reanalysis.MEMORY_FACTOR
+        chunks = extract_reanalysis._time_chunks(ds, max_memory)
+        days = ds.time.dt.floor("D").values
+
+    # consecutive, covering every time step, at most the days that fit
+    assert chunks[0].start == 0 and chunks[-1].stop == len(days)
+    assert all(a.stop == b.start for a, b in zip(chunks, chunks[1:]))
+    for chunk in chunks:
+        assert len(set(days[chunk])) <= days_per_chunk
+        # a day is never split between two chunks
+        assert chunk.start == 0 or days[chunk.start] != days[chunk.start - 1]
+    assert len(chunks) == -(-10 // days_per_chunk)
+
+
+def test_time_chunks_of_a_step_larger_than_the_memory(tmp_path):
+    file = _netcdf(tmp_path, days=3)
+    with xr.open_dataset(file, engine="netcdf4") as ds:
+        chunks = extract_reanalysis._time_chunks(ds, max_memory=1)
+    assert [(c.start, c.stop) for c in chunks] == [(0, 8), (8, 16), (16, 24)]
+
+
+@pytest.mark.parametrize("max_memory", [1, 10_000, 10**9])
+def test_chunked_parse_matches_full_parse(tmp_path, max_memory):
+    file = _netcdf(tmp_path)
+    expected = extract_reanalysis.to_dataframe(file)
+    result = extract_reanalysis.to_dataframe(file, max_memory=max_memory)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_geocode_cell(tmp_path):
+    file = _netcdf(tmp_path, longitudes=CELL_LONGITUDES)
+    result = extract_reanalysis.to_dataframe(file, GEOCODE)
+
+    with xr.open_dataset(file, engine="netcdf4") as ds:
+        cell = ds.sel(longitude=[-43.25, -43.0]).load()
+    expected = extract_reanalysis._daily_aggregates(
+        extract_reanalysis._convert(cell), GEOCODE
+    )
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("geocode", [GEOCODE, 3550308])
+def test_geocode_outside_the_grid(tmp_path, geocode):
+    # half of the cell of Rio de Janeiro and none of the one of São Paulo
+    file = _netcdf(tmp_path)
+    with pytest.raises(ValueError, match="not in the grid"):
+        extract_reanalysis.to_dataframe(file, geocode)
+
+
+class _PackedClient:
+    """
+    Writes a day of each requested month, packed as int16 with the scale
+    and offset of its own range, 280 K in January and 300 K after it.
+    """
+
+    def retrieve(self, dataset: str, request: dict, target: str):
+        t2m = 280.0 if request["month"] == "01" else 300.0
+        times = pd.date_range(f"2022-{request['month']}-01", periods=8, freq="3h")
+        values = np.full((len(times), 2, 2), t2m)
+        ds = xr.Dataset(
+            dict(t2m=(("time", "latitude", "longitude"), values)),
+            coords=dict(
+                time=times, latitude=[-22.75, -23.0], longitude=[-43.5, -43.25]
+            ),
+        )
+        encoding = dict(t2m=dict(dtype="int16", scale_factor=1 / 65532, add_offset=t2m))
+        ds.to_netcdf(target, engine="netcdf4", encoding=encoding)
+
+
+def test_parts_keep_their_values(tmp_path):
+    target = str(tmp_path / f"{GEOCODE}_20220101_20220201.nc")
+    requests = [dict(month="01"), dict(month="02")]
+    extract_reanalysis._retrieve(_PackedClient(), requests, target, use_cache=False)
+
+    with xr.open_dataset(target, engine="netcdf4") as ds:
+        t2m = ds.t2m.values
+    np.testing.assert_allclose(t2m[:8], 280.0, atol=1e-3)
+    np.testing.assert_allclose(t2m[8:], 300.0, atol=1e-3)
+
+
+def _parsed(monkeypatch) -> list:
+    """
+    Records the files parsed by `to_dataframe_many()` in this process.
+    """
+    parsed = []
+    columns = extract_reanalysis._columns
+
+    def counted(file, geocodes, max_memory):
+        parsed.append((file, geocodes))
+        return columns(file, geocodes, max_memory)
+
+    monkeypatch.setattr(extract_reanalysis, "_columns", counted)
+    return parsed
+
+
+def test_to_dataframe_many_parses_each_file_once(tmp_path, monkeypatch):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = _netcdf(tmp_path / "a", seed=1, longitudes=CELL_LONGITUDES)
+    second = _netcdf(tmp_path / "b", days=3, seed=2, longitudes=CELL_LONGITUDES)
+    parsed = _parsed(monkeypatch)
+
+    df = extract_reanalysis.to_dataframe_many(
+        [first, second, first, tmp_path / "a" / f"{GEOCODE}_20220101_20220110.nc"],
+        workers=1,
+    )
+
+    assert [file for file, _ in parsed] == [first, second]
+    expected = pd.concat(
+        [
+            extract_reanalysis.to_dataframe(first, GEOCODE),
+            extract_reanalysis.to_dataframe(second, GEOCODE),
+        ]
+    )
+    pd.testing.assert_frame_equal(df, expected, check_index_type=False)
+    assert df.attrs["errors"] == dict()
+
+
+def test_to_dataframe_many_merges_the_geocodes_of_a_file(tmp_path, monkeypatch):
+    file = _netcdf(tmp_path, longitudes=CELL_LONGITUDES)
+    parsed = _parsed(monkeypatch)
+
+    # Niterói shares the cell of Rio de Janeiro
+    df = extract_reanalysis.to_dataframe_many(
+        {
+            file: [GEOCODE, 3303302],
+            tmp_path / f"{GEOCODE}_20220101_20220110.nc": [GEOCODE],
+        },
+        workers=1,
+    )
+
+    assert parsed == [(file, [int(GEOCODE), 3303302])]
+    assert df["geocodigo"].value_counts().to_dict() == {GEOCODE: 10, "3303302": 10}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_to_dataframe_many_without_results(tmp_path, workers):
+    columns = extract_reanalysis.to_dataframe(
+        _netcdf(tmp_path, longitudes=CELL_LONGITUDES), GEOCODE
+    ).columns
+
+    empty = extract_reanalysis.to_dataframe_many([], workers=workers)
+    assert empty.empty
+    assert empty.columns.tolist() == columns.tolist()
+    assert empty.index.name == "date"
+    assert empty.attrs["errors"] == dict()
+
+    missing = str(tmp_path / f"{GEOCODE}_20220101_20220131.nc")
+    failed = extract_reanalysis.to_dataframe_many([missing], workers=workers)
+    assert failed.empty
+    assert failed.columns.tolist() == columns.tolist()
+    assert list(failed.attrs["errors"]) == [missing]
+
+
+def test_to_dataframe_many_errors(tmp_path):
+    file = _netcdf(tmp_path, longitudes=CELL_LONGITUDES)
+    missing = str(tmp_path / f"{GEOCODE}_20220101_20220131.nc")
+
+    df = extract_reanalysis.to_dataframe_many([missing, file], workers=2)
+    assert len(df) == 10
+    assert list(df.attrs["errors"]) == [missing]
+
+    with pytest.raises(FileNotFoundError):
+        extract_reanalysis.to_dataframe_many([file, missing], workers=1, errors="raise")
+    with pytest.raises(ValueError, match="Unknown errors option"):
+        extract_reanalysis.to_dataframe_many([file], errors="ignore")
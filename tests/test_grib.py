@@ -0,0 +1,218 @@
+"""
+Tests of the GRIB decoder against `eccodes` and the NetCDF parser.
+"""
+
+import eccodes
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cds_weather import extract_reanalysis, grib
+
+GEOCODE = "3304557"
+LATITUDES = [-22.75, -23.0]
+# the whole cell of Rio de Janeiro
+LONGITUDES = [-43.5, -43.25, -43.0]
+
+
+def _dataset(days: int = 3, seed: int = 0) -> xr.Dataset:
+    """
+    Dataset with the variables and layout of the NetCDF files of the API.
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2022-01-01", periods=days * 8, freq="3h")
+    shape = (len(times), len(LATITUDES), len(LONGITUDES))
+    t2m = 298 + 5 * rng.standard_normal(shape)
+    variables = dict(
+        t2m=t2m,
+        d2m=t2m - rng.uniform(0, 10, shape),
+        tp=rng.uniform(0, 2e-3, shape),
+        msl=101300 + 300 * rng.standard_normal(shape),
+    )
+    return xr.Dataset(
+        {name: (("time", "latitude", "longitude"), v) for name, v in variables.items()},
+        coords=dict(time=times, latitude=LATITUDES, longitude=LONGITUDES),
+    )
+
+
+def _eccodes(file) -> list:
+    """
+    (shortName, valid time, values) of each message, decoded by `eccodes`.
+    """
+    result = []
+    with open(file, "rb") as f:
+        while True:
+            handle = eccodes.codes_grib_new_from_file(f)
+            if handle is None:
+                return result
+            date = eccodes.codes_get_long(handle, "validityDate")
+            time = eccodes.codes_get_long(handle, "validityTime")
+            valid = pd.Timestamp(f"{date} {time:04d}").to_datetime64()
+            values = eccodes.codes_get_values(handle)
+            if eccodes.codes_get_long(handle, "bitmapPresent"):
+                missing = eccodes.codes_get_double(handle, "missingValue")
+                values[values == missing] = np.nan
+            result.append(
+                (eccodes.codes_get_string(handle, "shortName"), valid, values)
+            )
+            eccodes.codes_release(handle)
+
+
+def _decoded(monkeypatch) -> list:
+    """
+    Records the messages decoded by `eccodes` instead of numpy.
+    """
+    decoded = []
+    decode = grib._decode
+
+    def counted(message):
+        decoded.append(message)
+        return decode(message)
+
+    monkeypatch.setattr(grib, "_decode", counted)
+    return decoded
+
+
+def _assert_messages(file):
+    expected = _eccodes(file)
+    result = list(grib.messages(file))
+
+    assert len(result) == len(expected)
+    for (variable, time, lats, lons, values), (name, valid, reference) in zip(
+        result, expected
+    ):
+        assert variable == grib.SHORT_NAMES[name]
+        assert time == valid
+        assert values.shape == (lats.size, lons.size)
+        np.testing.assert_allclose(values.ravel(), reference, rtol=1e-12)
+
+
+@pytest.mark.parametrize("bits", [8, 16, 24, 32])
+def test_fast_path_matches_eccodes(tmp_path, monkeypatch, bits):
+    file = grib.write(tmp_path / "era5.grib", _dataset(), bits_per_value=bits)
+    decoded = _decoded(monkeypatch)
+
+    _assert_messages(file)
+    # only the first message of each variable is decoded by eccodes
+    assert len(decoded) == len(grib.PARAM_IDS)
+
+
+def test_constant_and_negative_fields(tmp_path, monkeypatch):
+    ds = _dataset()
+    # a reference value with the sign bit and a field packed with 0 bits
+    ds["t2m"] = ds.t2m - 330.0
+    ds["tp"] = ds.tp * 0
+    file = grib.write(tmp_path / "era5.grib", ds)
+
+    decoded = _decoded(monkeypatch)
+    _assert_messages(file)
+    assert len(decoded) == len(grib.PARAM_IDS)
+
+    t2m = [values for variable, _, _, _, values in grib.messages(file)][0::4]
+    np.testing.assert_allclose(t2m, ds.t2m.values, atol=1e-4)
+    assert (np.array(t2m) < 0).all()
+    tp = [values for variable, _, _, _, values in grib.messages(file)][1::4]
+    assert (np.array(tp) == 0).all()
+
+
+def test_signed():
+    assert grib._signed(b"\x00\x05") == 5
+    assert grib._signed(b"\x80\x05") == -5
+    assert grib._signed(b"\xff\xff") == -0x7FFF
+    assert grib._signed(b"\x80\x00\x01") == -1
+
+
+def test_missing_values(tmp_path, monkeypatch):
+    file = grib.write(tmp_path / "era5.grib", _dataset(days=1))
+    with open(file, "rb") as f:
+        handle = eccodes.codes_grib_new_from_file(f)
+    values = eccodes.codes_get_values(handle)
+    values[[0, 4]] = 9999
+    eccodes.codes_set(handle, "missingValue", 9999)
+    eccodes.codes_set(handle, "bitmapPresent", 1)
+    eccodes.codes_set_values(handle, values)
+    masked = tmp_path / "masked.grib"
+    with open(masked, "wb") as f:
+        eccodes.codes_write(handle, f)
+        eccodes.codes_write(handle, f)
+    eccodes.codes_release(handle)
+
+    decoded = _decoded(monkeypatch)
+    _assert_messages(masked)
+    # messages with a bitmap are always decoded by eccodes
+    assert len(decoded) == 2
+    (_, _, _, _, values), _ = grib.messages(masked)
+    assert np.isnan(values.ravel()[[0, 4]]).all()
+    assert not np.isnan(values.ravel()[[1, 2, 3, 5]]).any()
+
+
+def test_large_messages(tmp_path, monkeypatch):
+    """
+    GRIB 1 messages over 16 MB store their length divided by 120.
+    """
+    ni, nj = 2400, 1800
+    handle = eccodes.codes_grib_new_from_samples("regular_ll_sfc_grib1")
+    grid = dict(
+        Ni=ni,
+        Nj=nj,
+        latitudeOfFirstGridPointInDegrees=45.0,
+        latitudeOfLastGridPointInDegrees=45.0 - 0.05 * (nj - 1),
+        longitudeOfFirstGridPointInDegrees=0.0,
+        longitudeOfLastGridPointInDegrees=0.125 * (ni - 1),
+        iDirectionIncrementInDegrees=0.125,
+        jDirectionIncrementInDegrees=0.05,
+        bitsPerValue=32,
+        dataDate=20220101,
+    )
+    for key, value in grid.items():
+        eccodes.codes_set(handle, key, value)
+    values = np.random.default_rng(0).uniform(200, 300, ni * nj)
+    file = tmp_path / "large.grib"
+    with open(file, "wb") as f:
+        for hour in (0, 1, 2):
+            eccodes.codes_set(handle, "dataTime", hour * 100)
+            eccodes.codes_set_values(handle, values + hour)
+            eccodes.codes_write(handle, f)
+    eccodes.codes_release(handle)
+
+    message = file.read_bytes()[:16]
+    assert int.from_bytes(message[4:7], "big") & 0x800000
+    decoded = _decoded(monkeypatch)
+    result = list(grib.messages(file))
+
+    assert len(result) == 3
+    assert len(decoded) == 1
+    for hour, (_, time, _, _, decoded_values) in enumerate(result):
+        assert time == np.datetime64(f"2022-01-01T{hour:02d}:00", "ns")
+        np.testing.assert_allclose(decoded_values.ravel(), values + hour, rtol=1e-6)
+
+
+def test_bytes_between_messages_are_skipped(tmp_path):
+    file = grib.write(tmp_path / "era5.grib", _dataset(days=1))
+    data = (tmp_path / "era5.grib").read_bytes()
+    padded = tmp_path / "padded.grib"
+    padded.write_bytes(b"header GRI" + data + b"\0" * 7 + data + b"GRIB")
+
+    expected = list(grib.messages(file))
+    result = list(grib.messages(padded))
+    assert len(result) == 2 * len(expected)
+    for (*_, values), (*_, reference) in zip(result, expected + expected):
+        np.testing.assert_array_equal(values, reference)
+
+
+def test_to_dataframe_matches_netcdf(tmp_path):
+    ds = _dataset(days=5)
+    netcdf = tmp_path / f"{GEOCODE}_20220101_20220105.nc"
+    ds.to_netcdf(netcdf, engine="netcdf4")
+    file = grib.write(tmp_path / f"{GEOCODE}_20220101_20220105.grib", ds)
+
+    expected = extract_reanalysis.to_dataframe(str(netcdf), GEOCODE)
+    result = grib.to_dataframe(file, [int(GEOCODE), 3303302])
+
+    rio = result[result["geocodigo"] == GEOCODE]
+    assert rio.columns.tolist() == expected.columns.tolist()
+    # 24 bits packing of each message, relative to its range of values
+    pd.testing.assert_frame_equal(rio, expected, check_freq=False, rtol=1e-5)
+    niteroi = result[result["geocodigo"] == "3303302"]
+    np.testing.assert_array_equal(niteroi.values[:, 1:], rio.values[:, 1:])
@@ -0,0 +1,56 @@
+"""
+Tests of the relative humidity kernels.
+"""
+
+import numpy as np
+import pytest
+
+from cds_weather import humidity
+
+# recent MetPy releases compute the saturation vapor pressure with Ambaum
+# (2020), the numpy kernel with Bolton (1980). Between -40 and 50 celsius
+# degrees the two formulas differ by up to 0.28 percentage points
+METPY_ATOL = 0.3
+
+
+def _pairs(size: int = 100_000, dtype=np.float64):
+    rng = np.random.default_rng(0)
+    temperature = rng.uniform(-40, 50, size)
+    dewpoint = temperature - rng.uniform(0, 40, size)
+    return temperature.astype(dtype), dewpoint.astype(dtype)
+
+
+def _bolton(temperature, dewpoint):
+    def es(t):
+        return 6.112 * np.exp(17.67 * t / (t + 243.5))
+
+    return 100 * es(dewpoint) / es(temperature)
+
+
+def test_numpy_matches_metpy():
+    pytest.importorskip("metpy")
+    temperature, dewpoint = _pairs()
+    np.testing.assert_allclose(
+        humidity.relative_humidity(temperature, dewpoint, backend="numpy"),
+        humidity.relative_humidity(temperature, dewpoint, backend="metpy"),
+        rtol=0,
+        atol=METPY_ATOL,
+    )
+
+
+def test_float32_matches_float64_reference():
+    temperature, dewpoint = _pairs(dtype=np.float32)
+    rh = humidity.relative_humidity(temperature, dewpoint, backend="numpy")
+
+    assert rh.dtype == np.float32
+    expected = _bolton(temperature.astype(np.float64), dewpoint.astype(np.float64))
+    np.testing.assert_allclose(rh, expected, rtol=0, atol=1e-3)
+
+
+def test_writes_in_place():
+    temperature, dewpoint = _pairs(size=1000, dtype=np.float32)
+    expected = humidity.relative_humidity(temperature, dewpoint)
+
+    out = humidity.relative_humidity(temperature, dewpoint, out=dewpoint)
+    assert out is dewpoint
+    np.testing.assert_array_equal(out, expected)
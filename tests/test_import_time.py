@@ -0,0 +1,21 @@
+"""
+Checks that the modules of `benchmarks/import_time.py` don't import the
+heavy dependencies. The time budget is checked by `make check-imports`,
+the seconds depend on the machine running the tests.
+"""
+
+import importlib.util
+
+from pathlib import Path
+
+import pytest
+
+_SCRIPT = Path(__file__).resolve().parent.parent / "benchmarks" / "import_time.py"
+_spec = importlib.util.spec_from_file_location("import_time", _SCRIPT)
+import_time = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(import_time)
+
+
+@pytest.mark.parametrize("module", import_time.MODULES)
+def test_no_heavy_imports(module):
+    assert import_time.measure(module, repeat=1)["heavy"] == []
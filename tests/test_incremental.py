@@ -0,0 +1,170 @@
+"""
+Tests of the incremental updates from the watermarks.
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cds_weather import extract_reanalysis, incremental, loader
+
+RIO_DE_JANEIRO = 3304557
+NITEROI = 3303302
+SAO_PAULO = 3550308
+
+
+def test_watermarks_from_the_filenames(tmp_path):
+    for name in [
+        f"{RIO_DE_JANEIRO}_20220101_20220110.nc",
+        f"{RIO_DE_JANEIRO}_20220111_20220115.grib",
+        f"{NITEROI}_20211231.nc",
+        "REGION_0_-22.5_-43.5_-23.0_-43.0_20220101_20220201.nc",
+        f"{SAO_PAULO}_20220101_20220110.csv",
+    ]:
+        (tmp_path / name).touch()
+
+    assert incremental.watermarks(data_dir=tmp_path) == {
+        RIO_DE_JANEIRO: "2022-01-15",
+        NITEROI: "2021-12-31",
+    }
+
+
+def test_watermarks_file_keeps_the_latest(tmp_path):
+    (tmp_path / f"{RIO_DE_JANEIRO}_20220101_20220110.nc").touch()
+    incremental._write_marks(tmp_path, {RIO_DE_JANEIRO: "2022-01-05"})
+    incremental._write_marks(tmp_path, {NITEROI: "2022-02-01"})
+    incremental._write_marks(tmp_path, {NITEROI: "2022-01-01"})
+
+    assert incremental._read_marks(tmp_path) == {
+        RIO_DE_JANEIRO: "2022-01-05",
+        NITEROI: "2022-02-01",
+    }
+    assert incremental.watermarks(data_dir=tmp_path) == {
+        RIO_DE_JANEIRO: "2022-01-10",
+        NITEROI: "2022-02-01",
+    }
+
+
+def test_watermarks_from_the_database():
+    conn = sqlite3.connect(":memory:")
+    loader.create_table(conn)
+    assert incremental.watermarks(conn) == dict()
+
+    df = pd.DataFrame(
+        {c: np.ones(3) for c in loader.COLUMNS if c not in loader.KEY},
+        index=pd.date_range("2022-01-01", periods=3, name="date"),
+    )
+    loader.load(df.assign(geocodigo=str(NITEROI)), conn)
+    assert incremental.watermarks(conn) == {NITEROI: "2022-01-03"}
+
+
+def test_gaps_group_the_missing_ranges():
+    marks = {
+        RIO_DE_JANEIRO: "2022-01-10",
+        NITEROI: "2022-01-10",
+        SAO_PAULO: "2022-01-05",
+    }
+    geocodes = [RIO_DE_JANEIRO, NITEROI, SAO_PAULO]
+
+    assert incremental.gaps(geocodes, marks, end="2022-01-12") == {
+        ("2022-01-11", "2022-01-12"): [RIO_DE_JANEIRO, NITEROI],
+        ("2022-01-06", "2022-01-12"): [SAO_PAULO],
+    }
+    # a single missing day
+    assert incremental.gaps(geocodes, marks, end="2022-01-11") == {
+        ("2022-01-11", "2022-01-11"): [RIO_DE_JANEIRO, NITEROI],
+        ("2022-01-06", "2022-01-11"): [SAO_PAULO],
+    }
+
+
+def test_gaps_skip_the_updated_geocodes():
+    marks = {RIO_DE_JANEIRO: "2022-01-10", NITEROI: "2022-01-12"}
+    assert incremental.gaps(marks, marks, end="2022-01-10") == dict()
+    assert incremental.gaps(marks, marks, end="2022-01-11") == {
+        ("2022-01-11", "2022-01-11"): [RIO_DE_JANEIRO]
+    }
+
+
+def test_gaps_without_a_watermark(caplog):
+    marks = {RIO_DE_JANEIRO: "2022-01-10"}
+    geocodes = [RIO_DE_JANEIRO, NITEROI]
+
+    assert incremental.gaps(geocodes, marks, end="2022-01-12") == {
+        ("2022-01-11", "2022-01-12"): [RIO_DE_JANEIRO]
+    }
+    assert "1 geocodes without data" in caplog.text
+    assert incremental.gaps(geocodes, marks, "2022-01-01", "2022-01-12") == {
+        ("2022-01-11", "2022-01-12"): [RIO_DE_JANEIRO],
+        ("2022-01-01", "2022-01-12"): [NITEROI],
+    }
+
+
+def test_gaps_end_at_the_last_update(monkeypatch):
+    monkeypatch.setattr(extract_reanalysis, "last_update", lambda: "2022-01-12")
+    assert incremental.gaps([NITEROI], {NITEROI: "2022-01-10"}) == {
+        ("2022-01-11", "2022-01-12"): [NITEROI]
+    }
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """
+    Records the calls to `download_batch()`, one file per range.
+    """
+    calls = []
+
+    def download_batch(geocodes, past_date, date, data_dir, **kwargs):
+        calls.append((list(geocodes), past_date, date))
+        return {f"{past_date or date}_{date}.nc": list(geocodes)}
+
+    monkeypatch.setattr(extract_reanalysis, "last_update", lambda: "2022-01-12")
+    monkeypatch.setattr(extract_reanalysis, "download_batch", download_batch)
+    return calls
+
+
+def test_update_moves_the_watermarks(tmp_path, downloads):
+    (tmp_path / f"{RIO_DE_JANEIRO}_20220101_20220110.nc").touch()
+    (tmp_path / f"{NITEROI}_20220101_20220111.nc").touch()
+
+    files = incremental.update([RIO_DE_JANEIRO, NITEROI], data_dir=tmp_path)
+    assert downloads == [
+        ([RIO_DE_JANEIRO], "2022-01-11", "2022-01-12"),
+        ([NITEROI], None, "2022-01-12"),
+    ]
+    assert files == {
+        "2022-01-11_2022-01-12.nc": [RIO_DE_JANEIRO],
+        "2022-01-12_2022-01-12.nc": [NITEROI],
+    }
+
+    # nothing is missing on the next update
+    assert incremental.update([RIO_DE_JANEIRO, NITEROI], data_dir=tmp_path) == {}
+    assert len(downloads) == 2
+
+
+def test_update_loads_into_the_database(tmp_path, downloads, monkeypatch):
+    def to_dataframe_batch(files):
+        (name, geocodes), *_ = files.items()
+        first, last = name[: -len(".nc")].split("_")
+        index = pd.date_range(first, last, name="date")
+        df = pd.DataFrame(
+            {c: np.ones(len(index)) for c in loader.COLUMNS if c not in loader.KEY},
+            index=index,
+        )
+        return pd.concat(df.assign(geocodigo=str(g)) for g in geocodes)
+
+    monkeypatch.setattr(extract_reanalysis, "to_dataframe_batch", to_dataframe_batch)
+    conn = sqlite3.connect(":memory:")
+    loader.create_table(conn)
+
+    incremental.update(NITEROI, conn, tmp_path, start="2022-01-01")
+    assert downloads == [([NITEROI], "2022-01-01", "2022-01-12")]
+    assert loader.latest_dates(conn) == {NITEROI: "2022-01-12"}
+    count = conn.execute("SELECT COUNT(*) FROM clima_copernicus").fetchone()
+    assert count == (12,)
+
+    # the marks come from the database, not the directory
+    assert not (tmp_path / incremental.WATERMARKS_FILE).exists()
+    assert incremental.update(NITEROI, conn, tmp_path) == {}
+    assert len(downloads) == 1
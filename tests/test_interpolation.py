@@ -0,0 +1,105 @@
+"""
+Tests of the interpolation of gridded fields to the cities.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cds_weather import extract_latlons, globals, interpolation
+from cds_weather.extract_coordinates import do_area_many
+
+# grid of the state of Rio de Janeiro, [north, west, south, east]
+EXTENT = [-20.5, -45.0, -23.5, -40.75]
+
+
+def _linear(lats, lons):
+    return 2.0 * lats - 3.0 * lons + 10.0
+
+
+def _field(extent=EXTENT, times: int = 2) -> xr.DataArray:
+    north, west, south, east = extent
+    res = globals.GRID_RESOLUTION
+    lats = np.arange(north, south - res / 2, -res)
+    lons = np.arange(west, east + res / 2, res)
+    values = _linear(lats[:, None], lons[None, :])
+    values = values + np.arange(times)[:, None, None]
+    return xr.DataArray(
+        values,
+        dims=["time", "latitude", "longitude"],
+        coords=dict(
+            time=pd.date_range("2022-01-01", periods=times),
+            latitude=lats,
+            longitude=lons,
+        ),
+    )
+
+
+def _cities(geocodes) -> tuple:
+    lats, lons = extract_latlons.from_geocodes(geocodes)
+    return np.asarray(lats), np.asarray(lons)
+
+
+def test_bilinear_is_exact_for_a_linear_field(tmp_path):
+    df = interpolation.interpolate(_field(), "bilinear", cache_dir=tmp_path)
+
+    assert 3304557 in df.columns
+    lats, lons = _cities(df.columns)
+    expected = _linear(lats, lons)
+    np.testing.assert_allclose(df.iloc[0].values, expected, atol=1e-9)
+    np.testing.assert_allclose(df.iloc[1].values, expected + 1, atol=1e-9)
+
+
+def test_mean_is_the_center_of_the_cell(tmp_path):
+    df = interpolation.interpolate(_field(), "mean", cache_dir=tmp_path)
+
+    lats, lons = _cities(df.columns)
+    north, south, east, west = do_area_many(lats, lons)
+    expected = _linear((north + south) / 2, (east + west) / 2)
+    np.testing.assert_allclose(df.iloc[0].values, expected, atol=1e-9)
+
+
+def test_cities_outside_the_extent_are_left_out(tmp_path):
+    df = interpolation.interpolate(_field(), cache_dir=tmp_path)
+
+    lats, lons = _cities(df.columns)
+    north, west, south, east = EXTENT
+    assert ((lats <= north) & (lats >= south)).all()
+    assert ((lons >= west) & (lons <= east)).all()
+    # São Paulo
+    assert 3550308 not in df.columns
+
+
+def test_cache_is_rebuilt_when_municipios_changes(tmp_path, monkeypatch):
+    builds = []
+    build = interpolation._build
+
+    def counted(extent, method):
+        builds.append(extent)
+        return build(extent, method)
+
+    monkeypatch.setattr(interpolation, "_build", counted)
+    interpolation.weight_matrix(EXTENT, cache_dir=tmp_path)
+    interpolation.weight_matrix(EXTENT, cache_dir=tmp_path)
+    assert len(builds) == 1
+
+    municipios = tmp_path / "municipios.json"
+    municipios.write_text("[]")
+    (file,) = tmp_path.glob("weights_*.npz")
+    os.utime(municipios, (file.stat().st_mtime + 1,) * 2)
+    monkeypatch.setattr(extract_latlons, "MUNICIPIOS_JSON", municipios)
+    interpolation.weight_matrix(EXTENT, cache_dir=tmp_path)
+    assert len(builds) == 2
+
+
+def test_dimensions_are_checked_before_building(tmp_path, monkeypatch):
+    def build(extent, method):
+        raise AssertionError("the matrix should not be built")
+
+    monkeypatch.setattr(interpolation, "_build", build)
+    field = _field().expand_dims(level=[1000, 850])
+    with pytest.raises(ValueError, match="dimensions"):
+        interpolation.interpolate(field, cache_dir=tmp_path)
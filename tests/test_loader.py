@@ -0,0 +1,86 @@
+"""
+Tests of the bulk loader, on a SQLite database.
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cds_weather import loader
+
+VALUES = [c for c in loader.COLUMNS if c not in loader.KEY]
+
+
+def _frame(geocode: int, start: str, days: int, value: float = 1.0) -> pd.DataFrame:
+    """
+    DataFrame in the format of `to_dataframe()`.
+    """
+    index = pd.date_range(start, periods=days, name="date")
+    df = pd.DataFrame({c: np.full(days, value) for c in VALUES}, index=index)
+    df.insert(0, "geocodigo", str(geocode))
+    return df
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    loader.create_table(conn)
+    yield conn
+    conn.close()
+
+
+def _select(conn, column: str = "temp_min") -> dict:
+    rows = conn.execute(f"SELECT date, geocode, {column} FROM clima_copernicus")
+    return {(date, geocode): value for date, geocode, value in rows}
+
+
+def test_create_table_twice(conn):
+    loader.create_table(conn)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(clima_copernicus)")]
+    assert columns == loader.COLUMNS
+
+
+def test_load_is_idempotent(conn):
+    df = pd.concat([_frame(3304557, "2022-01-01", 5), _frame(3303302, "2022-01-01", 5)])
+    assert loader.load(df, conn) == 10
+    assert loader.load(df, conn, batch_size=3) == 10
+    assert conn.execute("SELECT COUNT(*) FROM clima_copernicus").fetchone() == (10,)
+
+
+def test_load_updates_the_values(conn):
+    loader.load(_frame(3304557, "2022-01-01", 5, value=1.0), conn)
+    loader.load(_frame(3304557, "2022-01-04", 5, value=2.0), conn)
+
+    values = _select(conn)
+    assert len(values) == 8
+    assert values[("2022-01-03", 3304557)] == 1.0
+    assert values[("2022-01-04", 3304557)] == 2.0
+    assert values[("2022-01-08", 3304557)] == 2.0
+
+
+def test_duplicated_rows_keep_the_last(conn):
+    df = pd.concat(
+        [_frame(3304557, "2022-01-01", 2), _frame(3304557, "2022-01-02", 1, 5)]
+    )
+    assert loader.load(df, conn) == 2
+    assert _select(conn)[("2022-01-02", 3304557)] == 5.0
+
+
+def test_nan_is_stored_as_null(conn):
+    df = _frame(3304557, "2022-01-01", 2)
+    df.loc[df.index[0], "umid_med"] = np.nan
+    loader.load(df, conn)
+
+    values = _select(conn, "umid_med")
+    assert values[("2022-01-01", 3304557)] is None
+    assert values[("2022-01-02", 3304557)] == 1.0
+
+
+def test_latest_dates(conn):
+    assert loader.latest_dates(conn) == dict()
+    loader.load(_frame(3304557, "2022-01-01", 10), conn)
+    loader.load(_frame(3303302, "2021-12-01", 3), conn)
+
+    assert loader.latest_dates(conn) == {3304557: "2022-01-10", 3303302: "2021-12-03"}
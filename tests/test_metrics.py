@@ -0,0 +1,123 @@
+"""
+Tests of the stage timings and their exporters.
+"""
+
+import json
+
+import pytest
+
+from cds_weather import metrics
+
+
+@pytest.fixture(autouse=True)
+def hooks(monkeypatch):
+    monkeypatch.setattr(metrics, "_hooks", [])
+
+
+def test_timer_without_hooks_is_a_no_op():
+    assert not metrics.enabled()
+    with metrics.timer("download", dataset="era5") as m:
+        m["bytes"] = 10
+    assert metrics.timer("download") is metrics._NULL
+    assert dict(metrics._NULL) == dict()
+
+
+def test_add_and_remove_hook():
+    events = []
+    metrics.add_hook(events.append)
+    assert metrics.enabled()
+
+    with metrics.timer("download", dataset="era5") as m:
+        m["bytes"] = 10
+    metrics.remove_hook(events.append)
+    metrics.remove_hook(events.append)
+    with metrics.timer("download"):
+        pass
+
+    assert not metrics.enabled()
+    (event,) = events
+    assert event["stage"] == "download"
+    assert event["dataset"] == "era5"
+    assert event["bytes"] == 10
+    assert event["seconds"] >= 0
+    assert "error" not in event
+
+
+def test_timer_records_the_error():
+    events = []
+    metrics.add_hook(events.append)
+
+    with pytest.raises(KeyError):
+        with metrics.timer("lookup"):
+            raise KeyError(1)
+    assert events[0]["error"] == "KeyError"
+
+
+def test_failed_hook_is_logged(caplog):
+    events = []
+
+    def failed(event):
+        raise RuntimeError("full disk")
+
+    metrics.add_hook(failed)
+    metrics.add_hook(events.append)
+    metrics.emit("connect", 0.5)
+
+    assert "full disk" in caplog.text
+    assert events[0]["seconds"] == 0.5
+
+
+def test_json_lines_exporter(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    metrics.add_hook(metrics.JsonLinesExporter(path))
+    metrics.emit("download", 2.0, start=100.0, bytes=1024, target=tmp_path)
+    metrics.emit("connect", 0.5, start=98.0)
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines == [
+        dict(
+            stage="download", start=100.0, seconds=2.0, bytes=1024, target=str(tmp_path)
+        ),
+        dict(stage="connect", start=98.0, seconds=0.5),
+    ]
+
+
+def test_prometheus_exporter(tmp_path):
+    exporter = metrics.PrometheusExporter()
+    metrics.add_hook(exporter)
+    metrics.emit("download", 2.0, bytes=1024, attempt=1, throughput=512.0)
+    metrics.emit("download", 3.0, bytes=1024, attempt=2, cached=True)
+    metrics.emit("connect", 0.5, dataset="era5")
+
+    assert exporter.text() == (
+        "# TYPE adclima_stage_bytes_total counter\n"
+        'adclima_stage_bytes_total{stage="download"} 2048\n'
+        "# TYPE adclima_stage_calls_total counter\n"
+        'adclima_stage_calls_total{stage="connect"} 1\n'
+        'adclima_stage_calls_total{stage="download"} 2\n'
+        "# TYPE adclima_stage_seconds_total counter\n"
+        'adclima_stage_seconds_total{stage="connect"} 0.5\n'
+        'adclima_stage_seconds_total{stage="download"} 5.0\n'
+    )
+    path = tmp_path / "adclima.prom"
+    exporter.write(path)
+    assert path.read_text() == exporter.text()
+    assert not (tmp_path / "adclima.prom.part").exists()
+
+
+def test_download_fields():
+    states = metrics.track_states()
+    metrics.cdsapi_info("Request is queued")
+    metrics.cdsapi_info("Request is running")
+    metrics.cdsapi_info("Request is completed")
+    assert list(states) == ["queued", "running", "completed"]
+
+    states.update(queued=1.0, running=4.0, completed=10.0)
+    fields = metrics.download_fields(states, 0.0, 12.0, 1000)
+    assert fields == dict(
+        bytes=1000, queued=3.0, running=6.0, transfer=2.0, throughput=500.0
+    )
+    # the states of a client that doesn't report them
+    assert metrics.download_fields(dict(), 0.0, 4.0, 1000) == dict(
+        bytes=1000, transfer=4.0, throughput=250.0
+    )
@@ -0,0 +1,183 @@
+"""
+Tests of the local mock of the Copernicus API.
+"""
+
+import os
+import time
+
+import cdsapi
+import numpy as np
+import pytest
+import requests
+import xarray as xr
+
+from cds_weather import grib, mock_cds, planner
+
+AREA = [-22.5, -43.5, -23.0, -43.0]
+AUTH = tuple(mock_cds.KEY.split(":"))
+
+
+def _request(format: str = "netcdf") -> dict:
+    (request,) = planner.plan("2022-01-01", "2022-01-02", AREA, format=format)
+    return request
+
+
+@pytest.fixture
+def start():
+    """
+    Starts servers with the options given, stopped after the test.
+    """
+    servers = []
+
+    def start(**options):
+        servers.append(mock_cds.start(**options))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def _client(server, **options) -> cdsapi.Client:
+    options = dict(
+        url=server.url,
+        key=mock_cds.KEY,
+        quiet=True,
+        progress=False,
+        sleep_max=0.1,
+        retry_max=3,
+        **options,
+    )
+    return cdsapi.Client(**options)
+
+
+def _submit(server, request: dict) -> requests.Response:
+    return requests.post(
+        f"{server.url}/resources/{mock_cds.DATASET}", json=request, auth=AUTH
+    )
+
+
+def test_retrieve_netcdf(start, tmp_path):
+    server = start()
+    target = tmp_path / "era5.nc"
+    _client(server).retrieve(mock_cds.DATASET, _request(), str(target))
+
+    with xr.open_dataset(target, engine="netcdf4") as ds:
+        assert sorted(ds.data_vars) == ["d2m", "msl", "t2m", "tp"]
+        assert ds.time.size == 16
+        assert ds.latitude.values.tolist() == [-22.5, -22.75, -23.0]
+        assert ds.longitude.values.tolist() == [-43.5, -43.25, -43.0]
+    assert server.stats["submit"] == 1
+    assert server.stats["download"] == 1
+    assert server.stats["bytes"] == os.path.getsize(target)
+
+
+def test_retrieve_grib(start, tmp_path):
+    server = start()
+    target = tmp_path / "era5.grib"
+    _client(server).retrieve(mock_cds.DATASET, _request("grib"), str(target))
+
+    messages = list(grib.messages(str(target)))
+    assert len(messages) == 16 * len(grib.PARAM_IDS)
+    _, _, lats, lons, values = messages[0]
+    assert values.shape == (3, 3)
+    np.testing.assert_allclose(lons, [-43.5, -43.25, -43.0])
+
+
+def test_invalid_requests(start):
+    server = start()
+
+    assert requests.get(f"{server.url}/status.json").status_code == 200
+    assert _submit(server, dict(variable=[])).status_code == 400
+    assert _submit(server, dict(_request(), format="zarr")).status_code == 400
+    unknown = f"{server.url}/resources/reanalysis-era5-land"
+    assert requests.post(unknown, json=_request(), auth=AUTH).status_code == 404
+    unauthorized = f"{server.url}/resources/{mock_cds.DATASET}"
+    assert requests.post(unauthorized, json=_request()).status_code == 401
+    assert requests.get(f"{server.url}/tasks/missing", auth=AUTH).status_code == 404
+
+    with pytest.raises(ValueError, match="queue_size"):
+        mock_cds.start(queue_size=2)
+
+
+def test_job_states(start):
+    server = start(max_running=1, run_time=0.3)
+
+    first = _submit(server, _request())
+    second = _submit(server, _request())
+    assert first.status_code == second.status_code == 202
+    assert first.json()["state"] == "running"
+    assert second.json()["state"] == "queued"
+
+    rid = second.json()["request_id"]
+    time.sleep(0.65)
+    task = requests.get(f"{server.url}/tasks/{rid}", auth=AUTH).json()
+    assert task["state"] == "completed"
+    assert task["location"].endswith(".nc")
+
+    requests.delete(f"{server.url}/tasks/{rid}", auth=AUTH)
+    assert requests.get(f"{server.url}/tasks/{rid}", auth=AUTH).status_code == 404
+    assert len(os.listdir(server.data_dir)) == 0
+
+
+def test_failed_jobs(start, tmp_path):
+    server = start(failure_rate=1.0)
+
+    with pytest.raises(Exception, match="Temporarily unable"):
+        _client(server).retrieve(
+            mock_cds.DATASET, _request(), str(tmp_path / "era5.nc")
+        )
+    assert server.stats["failed"] == 1
+
+
+def test_rate_limit(start):
+    # jobs still running, no file is written in the second of the limit
+    server = start(rate_limit=2, run_time=60)
+
+    codes = [_submit(server, _request()).status_code for _ in range(3)]
+    assert codes == [202, 202, 429]
+    assert server.stats["rate_limited"] == 1
+    time.sleep(1.05)
+    assert _submit(server, _request()).status_code == 202
+
+
+def test_unavailable(start, tmp_path):
+    server = start(error_rate=1.0)
+
+    assert requests.get(f"{server.url}/status.json").status_code == 200
+    assert _submit(server, _request()).status_code == 503
+    # the client retries the 503 answers `retry_max` times
+    with pytest.raises(Exception, match="Could not connect"):
+        _client(server).retrieve(
+            mock_cds.DATASET, _request(), str(tmp_path / "era5.nc")
+        )
+    assert server.stats["errors"] == 1 + 3
+
+
+def test_dropped_downloads_can_be_resumed(start):
+    server = start(drop_rate=1.0)
+    reply = _submit(server, _request()).json()
+    url = server.url.replace(mock_cds.API_PATH, "") + reply["location"]
+    size = reply["content_length"]
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        requests.get(url, auth=AUTH).content
+    assert server.stats["dropped"] == 1
+    assert server.stats["bytes"] == size // 2
+
+    server.options["drop_rate"] = 0.0
+    whole = requests.get(url, auth=AUTH)
+    rest = requests.get(url, auth=AUTH, headers=dict(Range=f"bytes={size // 2}-"))
+    assert rest.status_code == 206
+    assert rest.headers["Content-Range"] == f"bytes {size // 2}-{size - 1}/{size}"
+    assert rest.content == whole.content[size // 2 :]
+
+
+def test_bandwidth(start):
+    server = start(bandwidth=1e5)
+    reply = _submit(server, _request()).json()
+    url = server.url.replace(mock_cds.API_PATH, "") + reply["location"]
+
+    begin = time.perf_counter()
+    data = requests.get(url, auth=AUTH).content
+    assert time.perf_counter() - begin >= len(data) / 1e5 * 0.9
@@ -0,0 +1,157 @@
+"""
+Tests of the streaming download, parse and load pipeline.
+"""
+
+import time
+import threading
+
+import pytest
+
+from cds_weather import extract_reanalysis, pipeline
+
+
+def _run(items, download=None, parse=None, load=None, **kwargs) -> dict:
+    results = pipeline.run(
+        items,
+        download or (lambda item: item),
+        parse or (lambda value: value * 10),
+        load,
+        **kwargs,
+    )
+    return {item: (result, error) for item, result, error in results}
+
+
+def test_every_item_goes_through_the_stages():
+    loaded = []
+
+    def load(value):
+        loaded.append(value)
+        return value + 1
+
+    results = _run(range(20), load=load, download_workers=4, parse_workers=2)
+
+    assert results == {i: (i * 10 + 1, None) for i in range(20)}
+    assert sorted(loaded) == [i * 10 for i in range(20)]
+
+
+def test_without_load_the_parsed_values_are_yielded():
+    assert _run([1, 2]) == {1: (10, None), 2: (20, None)}
+    assert _run([]) == dict()
+
+
+@pytest.mark.parametrize("stage", ["download", "parse", "load"])
+def test_errors_are_passed_with_their_item(stage):
+    calls = dict(download=[], parse=[], load=[])
+
+    def counted(name, func):
+        def call(value):
+            calls[name].append(value)
+            if name == stage and value in (3, 30):
+                raise ValueError(f"{name} of {value}")
+            return func(value)
+
+        return call
+
+    results = _run(
+        range(5),
+        counted("download", lambda item: item),
+        counted("parse", lambda value: value * 10),
+        counted("load", lambda value: value),
+        download_workers=2,
+    )
+
+    result, error = results.pop(3)
+    assert result is None
+    assert isinstance(error, ValueError)
+    assert str(error) == f"{stage} of {30 if stage == 'load' else 3}"
+    assert results == {i: (i * 10, None) for i in [0, 1, 2, 4]}
+    # the stages after the failure are skipped
+    assert len(calls["load"]) == (5 if stage == "load" else 4)
+
+
+def test_failed_input_stops_the_stages():
+    def items():
+        yield 1
+        raise OSError("manifest removed")
+
+    assert _run(items()) == {1: (10, None)}
+
+
+def test_load_runs_in_a_single_thread():
+    running = []
+    overlapped = []
+
+    def load(value):
+        running.append(value)
+        if len(running) > 1:
+            overlapped.append(value)
+        time.sleep(0.005)
+        running.remove(value)
+        return value
+
+    _run(range(20), load=load, download_workers=8, parse_workers=4)
+    assert overlapped == []
+
+
+def test_break_cancels_the_items_not_started():
+    downloaded = []
+    release = threading.Event()
+
+    def download(item):
+        downloaded.append(item)
+        if item > 0:
+            release.wait(5)
+        return item
+
+    results = pipeline.run(range(100), download, lambda v: v, download_workers=2)
+    item, value, error = next(results)
+    assert (item, value, error) == (0, 0, None)
+
+    release.set()
+    results.close()
+    # the items already taken by the workers finish, the others are skipped
+    assert len(downloaded) < 10
+    started = len(downloaded)
+    time.sleep(0.05)
+    assert len(downloaded) == started
+
+
+def test_cancelled_items_are_not_parsed():
+    parsed = []
+    first = threading.Event()
+
+    def download(item):
+        if item > 0:
+            first.wait(5)
+        return item
+
+    def parse(value):
+        parsed.append(value)
+        return value
+
+    results = pipeline.run(range(10), download, parse, download_workers=4)
+    assert next(results)[0] == 0
+    # the downloads waiting on `first` finish after the cancellation
+    threading.Timer(0.05, first.set).start()
+    results.close()
+    assert parsed == [0]
+
+
+def test_stream_skips_the_failed_regions(monkeypatch, caplog):
+    def download_batch(geocodes, **kwargs):
+        if 3304557 in geocodes:
+            return dict()
+        return {"file": list(geocodes)}
+
+    monkeypatch.setattr(extract_reanalysis, "download_batch", download_batch)
+    monkeypatch.setattr(
+        extract_reanalysis, "to_dataframe_batch", lambda files: files["file"]
+    )
+
+    frames = list(
+        pipeline.stream(
+            [3304557, 3550308, 5300108], date="2022-01-01", max_region_size=1.0
+        )
+    )
+    assert sorted(g for frame in frames for g in frame) == [3550308, 5300108]
+    assert "Region failed: download failed" in caplog.text
@@ -0,0 +1,61 @@
+"""
+Tests of the grouping of cities into regions.
+"""
+
+import pytest
+
+from cds_weather import extract_latlons, regions, spatial
+
+RIO_DE_JANEIRO = 3304557
+NITEROI = 3303302
+
+
+def test_select():
+    assert regions.select("all") == extract_latlons.geocodes()
+    assert regions.select(33) == extract_latlons.geocodes(uf=33)
+    assert regions.select("33") == extract_latlons.geocodes(uf=33)
+    assert regions.select(RIO_DE_JANEIRO) == [RIO_DE_JANEIRO]
+    assert regions.select([str(NITEROI), RIO_DE_JANEIRO, NITEROI]) == [
+        NITEROI,
+        RIO_DE_JANEIRO,
+    ]
+
+
+def _covers(box: list, area: tuple) -> bool:
+    north, west, south, east = box
+    n, s, e, w = area
+    return n <= north and s >= south and w >= west and e <= east
+
+
+@pytest.mark.parametrize("max_size", [1.0, regions.MAX_REGION_SIZE, 100.0])
+def test_bounding_boxes_cover_every_city(max_size):
+    geocodes = extract_latlons.geocodes()
+    boxes = regions.bounding_boxes(geocodes, max_size)
+
+    in_boxes = [g for _, in_box in boxes for g in in_box]
+    assert sorted(in_boxes) == sorted(geocodes)
+    for box, in_box in boxes:
+        north, west, south, east = box
+        # a box is only larger than the maximum when it has a single cell
+        cells = {spatial.cell(g) for g in in_box}
+        assert len(cells) == 1 or (
+            north - south <= max_size and east - west <= max_size
+        )
+        assert all(_covers(box, cell) for cell in cells)
+
+
+def test_bounding_boxes_keep_cells_together():
+    # Rio de Janeiro and Niterói share a cell
+    assert spatial.cell(RIO_DE_JANEIRO) == spatial.cell(NITEROI)
+    boxes = regions.bounding_boxes(extract_latlons.geocodes(uf=33), max_size=0.5)
+
+    (in_box,) = [in_box for _, in_box in boxes if RIO_DE_JANEIRO in in_box]
+    assert NITEROI in in_box
+
+
+def test_bounding_boxes_of_a_single_cell():
+    north, south, east, west = spatial.cell(RIO_DE_JANEIRO)
+    assert regions.bounding_boxes([RIO_DE_JANEIRO, NITEROI]) == [
+        ([north, west, south, east], [RIO_DE_JANEIRO, NITEROI])
+    ]
+    assert regions.bounding_boxes([]) == []
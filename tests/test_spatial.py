@@ -0,0 +1,98 @@
+"""
+Tests of the spatial index of the cities by grid cell.
+"""
+
+import pytest
+
+from cds_weather import extract_latlons, spatial
+from cds_weather.extract_coordinates import do_area
+
+RIO_DE_JANEIRO = 3304557
+NITEROI = 3303302
+SAO_PAULO = 3550308
+
+
+def test_index_holds_every_city_once():
+    index = spatial.index()
+    geocodes = [g for in_cell in index.values() for g in in_cell]
+
+    assert sorted(geocodes) == sorted(extract_latlons.geocodes())
+    assert len(index) < len(geocodes)
+
+
+@pytest.mark.parametrize("geocode", [RIO_DE_JANEIRO, NITEROI, SAO_PAULO, 5300108])
+def test_cell_is_the_do_area(geocode):
+    lat, lon = extract_latlons.from_geocode(geocode)
+    cell = spatial.cell(geocode)
+
+    assert cell == tuple(float(c) for c in do_area(lat, lon))
+    assert spatial.cell(str(geocode)) == cell
+    assert geocode in spatial.index()[cell]
+
+
+def test_cell_of_an_unknown_geocode():
+    with pytest.raises(KeyError):
+        spatial.cell(1234567)
+
+
+def test_groups(caplog):
+    groups = spatial.groups([SAO_PAULO, str(NITEROI), 1234567, RIO_DE_JANEIRO])
+
+    assert groups == {
+        spatial.cell(SAO_PAULO): [SAO_PAULO],
+        spatial.cell(RIO_DE_JANEIRO): [NITEROI, RIO_DE_JANEIRO],
+    }
+    assert list(groups) == [spatial.cell(SAO_PAULO), spatial.cell(RIO_DE_JANEIRO)]
+    assert "Geocode 1234567 not found" in caplog.text
+    assert spatial.groups([]) == dict()
+
+
+def test_at_point():
+    lat, lon = extract_latlons.from_geocode(RIO_DE_JANEIRO)
+    assert spatial.at_point(lat, lon) == spatial.index()[spatial.cell(RIO_DE_JANEIRO)]
+
+    # every point of the cell has the same cities
+    north, south, east, west = spatial.cell(RIO_DE_JANEIRO)
+    inner = spatial.at_point(north - 0.01, west + 0.01)
+    assert sorted(inner) == sorted(spatial.at_point(lat, lon))
+    # in the Atlantic
+    assert spatial.at_point(-25.0, -35.0) == []
+
+
+def test_in_bbox():
+    table = extract_latlons.table()
+    lats, lons = table["latitude"], table["longitude"]
+    box = [-22.0, -44.0, -23.5, -42.5]
+    north, west, south, east = box
+
+    geocodes = spatial.in_bbox(*box)
+    assert RIO_DE_JANEIRO in geocodes and NITEROI in geocodes
+    assert SAO_PAULO not in geocodes
+    for geocode in geocodes:
+        lat, lon = extract_latlons.from_geocode(geocode)
+        assert south <= lat <= north and west <= lon <= east
+    inside = (lats <= north) & (lats >= south) & (lons >= west) & (lons <= east)
+    assert len(geocodes) == inside.sum()
+
+
+def test_in_bbox_of_cells():
+    box = [-22.1, -44.1, -23.4, -42.6]
+    north, west, south, east = box
+
+    geocodes = spatial.in_bbox(*box, cells=True)
+    assert geocodes == sorted(geocodes)
+    for geocode in geocodes:
+        n, s, e, w = spatial.cell(geocode)
+        assert n <= north and s >= south and w >= west and e <= east
+    # cities near the limits are inside the box, but their cells aren't
+    assert set(geocodes) < set(spatial.in_bbox(*box))
+    # a box on the grid lines has the cells of the cities inside it
+    grid = [-22.0, -44.0, -23.5, -42.5]
+    assert spatial.in_bbox(*grid, cells=True) == sorted(spatial.in_bbox(*grid))
+
+    # the box of a single cell, with the float32 coordinates of a file
+    n, s, e, w = (float(c) for c in spatial.cell(RIO_DE_JANEIRO))
+    area = [n - 1e-6, w + 1e-6, s + 1e-6, e - 1e-6]
+    assert spatial.in_bbox(*area, cells=True) == sorted(
+        spatial.index()[spatial.cell(RIO_DE_JANEIRO)]
+    )
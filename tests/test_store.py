@@ -0,0 +1,129 @@
+"""
+Tests of the Parquet store of the daily data.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cds_weather import store
+
+RIO_DE_JANEIRO = 3304557
+NITEROI = 3303302
+SAO_PAULO = 3550308
+
+
+def _frame(geocode: int, start: str, days: int, value: float = 1.0) -> pd.DataFrame:
+    """
+    DataFrame in the format of `to_dataframe()`.
+    """
+    index = pd.date_range(start, periods=days, name="date")
+    df = pd.DataFrame({c: np.full(days, value) for c in store.VALUES}, index=index)
+    df.insert(0, "geocodigo", str(geocode))
+    return df
+
+
+def _files(root) -> list:
+    return sorted(str(f.relative_to(root)) for f in root.rglob("*.parquet"))
+
+
+def test_write_and_query(tmp_path):
+    df = pd.concat(
+        [
+            _frame(RIO_DE_JANEIRO, "2021-12-30", 5, 1.0),
+            _frame(NITEROI, "2021-12-30", 5, 2.0),
+            _frame(SAO_PAULO, "2021-12-30", 5, 3.0),
+        ]
+    )
+    assert store.write(df, tmp_path) == 15
+
+    assert [f.split("/part")[0] for f in _files(tmp_path)] == [
+        "codigo_uf=33/year=2021",
+        "codigo_uf=33/year=2022",
+        "codigo_uf=35/year=2021",
+        "codigo_uf=35/year=2022",
+    ]
+    stored = store.query(root=tmp_path)
+    assert len(stored) == 15
+    assert (
+        stored["geocode"].tolist()
+        == [NITEROI] * 5 + [RIO_DE_JANEIRO] * 5 + [SAO_PAULO] * 5
+    )
+    assert stored.dtypes["temp_min"] == np.float32
+
+
+def test_query_filters(tmp_path):
+    store.write(
+        pd.concat(
+            [
+                _frame(RIO_DE_JANEIRO, "2021-12-30", 5, 1.0),
+                _frame(SAO_PAULO, "2021-12-30", 5, 3.0),
+            ]
+        ),
+        tmp_path,
+    )
+
+    rio = store.query([RIO_DE_JANEIRO], root=tmp_path)
+    assert set(rio["geocode"]) == {RIO_DE_JANEIRO}
+    assert set(store.query(uf=35, root=tmp_path)["geocode"]) == {SAO_PAULO}
+
+    days = store.query(start="2021-12-31", end="2022-01-02", root=tmp_path)
+    assert len(days) == 6
+    assert str(days["date"].min()) == "2021-12-31"
+    assert str(days["date"].max()) == "2022-01-02"
+
+    columns = store.query(columns=["umid_med"], root=tmp_path)
+    assert columns.columns.tolist() == ["date", "geocode", "umid_med"]
+
+
+def test_query_without_a_store(tmp_path):
+    df = store.query(root=tmp_path / "missing")
+    assert df.empty
+    assert df.columns.tolist() == ["date", "geocode"] + store.VALUES
+
+
+def test_write_replaces_the_stored_rows(tmp_path):
+    store.write(_frame(RIO_DE_JANEIRO, "2022-01-01", 10, 1.0), tmp_path)
+    store.write(_frame(NITEROI, "2022-01-01", 10, 1.0), tmp_path)
+    assert store.write(_frame(RIO_DE_JANEIRO, "2022-01-06", 10, 2.0), tmp_path) == 10
+
+    rio = store.query([RIO_DE_JANEIRO], root=tmp_path)
+    assert len(rio) == 15
+    assert rio["temp_max"].tolist() == [1.0] * 5 + [2.0] * 10
+    assert len(store.query([NITEROI], root=tmp_path)) == 10
+    # a single file per partition, no leftovers of the temporary ones
+    assert len(_files(tmp_path)) == 1
+    assert [f.name for f in tmp_path.iterdir()] == ["codigo_uf=33"]
+
+
+def test_write_counts_the_rows_stored(tmp_path):
+    df = pd.concat(
+        [
+            _frame(RIO_DE_JANEIRO, "2022-01-01", 3),
+            _frame(RIO_DE_JANEIRO, "2022-01-03", 1),
+        ]
+    )
+    assert store.write(df, tmp_path) == 3
+    assert store.write(df.iloc[:0], tmp_path) == 0
+    assert len(store.query(root=tmp_path)) == 3
+
+
+def test_failed_write_keeps_the_stored_rows(tmp_path, monkeypatch):
+    store.write(_frame(RIO_DE_JANEIRO, "2022-01-01", 5, 1.0), tmp_path)
+
+    write_dataset = store.pds.write_dataset
+
+    def interrupted(*args, **kwargs):
+        def visitor(written):
+            raise KeyboardInterrupt
+
+        write_dataset(*args, file_visitor=visitor, **kwargs)
+
+    # interrupted once the first file is written
+    monkeypatch.setattr(store.pds, "write_dataset", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        store.write(_frame(RIO_DE_JANEIRO, "2022-01-03", 5, 2.0), tmp_path)
+
+    rio = store.query(root=tmp_path)
+    assert rio["temp_max"].tolist() == [1.0] * 5
+    assert [f.name for f in tmp_path.iterdir()] == ["codigo_uf=33"]